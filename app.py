@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file, make_response
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file, make_response, g, Response, stream_with_context, has_request_context, before_render_template, template_rendered
 import sqlite3
 import hashlib
 from functools import wraps
@@ -7,21 +7,552 @@ import io
 import csv
 from datetime import datetime
 import json
+import math
 from fpdf import FPDF  # Using fpdf2 instead of pdfkit
-from collections import defaultdict
+import numpy as np
+from collections import defaultdict, OrderedDict, deque
+from itertools import accumulate, chain, islice
 import os
+import re
+import sys
+import time
+import bisect
+import queue
+import tempfile
+import threading
+import uuid
+import zipfile
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this-in-production'
+app.config.setdefault('DATABASE', 'school.db')
+app.config.setdefault('DB_POOL_SIZE', 8)
+app.config.setdefault('METRICS_ENABLED', True)
+app.config.setdefault('SLOW_QUERY_SECONDS', None)  # log statements slower than this, when set
+app.config.setdefault('METRICS_DIR', None)  # directory where worker processes publish their metrics
+
+# SQLite tuning applied once to every new connection
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),      # ~16 MB page cache per connection
+    ('mmap_size', 268435456),    # 256 MB memory-mapped reads
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),
+)
+
+# Histogram buckets for durations (seconds) and for per-request counts
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+class Metrics:
+    """Thread-safe registry of labelled counters and histograms for this process.
+
+    Metrics are declared once with their label names; render() writes every series
+    in the Prometheus text exposition format. Each gunicorn worker keeps its own and
+    publishes them to a shared directory, where collect() adds up every worker's
+    series so a scrape reports totals whichever worker answers it.
+    """
+
+    def __init__(self):
+        self._declared = {}
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text, labels=()):
+        self._declared[name] = ('counter', help_text, labels, None)
+        self._series[name] = {}
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self._declared[name] = ('histogram', help_text, labels, buckets)
+        self._series[name] = {}
+
+    def inc(self, name, labels=(), amount=1):
+        series = self._series[name]
+        with self._lock:
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = self._declared[name][3]
+        series = self._series[name]
+        with self._lock:
+            counts = series.get(labels)
+            if counts is None:
+                # One count per bucket, one for +Inf, then the sum
+                counts = series[labels] = [0] * (len(buckets) + 1) + [0]
+            counts[bisect.bisect_left(buckets, value)] += 1
+            counts[-1] += value
+
+    def clear(self):
+        with self._lock:
+            for series in self._series.values():
+                series.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {name: {labels: list(value) if isinstance(value, list) else value
+                           for labels, value in series.items()}
+                    for name, series in self._series.items()}
+
+    # Write this process's series to <directory>/metrics-<worker>.json, replaced atomically
+    # so that readers never see a partial file
+    def publish(self, directory, worker=None):
+        worker = os.getpid() if worker is None else worker
+        data = {name: [[list(labels), value] for labels, value in series.items()]
+                for name, series in self.snapshot().items()}
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-', suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, os.path.join(directory, f'metrics-{worker}.json'))
+
+    # This process's series plus those the other workers published to directory: counters
+    # and histogram buckets are summed. Files of exited workers are kept, so totals do not
+    # go backwards when gunicorn replaces a worker.
+    def collect(self, directory, worker=None):
+        worker = os.getpid() if worker is None else worker
+        merged = self.snapshot()
+        for entry in os.scandir(directory):
+            if not re.fullmatch(r'metrics-.+\.json', entry.name) or entry.name == f'metrics-{worker}.json':
+                continue
+            try:
+                with open(entry.path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue  # removed since the directory was listed
+            for name, series in data.items():
+                if name not in merged:
+                    continue
+                target = merged[name]
+                for labels, value in series:
+                    labels = tuple(labels)
+                    current = target.get(labels)
+                    if current is None:
+                        target[labels] = value
+                    elif isinstance(current, list):
+                        target[labels] = [a + b for a, b in zip(current, value)]
+                    else:
+                        target[labels] = current + value
+        return merged
+
+    # Exposition text for a snapshot (by default this process's own series)
+    def render(self, snapshot=None):
+        if snapshot is None:
+            snapshot = self.snapshot()
+        
+        lines = []
+        for name, (kind, help_text, label_names, buckets) in self._declared.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(snapshot[name].items()):
+                pairs = list(zip(label_names, labels))
+                if kind == 'counter':
+                    lines.append(f'{name}{format_labels(pairs)} {value}')
+                    continue
+                for bound, total in zip((*buckets, '+Inf'), accumulate(value[:-1])):
+                    lines.append(f"{name}_bucket{format_labels(pairs + [('le', bound)])} {total}")
+                lines.append(f'{name}_sum{format_labels(pairs)} {value[-1]}')
+                lines.append(f'{name}_count{format_labels(pairs)} {sum(value[:-1])}')
+        return '\n'.join(lines) + '\n'
+
+# Render {name="value",...}, escaping label values as the exposition format requires
+def format_labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+metrics = Metrics()
+metrics.histogram('http_request_duration_seconds', 'Time spent handling a request, streaming included',
+                  ('endpoint', 'method', 'status'))
+metrics.histogram('http_request_sql_statements', 'SQL statements run by the request thread per request',
+                  ('endpoint',), COUNT_BUCKETS)
+metrics.histogram('http_request_sql_seconds', 'Time spent executing SQL and fetching rows per request',
+                  ('endpoint',))
+metrics.counter('http_request_sql_rows_total', 'Rows fetched by requests', ('endpoint',))
+metrics.histogram('sql_query_duration_seconds', 'Time per statement, from execute to its last fetch',
+                  ('query',))
+metrics.counter('sql_query_rows_total', 'Rows fetched per query', ('query',))
+metrics.histogram('template_render_seconds', 'Time spent rendering a template', ('template',))
+
+METRICS_PUBLISH_INTERVAL = 5  # seconds between a worker's snapshots in METRICS_DIR
+_metrics_published = 0.0
+
+# Publish this worker's metrics to METRICS_DIR, when set, at most every METRICS_PUBLISH_INTERVAL
+# seconds unless forced (as when the worker exits)
+def publish_metrics(force=False):
+    global _metrics_published
+    directory = app.config.get('METRICS_DIR')
+    now = time.monotonic()
+    if directory and (force or now - _metrics_published >= METRICS_PUBLISH_INTERVAL):
+        _metrics_published = now
+        metrics.publish(directory)
+
+# Empty (creating it if needed) a METRICS_DIR before the workers of a new server start
+def reset_metrics_dir(directory):
+    os.makedirs(directory, exist_ok=True)
+    for entry in os.scandir(directory):
+        if entry.name.startswith(('metrics-', '.metrics-')):
+            os.remove(entry.path)
+
+CURSOR_ITER_BATCH = 256
+
+# SQL activity of the current thread, reset at the start of each request
+class SQLActivity(threading.local):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.statements = 0
+        self.seconds = 0.0
+        self.rows = 0
+
+sql_activity = SQLActivity()
+
+_named_queries = None
+_query_names = {}  # statement text -> constant name (or None), bounded below
+QUERY_NAME_CACHE_SIZE = 4096
+
+# Name a statement after the *_QUERY / *_SQL constant it starts with (format placeholders
+# aside), falling back to the function that ran it, e.g. 'export_query' or 'admin_dashboard'
+def query_name(sql, caller):
+    global _named_queries
+    try:
+        name = _query_names[sql]
+    except KeyError:
+        if _named_queries is None:
+            _named_queries = sorted(
+                ((value.split('{', 1)[0], name.lower()) for name, value in list(globals().items())
+                 if name.endswith(('_QUERY', '_SQL')) and isinstance(value, str)),
+                key=lambda item: -len(item[0]))
+        name = next((name for prefix, name in _named_queries if sql.startswith(prefix)), None)
+        if len(_query_names) < QUERY_NAME_CACHE_SIZE:
+            _query_names[sql] = name
+    return name or caller.f_code.co_name
+
+# Account one finished statement, logging it when it is slower than SLOW_QUERY_SECONDS
+def record_query(name, sql, seconds, rows):
+    metrics.observe('sql_query_duration_seconds', (name,), seconds)
+    if rows:
+        metrics.inc('sql_query_rows_total', (name,), rows)
+    sql_activity.statements += 1
+    sql_activity.seconds += seconds
+    sql_activity.rows += rows
+    
+    threshold = app.config.get('SLOW_QUERY_SECONDS')
+    if threshold is not None and seconds >= threshold:
+        source = request.endpoint if has_request_context() else threading.current_thread().name
+        app.logger.warning('Slow query %s in %s: %.3fs, %d rows: %s',
+                           name, source, seconds, rows, ' '.join(sql.split()))
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times each statement from execute() through its last fetch and
+    counts the rows fetched. A statement is recorded once it is finished: exhausted,
+    replaced by the next execute(), or its cursor closed or garbage collected.
+    """
+
+    _statement = None
+    _elapsed = 0.0
+    _rows = 0
+
+    def _begin(self, sql, caller):
+        self._finish()
+        self._statement = sql
+        self._query = query_name(sql, caller)
+        self._elapsed = 0.0
+        self._rows = 0
+
+    def _finish(self):
+        if self._statement is not None:
+            sql, self._statement = self._statement, None
+            record_query(self._query, sql, self._elapsed, self._rows)
+
+    def execute(self, sql, parameters=(), caller=None):
+        self._begin(sql, caller or sys._getframe(1))
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._elapsed += time.perf_counter() - start
+
+    def executemany(self, sql, seq_of_parameters, caller=None):
+        self._begin(sql, caller or sys._getframe(1))
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._elapsed += time.perf_counter() - start
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._elapsed += time.perf_counter() - start
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._elapsed += time.perf_counter() - start
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._elapsed += time.perf_counter() - start
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        # Rows are fetched in batches, so looping over a cursor is timed per batch rather
+        # than per row; stopping early discards the rest of the batch along with the loop
+        while True:
+            rows = self.fetchmany(CURSOR_ITER_BATCH)
+            yield from rows
+            if len(rows) < CURSOR_ITER_BATCH:
+                return
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._elapsed += time.perf_counter() - start
+            self._finish()
+            raise
+        self._elapsed += time.perf_counter() - start
+        self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors, including the implicit ones of execute(), are instrumented"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters, sys._getframe(1))
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters, sys._getframe(1))
+
+# Open a tuned connection to the database, instrumented unless METRICS_ENABLED is off
+def connect_db(path=None):
+    factory = InstrumentedConnection if app.config['METRICS_ENABLED'] else sqlite3.Connection
+    conn = sqlite3.connect(path or app.config['DATABASE'], check_same_thread=False, factory=factory)
+    for name, value in SQLITE_PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+class ConnectionPool:
+    """Thread-safe pool of tuned connections to a single database file.
+
+    Idle connections are reused most-recently-released first so that their
+    page cache stays warm.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect_db(self.path)
+
+    def release(self, conn):
+        # Never hand out a connection with a half-finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Get the process-wide pool, recreating it if the configured database changed
+def get_pool():
+    global _pool
+    path = app.config['DATABASE']
+    if _pool is None or _pool.path != path:
+        with _pool_lock:
+            if _pool is None or _pool.path != path:
+                if _pool is not None:
+                    _pool.close()
+                _pool = ConnectionPool(path, app.config['DB_POOL_SIZE'])
+    return _pool
+
+# Get the connection bound to the current request, checking one out on first use
+def get_db():
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(conn)
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    sql_activity.reset()
+
+@app.after_request
+def note_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+# Runs once the response is sent, so streamed exports are timed to their last chunk
+@app.teardown_request
+def record_request_metrics(exception):
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    endpoint = request.endpoint or 'unmatched'
+    status = g.pop('response_status', 500)
+    metrics.observe('http_request_duration_seconds', (endpoint, request.method, str(status)),
+                    time.perf_counter() - started)
+    metrics.observe('http_request_sql_statements', (endpoint,), sql_activity.statements)
+    metrics.observe('http_request_sql_seconds', (endpoint,), sql_activity.seconds)
+    if sql_activity.rows:
+        metrics.inc('http_request_sql_rows_total', (endpoint,), sql_activity.rows)
+    publish_metrics()
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.setdefault('template_started', []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def record_template_time(sender, template, context, **extra):
+    started = g.template_started.pop()
+    metrics.observe('template_render_seconds', (template.name,), time.perf_counter() - started)
+
+class WriteQueue:
+    """Single writer thread for one database file.
+
+    Request threads submit write functions, which receive a cursor, and get a Future
+    back. The writer drains whatever has queued up (at most max_batch writes) into one
+    IMMEDIATE transaction, so concurrent writers never race for SQLite's write lock.
+    If any write in a group raises, the group is rolled back and each write is replayed
+    in a transaction of its own, so write functions must only touch the database.
+    Futures resolve only after the transaction that holds their write commits.
+    """
+
+    def __init__(self, path, max_batch=64):
+        self.path = path
+        self.max_batch = max_batch
+        self.transactions = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        future = Future()
+        self._queue.put((future, fn, args))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+
+    def _run(self):
+        conn = connect_db(self.path)
+        conn.isolation_level = None  # transactions are managed explicitly below
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+                batch = [item for item in batch if item is not None]
+            
+            batch = [item for item in batch if item[0].set_running_or_notify_cancel()]
+            if len(batch) > 1 and self._write(conn, batch):
+                continue
+            for item in batch:
+                self._write(conn, [item])
+        conn.close()
+
+    def _write(self, conn, batch):
+        # Run a group of writes in one transaction; returns False when a write of a
+        # larger group failed and nothing was resolved, so the caller can replay them
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for _, fn, args in batch:
+                results.append(fn(conn.cursor(), *args))
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            if len(batch) > 1:
+                return False
+            batch[0][0].set_exception(e)
+            return True
+        
+        self.transactions += 1
+        for (future, _, _), result in zip(batch, results):
+            future.set_result(result)
+        return True
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+# Get the process-wide write queue, recreating it if the configured database changed
+def get_write_queue():
+    global _write_queue
+    path = app.config['DATABASE']
+    if _write_queue is None or _write_queue.path != path:
+        with _write_queue_lock:
+            if _write_queue is None or _write_queue.path != path:
+                if _write_queue is not None:
+                    _write_queue.close()
+                _write_queue = WriteQueue(path, app.config.get('WRITE_BATCH_SIZE', 64))
+    return _write_queue
+
+# Run fn(cursor, *args) on the writer thread and wait for its transaction to commit
+def write_db(fn, *args):
+    return get_write_queue().submit(fn, *args).result()
 
 # Database initialization
 def init_db():
     print("Initializing database...")
     
     # Only create database if it doesn't exist
-    database_exists = os.path.exists('school.db')
+    database_exists = os.path.exists(app.config['DATABASE'])
     
-    conn = sqlite3.connect('school.db')
+    conn = connect_db()
     cursor = conn.cursor()
     
     # Create users table
@@ -107,8 +638,19 @@ def init_db():
         cursor.execute('INSERT INTO risk_thresholds (min_grade, max_absences, risk_level) VALUES (10.0, 10, "medium")')
         print("Inserted default risk threshold")
     
-    print("Database initialization completed successfully")
     conn.commit()
+    
+    # Bring older databases up to the current schema version
+    migrate_db(conn)
+    
+    # Jobs that were in flight when the server stopped will never finish
+    cursor.execute('''
+        UPDATE report_jobs SET status = 'failed', error = 'Interrupted by server restart'
+        WHERE status IN ('queued', 'running')
+    ''')
+    conn.commit()
+    
+    print("Database initialization completed successfully")
     conn.close()
     
     if not database_exists:
@@ -116,6 +658,711 @@ def init_db():
     else:
         print("Existing database loaded. Your data is preserved.")
 
+# Schema migrations, applied in order; PRAGMA user_version records how many have run
+def migration_natural_key_indexes(cursor):
+    # Collapse duplicate rows on the natural key, keeping the most recent entry
+    for table in ('grades', 'absences'):
+        cursor.execute(f'''
+            DELETE FROM {table}
+            WHERE module_name IS NOT NULL AND academic_year IS NOT NULL AND semester IS NOT NULL
+              AND id NOT IN (
+                  SELECT MAX(id) FROM {table}
+                  WHERE module_name IS NOT NULL AND academic_year IS NOT NULL AND semester IS NOT NULL
+                  GROUP BY student_id, module_name, academic_year, semester
+              )
+        ''')
+    
+    # Unique natural keys; the student_id prefix also serves per-student lookups
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_grades_natural_key
+        ON grades (student_id, module_name, academic_year, semester)
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_absences_natural_key
+        ON absences (student_id, module_name, academic_year, semester)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_grades_year_semester ON grades (academic_year, semester)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_users_role_name ON users (role, name)')
+
+def migration_report_jobs(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS report_jobs (
+            id TEXT PRIMARY KEY,
+            format TEXT NOT NULL,
+            params TEXT NOT NULL,
+            params_key TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            progress REAL NOT NULL DEFAULT 0,
+            artifact_path TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    # At most one queued or running job per format/parameter combination
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_report_jobs_in_flight
+        ON report_jobs (params_key) WHERE status IN ('queued', 'running')
+    ''')
+
+def migration_student_summary(cursor):
+    # One row per student with running grade/absence aggregates and the derived risk level
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS student_summary (
+            student_id INTEGER PRIMARY KEY,
+            grade_sum REAL NOT NULL DEFAULT 0,
+            grade_count INTEGER NOT NULL DEFAULT 0,
+            pass_count INTEGER NOT NULL DEFAULT 0,
+            avg_grade REAL,
+            total_absences INTEGER NOT NULL DEFAULT 0,
+            risk_level TEXT NOT NULL DEFAULT 'low',
+            FOREIGN KEY (student_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_student_summary_avg ON student_summary (avg_grade)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_student_summary_risk ON student_summary (risk_level)')
+    
+    min_grade = 'COALESCE((SELECT min_grade FROM risk_thresholds LIMIT 1), 10.0)'
+    max_absences = 'COALESCE((SELECT max_absences FROM risk_thresholds LIMIT 1), 10)'
+    
+    def risk_case(avg, absences):
+        return f'''
+            CASE
+                WHEN COALESCE({avg}, 0) < {min_grade} AND {absences} > {max_absences} THEN 'high'
+                WHEN COALESCE({avg}, 0) < {min_grade} OR {absences} > {max_absences} THEN 'medium'
+                ELSE 'low'
+            END
+        '''
+    
+    # Apply a grade delta to one student's row in O(1). SET expressions see the pre-update
+    # values, so the new average and risk level are derived from the adjusted totals.
+    def add_grade(student, grade, sign):
+        grade_sum = f'ROUND(grade_sum {sign} {grade}, 6)'
+        grade_count = f'(grade_count {sign} 1)'
+        avg = f'(CASE WHEN {grade_count} > 0 THEN {grade_sum} / {grade_count} END)'
+        return f'''
+            UPDATE student_summary SET
+                grade_sum = {grade_sum},
+                grade_count = {grade_count},
+                pass_count = pass_count {sign} ({grade} >= 10),
+                avg_grade = {avg},
+                risk_level = {risk_case(avg, 'total_absences')}
+            WHERE student_id = {student};
+        '''
+    
+    def add_absences(student, count, sign):
+        total = f'(total_absences {sign} COALESCE({count}, 0))'
+        return f'''
+            UPDATE student_summary SET
+                total_absences = {total},
+                risk_level = {risk_case('avg_grade', total)}
+            WHERE student_id = {student};
+        '''
+    
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_grades_summary_insert AFTER INSERT ON grades
+        BEGIN {add_grade('NEW.student_id', 'NEW.grade', '+')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_grades_summary_delete AFTER DELETE ON grades
+        BEGIN {add_grade('OLD.student_id', 'OLD.grade', '-')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_grades_summary_update AFTER UPDATE OF student_id, grade ON grades
+        BEGIN {add_grade('OLD.student_id', 'OLD.grade', '-')} {add_grade('NEW.student_id', 'NEW.grade', '+')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_absences_summary_insert AFTER INSERT ON absences
+        BEGIN {add_absences('NEW.student_id', 'NEW.count', '+')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_absences_summary_delete AFTER DELETE ON absences
+        BEGIN {add_absences('OLD.student_id', 'OLD.count', '-')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_absences_summary_update AFTER UPDATE OF student_id, count ON absences
+        BEGIN {add_absences('OLD.student_id', 'OLD.count', '-')} {add_absences('NEW.student_id', 'NEW.count', '+')} END
+    ''')
+    
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_users_summary_insert AFTER INSERT ON users
+        WHEN NEW.role = 'student'
+        BEGIN
+            INSERT INTO student_summary (student_id, risk_level)
+            VALUES (NEW.id, {risk_case('NULL', '0')});
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_summary_delete AFTER DELETE ON users
+        BEGIN DELETE FROM student_summary WHERE student_id = OLD.id; END
+    ''')
+    
+    # Threshold changes re-derive every stored risk level
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_risk_thresholds_summary_{event.lower()} AFTER {event} ON risk_thresholds
+            BEGIN
+                UPDATE student_summary SET risk_level = {risk_case('avg_grade', 'total_absences')};
+            END
+        ''')
+    
+    # Populate from existing data
+    cursor.execute(f'''
+        INSERT OR REPLACE INTO student_summary
+            (student_id, grade_sum, grade_count, pass_count, avg_grade, total_absences, risk_level)
+        SELECT u.id, COALESCE(g.grade_sum, 0), COALESCE(g.grade_count, 0), COALESCE(g.pass_count, 0),
+               g.avg_grade, COALESCE(a.total_absences, 0),
+               {risk_case('g.avg_grade', 'COALESCE(a.total_absences, 0)')}
+        FROM users u
+        LEFT JOIN (SELECT student_id, SUM(grade) AS grade_sum, COUNT(*) AS grade_count,
+                          COUNT(CASE WHEN grade >= 10 THEN 1 END) AS pass_count, AVG(grade) AS avg_grade
+                   FROM grades GROUP BY student_id) g ON g.student_id = u.id
+        LEFT JOIN (SELECT student_id, SUM(count) AS total_absences
+                   FROM absences GROUP BY student_id) a ON a.student_id = u.id
+        WHERE u.role = 'student'
+    ''')
+
+def migration_change_counters(cursor):
+    # Per-table write counters; readers compare them to know when derived data is stale
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_counters (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for table in ('users', 'grades', 'absences', 'classes', 'student_class', 'risk_thresholds'):
+        cursor.execute('INSERT OR IGNORE INTO change_counters (name) VALUES (?)', (table,))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_counter_{event.lower()} AFTER {event} ON {table}
+                BEGIN UPDATE change_counters SET version = version + 1 WHERE name = '{table}'; END
+            ''')
+    
+    # Scoped ranking lookups
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_grades_module ON grades (module_name, academic_year, semester)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_student_class_class ON student_class (class_id, student_id)')
+
+def migration_search_index(cursor):
+    # Distinct module and teacher names with the number of grade rows using them
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS search_terms (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            value TEXT NOT NULL,
+            refs INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (kind, value)
+        )
+    ''')
+    # Full-text indexes over the terms and over student names/emails; prefix indexes keep
+    # typeahead queries cheap. Both are external-content tables kept in sync by triggers.
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_terms_fts USING fts5(
+            value, content='search_terms', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5(
+            name, email, content='users', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_search_terms_fts_insert AFTER INSERT ON search_terms
+        BEGIN INSERT INTO search_terms_fts (rowid, value) VALUES (NEW.id, NEW.value); END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_search_terms_fts_delete AFTER DELETE ON search_terms
+        BEGIN INSERT INTO search_terms_fts (search_terms_fts, rowid, value) VALUES ('delete', OLD.id, OLD.value); END
+    ''')
+    
+    def add_term(kind, value):
+        return f'''
+            INSERT INTO search_terms (kind, value, refs) SELECT '{kind}', {value}, 1 WHERE {value} <> ''
+            ON CONFLICT (kind, value) DO UPDATE SET refs = refs + 1;
+        '''
+    
+    def remove_term(kind, value):
+        return f'''
+            UPDATE search_terms SET refs = refs - 1 WHERE kind = '{kind}' AND value = {value};
+            DELETE FROM search_terms WHERE kind = '{kind}' AND value = {value} AND refs <= 0;
+        '''
+    
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_grades_search_insert AFTER INSERT ON grades
+        BEGIN {add_term('module', 'NEW.module_name')} {add_term('teacher', 'NEW.teacher_name')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_grades_search_delete AFTER DELETE ON grades
+        BEGIN {remove_term('module', 'OLD.module_name')} {remove_term('teacher', 'OLD.teacher_name')} END
+    ''')
+    for kind, column in (('module', 'module_name'), ('teacher', 'teacher_name')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_grades_search_update_{kind} AFTER UPDATE OF {column} ON grades
+            WHEN OLD.{column} IS NOT NEW.{column}
+            BEGIN {remove_term(kind, f'OLD.{column}')} {add_term(kind, f'NEW.{column}')} END
+        ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_search_insert AFTER INSERT ON users
+        WHEN NEW.role = 'student'
+        BEGIN INSERT INTO students_fts (rowid, name, email) VALUES (NEW.id, NEW.name, NEW.email); END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_search_delete AFTER DELETE ON users
+        WHEN OLD.role = 'student'
+        BEGIN INSERT INTO students_fts (students_fts, rowid, name, email) VALUES ('delete', OLD.id, OLD.name, OLD.email); END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_search_update AFTER UPDATE OF name, email, role ON users
+        BEGIN
+            INSERT INTO students_fts (students_fts, rowid, name, email)
+            SELECT 'delete', OLD.id, OLD.name, OLD.email WHERE OLD.role = 'student';
+            INSERT INTO students_fts (rowid, name, email)
+            SELECT NEW.id, NEW.name, NEW.email WHERE NEW.role = 'student';
+        END
+    ''')
+    
+    # Populate from existing data
+    cursor.execute('''
+        INSERT OR IGNORE INTO search_terms (kind, value, refs)
+        SELECT 'module', module_name, COUNT(*) FROM grades WHERE module_name <> '' GROUP BY module_name
+        UNION ALL
+        SELECT 'teacher', teacher_name, COUNT(*) FROM grades WHERE teacher_name <> '' GROUP BY teacher_name
+    ''')
+    cursor.execute("INSERT INTO students_fts (rowid, name, email) SELECT id, name, email FROM users WHERE role = 'student'")
+
+def migration_facet_catalogue(cursor):
+    # search_terms doubles as the filter facet catalogue: academic years and semesters are
+    # counted there too, but only module and teacher names go into the full-text index
+    cursor.execute('DROP TRIGGER IF EXISTS trg_search_terms_fts_insert')
+    cursor.execute('DROP TRIGGER IF EXISTS trg_search_terms_fts_delete')
+    cursor.execute('''
+        CREATE TRIGGER trg_search_terms_fts_insert AFTER INSERT ON search_terms
+        WHEN NEW.kind IN ('module', 'teacher')
+        BEGIN INSERT INTO search_terms_fts (rowid, value) VALUES (NEW.id, NEW.value); END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER trg_search_terms_fts_delete AFTER DELETE ON search_terms
+        WHEN OLD.kind IN ('module', 'teacher')
+        BEGIN INSERT INTO search_terms_fts (search_terms_fts, rowid, value) VALUES ('delete', OLD.id, OLD.value); END
+    ''')
+    
+    def add_term(kind, value):
+        return f'''
+            INSERT INTO search_terms (kind, value, refs) SELECT '{kind}', {value}, 1 WHERE {value} <> ''
+            ON CONFLICT (kind, value) DO UPDATE SET refs = refs + 1;
+        '''
+    
+    def remove_term(kind, value):
+        return f'''
+            UPDATE search_terms SET refs = refs - 1 WHERE kind = '{kind}' AND value = {value};
+            DELETE FROM search_terms WHERE kind = '{kind}' AND value = {value} AND refs <= 0;
+        '''
+    
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_grades_facets_insert AFTER INSERT ON grades
+        BEGIN {add_term('academic_year', 'NEW.academic_year')} {add_term('semester', 'NEW.semester')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_grades_facets_delete AFTER DELETE ON grades
+        BEGIN {remove_term('academic_year', 'OLD.academic_year')} {remove_term('semester', 'OLD.semester')} END
+    ''')
+    for kind in ('academic_year', 'semester'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_grades_facets_update_{kind} AFTER UPDATE OF {kind} ON grades
+            WHEN OLD.{kind} IS NOT NEW.{kind}
+            BEGIN {remove_term(kind, f'OLD.{kind}')} {add_term(kind, f'NEW.{kind}')} END
+        ''')
+    
+    # Populate from existing data
+    cursor.execute('''
+        INSERT OR IGNORE INTO search_terms (kind, value, refs)
+        SELECT 'academic_year', academic_year, COUNT(*) FROM grades WHERE academic_year <> '' GROUP BY academic_year
+        UNION ALL
+        SELECT 'semester', semester, COUNT(*) FROM grades WHERE semester <> '' GROUP BY semester
+    ''')
+
+def migration_grade_cube(cursor):
+    # Rollup cube: grade and absence totals per (academic_year, semester, module, teacher) cell.
+    # NULL years, semesters and teachers are stored as '' so every cell has a unique key.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS grade_cube (
+            academic_year TEXT NOT NULL,
+            semester TEXT NOT NULL,
+            module_name TEXT NOT NULL,
+            teacher_name TEXT NOT NULL,
+            grade_sum REAL NOT NULL DEFAULT 0,
+            grade_count INTEGER NOT NULL DEFAULT 0,
+            pass_count INTEGER NOT NULL DEFAULT 0,
+            absence_total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (academic_year, semester, module_name, teacher_name)
+        )
+    ''')
+    
+    def cell(row):
+        return (f"COALESCE({row}.academic_year, ''), COALESCE({row}.semester, ''), "
+                f"{row}.module_name, COALESCE({row}.teacher_name, '')")
+    
+    def cell_matches(row):
+        return f'(academic_year, semester, module_name, teacher_name) = ({cell(row)})'
+    
+    # Absences count towards the cell of the grade with the same natural key
+    def matching_absences(row):
+        return f'''COALESCE((SELECT a.count FROM absences a
+            WHERE a.student_id = {row}.student_id AND a.module_name = {row}.module_name
+              AND a.academic_year = {row}.academic_year AND a.semester = {row}.semester), 0)'''
+    
+    def add_grade(row):
+        return f'''
+            INSERT INTO grade_cube
+                (academic_year, semester, module_name, teacher_name, grade_sum, grade_count, pass_count, absence_total)
+            VALUES ({cell(row)}, {row}.grade, 1, {row}.grade >= 10, {matching_absences(row)})
+            ON CONFLICT (academic_year, semester, module_name, teacher_name) DO UPDATE SET
+                grade_sum = ROUND(grade_sum + excluded.grade_sum, 6),
+                grade_count = grade_count + 1,
+                pass_count = pass_count + excluded.pass_count,
+                absence_total = absence_total + excluded.absence_total;
+        '''
+    
+    def remove_grade(row):
+        return f'''
+            UPDATE grade_cube SET
+                grade_sum = ROUND(grade_sum - {row}.grade, 6),
+                grade_count = grade_count - 1,
+                pass_count = pass_count - ({row}.grade >= 10),
+                absence_total = absence_total - {matching_absences(row)}
+            WHERE {cell_matches(row)};
+            DELETE FROM grade_cube WHERE {cell_matches(row)} AND grade_count <= 0;
+        '''
+    
+    grade_columns = ('student_id', 'module_name', 'grade', 'teacher_name', 'academic_year', 'semester')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_grades_cube_insert AFTER INSERT ON grades
+        BEGIN {add_grade('NEW')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_grades_cube_delete AFTER DELETE ON grades
+        BEGIN {remove_grade('OLD')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_grades_cube_update AFTER UPDATE OF {', '.join(grade_columns)} ON grades
+        WHEN {' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in grade_columns)}
+        BEGIN {remove_grade('OLD')} {add_grade('NEW')} END
+    ''')
+    
+    def add_absences(row, sign):
+        return f'''
+            UPDATE grade_cube SET absence_total = absence_total {sign} COALESCE({row}.count, 0)
+            WHERE (academic_year, semester, module_name, teacher_name) = (
+                SELECT {cell('g')} FROM grades g
+                WHERE g.student_id = {row}.student_id AND g.module_name = {row}.module_name
+                  AND g.academic_year = {row}.academic_year AND g.semester = {row}.semester);
+        '''
+    
+    absence_columns = ('student_id', 'module_name', 'count', 'academic_year', 'semester')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_absences_cube_insert AFTER INSERT ON absences
+        BEGIN {add_absences('NEW', '+')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_absences_cube_delete AFTER DELETE ON absences
+        BEGIN {add_absences('OLD', '-')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_absences_cube_update AFTER UPDATE OF {', '.join(absence_columns)} ON absences
+        WHEN {' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in absence_columns)}
+        BEGIN {add_absences('OLD', '-')} {add_absences('NEW', '+')} END
+    ''')
+    
+    # Populate from existing data
+    cursor.execute('''
+        INSERT OR REPLACE INTO grade_cube
+            (academic_year, semester, module_name, teacher_name, grade_sum, grade_count, pass_count, absence_total)
+        SELECT COALESCE(g.academic_year, ''), COALESCE(g.semester, ''), g.module_name, COALESCE(g.teacher_name, ''),
+               ROUND(SUM(g.grade), 6), COUNT(*), COUNT(CASE WHEN g.grade >= 10 THEN 1 END), SUM(COALESCE(a.count, 0))
+        FROM grades g
+        LEFT JOIN absences a ON (g.student_id = a.student_id AND g.module_name = a.module_name 
+                                AND g.academic_year = a.academic_year AND g.semester = a.semester)
+        GROUP BY 1, 2, 3, 4
+    ''')
+
+def migration_risk_levels(cursor):
+    # Named risk levels: a student gets the most severe level whose rule matches, where
+    # 'any' means below min_grade or over max_absences and 'all' means both. The single
+    # row that used to apply (the first one) becomes 'medium', and the former hard-coded
+    # 'high' (both limits crossed) becomes a row of its own.
+    for event in ('insert', 'delete', 'update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS trg_grades_summary_{event}')
+        cursor.execute(f'DROP TRIGGER IF EXISTS trg_absences_summary_{event}')
+        cursor.execute(f'DROP TRIGGER IF EXISTS trg_risk_thresholds_summary_{event}')
+    cursor.execute('DROP TRIGGER IF EXISTS trg_users_summary_insert')
+    
+    cursor.execute('ALTER TABLE risk_thresholds ADD COLUMN severity INTEGER NOT NULL DEFAULT 1')
+    cursor.execute("ALTER TABLE risk_thresholds ADD COLUMN rule TEXT NOT NULL DEFAULT 'any'")
+    cursor.execute('DELETE FROM risk_thresholds WHERE id > (SELECT MIN(id) FROM risk_thresholds)')
+    cursor.execute("UPDATE risk_thresholds SET risk_level = 'medium', severity = 1, rule = 'any'")
+    cursor.execute('''
+        INSERT INTO risk_thresholds (min_grade, max_absences, risk_level, severity, rule)
+        SELECT COALESCE(MIN(min_grade), 10.0), COALESCE(MIN(max_absences), 10), 'high', 2, 'all'
+        FROM risk_thresholds
+    ''')
+    cursor.execute("INSERT INTO risk_thresholds (min_grade, max_absences, risk_level, severity, rule) "
+                   "SELECT 10.0, 10, 'medium', 1, 'any' WHERE NOT EXISTS (SELECT 1 FROM risk_thresholds WHERE risk_level = 'medium')")
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_risk_thresholds_level ON risk_thresholds (risk_level)')
+    
+    def risk_case(avg, absences):
+        return f'''
+            COALESCE((
+                SELECT t.risk_level FROM risk_thresholds t
+                WHERE CASE t.rule
+                    WHEN 'all' THEN COALESCE({avg}, 0) < t.min_grade AND {absences} > t.max_absences
+                    ELSE COALESCE({avg}, 0) < t.min_grade OR {absences} > t.max_absences
+                END
+                ORDER BY t.severity DESC LIMIT 1
+            ), 'low')
+        '''
+    
+    # Same O(1) deltas as migration 3, with the level looked up from the table
+    def add_grade(student, grade, sign):
+        grade_sum = f'ROUND(grade_sum {sign} {grade}, 6)'
+        grade_count = f'(grade_count {sign} 1)'
+        avg = f'(CASE WHEN {grade_count} > 0 THEN {grade_sum} / {grade_count} END)'
+        return f'''
+            UPDATE student_summary SET
+                grade_sum = {grade_sum},
+                grade_count = {grade_count},
+                pass_count = pass_count {sign} ({grade} >= 10),
+                avg_grade = {avg},
+                risk_level = {risk_case(avg, 'total_absences')}
+            WHERE student_id = {student};
+        '''
+    
+    def add_absences(student, count, sign):
+        total = f'(total_absences {sign} COALESCE({count}, 0))'
+        return f'''
+            UPDATE student_summary SET
+                total_absences = {total},
+                risk_level = {risk_case('avg_grade', total)}
+            WHERE student_id = {student};
+        '''
+    
+    cursor.execute(f'''
+        CREATE TRIGGER trg_grades_summary_insert AFTER INSERT ON grades
+        BEGIN {add_grade('NEW.student_id', 'NEW.grade', '+')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER trg_grades_summary_delete AFTER DELETE ON grades
+        BEGIN {add_grade('OLD.student_id', 'OLD.grade', '-')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER trg_grades_summary_update AFTER UPDATE OF student_id, grade ON grades
+        BEGIN {add_grade('OLD.student_id', 'OLD.grade', '-')} {add_grade('NEW.student_id', 'NEW.grade', '+')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER trg_absences_summary_insert AFTER INSERT ON absences
+        BEGIN {add_absences('NEW.student_id', 'NEW.count', '+')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER trg_absences_summary_delete AFTER DELETE ON absences
+        BEGIN {add_absences('OLD.student_id', 'OLD.count', '-')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER trg_absences_summary_update AFTER UPDATE OF student_id, count ON absences
+        BEGIN {add_absences('OLD.student_id', 'OLD.count', '-')} {add_absences('NEW.student_id', 'NEW.count', '+')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER trg_users_summary_insert AFTER INSERT ON users
+        WHEN NEW.role = 'student'
+        BEGIN
+            INSERT INTO student_summary (student_id, risk_level)
+            VALUES (NEW.id, {risk_case('NULL', '0')});
+        END
+    ''')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER trg_risk_thresholds_summary_{event.lower()} AFTER {event} ON risk_thresholds
+            BEGIN
+                UPDATE student_summary SET risk_level = {risk_case('avg_grade', 'total_absences')};
+            END
+        ''')
+    
+    cursor.execute(f"UPDATE student_summary SET risk_level = {risk_case('avg_grade', 'total_absences')}")
+
+def migration_grade_squares(cursor):
+    # Sum of squared grades per cube cell, so standard deviations and z-scores of any
+    # rollup follow from the sums (variance = squares / count - mean²)
+    cursor.execute('ALTER TABLE grade_cube ADD COLUMN grade_sq_sum REAL NOT NULL DEFAULT 0')
+    for event in ('insert', 'delete', 'update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS trg_grades_cube_{event}')
+    
+    def cell(row):
+        return (f"COALESCE({row}.academic_year, ''), COALESCE({row}.semester, ''), "
+                f"{row}.module_name, COALESCE({row}.teacher_name, '')")
+    
+    def cell_matches(row):
+        return f'(academic_year, semester, module_name, teacher_name) = ({cell(row)})'
+    
+    def matching_absences(row):
+        return f'''COALESCE((SELECT a.count FROM absences a
+            WHERE a.student_id = {row}.student_id AND a.module_name = {row}.module_name
+              AND a.academic_year = {row}.academic_year AND a.semester = {row}.semester), 0)'''
+    
+    def add_grade(row):
+        return f'''
+            INSERT INTO grade_cube
+                (academic_year, semester, module_name, teacher_name,
+                 grade_sum, grade_sq_sum, grade_count, pass_count, absence_total)
+            VALUES ({cell(row)}, {row}.grade, {row}.grade * {row}.grade, 1, {row}.grade >= 10, {matching_absences(row)})
+            ON CONFLICT (academic_year, semester, module_name, teacher_name) DO UPDATE SET
+                grade_sum = ROUND(grade_sum + excluded.grade_sum, 6),
+                grade_sq_sum = ROUND(grade_sq_sum + excluded.grade_sq_sum, 6),
+                grade_count = grade_count + 1,
+                pass_count = pass_count + excluded.pass_count,
+                absence_total = absence_total + excluded.absence_total;
+        '''
+    
+    def remove_grade(row):
+        return f'''
+            UPDATE grade_cube SET
+                grade_sum = ROUND(grade_sum - {row}.grade, 6),
+                grade_sq_sum = ROUND(grade_sq_sum - {row}.grade * {row}.grade, 6),
+                grade_count = grade_count - 1,
+                pass_count = pass_count - ({row}.grade >= 10),
+                absence_total = absence_total - {matching_absences(row)}
+            WHERE {cell_matches(row)};
+            DELETE FROM grade_cube WHERE {cell_matches(row)} AND grade_count <= 0;
+        '''
+    
+    grade_columns = ('student_id', 'module_name', 'grade', 'teacher_name', 'academic_year', 'semester')
+    cursor.execute(f'''
+        CREATE TRIGGER trg_grades_cube_insert AFTER INSERT ON grades
+        BEGIN {add_grade('NEW')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER trg_grades_cube_delete AFTER DELETE ON grades
+        BEGIN {remove_grade('OLD')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER trg_grades_cube_update AFTER UPDATE OF {', '.join(grade_columns)} ON grades
+        WHEN {' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in grade_columns)}
+        BEGIN {remove_grade('OLD')} {add_grade('NEW')} END
+    ''')
+    
+    # Populate from existing data
+    cursor.execute('''
+        UPDATE grade_cube SET grade_sq_sum = squares.grade_sq_sum
+        FROM (SELECT COALESCE(academic_year, '') AS academic_year, COALESCE(semester, '') AS semester,
+                     module_name, COALESCE(teacher_name, '') AS teacher_name,
+                     ROUND(SUM(grade * grade), 6) AS grade_sq_sum
+              FROM grades GROUP BY 1, 2, 3, 4) AS squares
+        WHERE (grade_cube.academic_year, grade_cube.semester, grade_cube.module_name, grade_cube.teacher_name)
+            = (squares.academic_year, squares.semester, squares.module_name, squares.teacher_name)
+    ''')
+
+MIGRATIONS = [
+    migration_natural_key_indexes,  # 1
+    migration_report_jobs,          # 2
+    migration_student_summary,      # 3
+    migration_change_counters,      # 4
+    migration_search_index,         # 5
+    migration_facet_catalogue,      # 6
+    migration_grade_cube,           # 7
+    migration_risk_levels,          # 8
+    migration_grade_squares,        # 9
+]
+
+# Current write counters for the given tables, as a tuple usable in cache keys
+def get_change_version(conn, *tables):
+    placeholders = ', '.join('?' for _ in tables)
+    versions = dict(conn.execute(f'SELECT name, version FROM change_counters WHERE name IN ({placeholders})',
+                                 tables).fetchall())
+    return tuple(versions.get(table, 0) for table in tables)
+
+class RiskThresholds:
+    """The configured risk levels, most severe first.
+
+    A student is at the first level whose rule matches: 'any' when their average is
+    below min_grade or their absences exceed max_absences, 'all' when both hold, and
+    'low' when none does. The summary triggers evaluate the same rule in SQL.
+    """
+
+    FIELDS = ('risk_level', 'min_grade', 'max_absences', 'rule', 'severity')
+    RULES = ('any', 'all')
+
+    def __init__(self, levels):
+        self.levels = levels
+
+    @property
+    def names(self):
+        return [level['risk_level'] for level in self.levels] + ['low']
+
+    @property
+    def absence_limit(self):
+        # Absences above this put a student at some level of risk
+        return min((level['max_absences'] for level in self.levels), default=None)
+
+_risk_thresholds_cache = {}
+
+# Get the risk levels, reloading them only after risk_thresholds changes (in any process)
+def get_risk_thresholds(conn):
+    key = app.config['DATABASE']
+    version = get_change_version(conn, 'risk_thresholds')
+    cached = _risk_thresholds_cache.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+    
+    rows = conn.execute(f"SELECT {', '.join(RiskThresholds.FIELDS)} FROM risk_thresholds "
+                        "ORDER BY severity DESC").fetchall()
+    thresholds = RiskThresholds([dict(zip(RiskThresholds.FIELDS, row)) for row in rows])
+    _risk_thresholds_cache[key] = (version, thresholds)
+    return thresholds
+
+# Validate a complete set of risk levels and return rows for risk_thresholds
+def parse_risk_levels(levels):
+    if not isinstance(levels, list) or not levels:
+        raise ValueError('Expected a non-empty JSON array of risk levels')
+    rows = []
+    for level in levels:
+        if not isinstance(level, dict):
+            raise ValueError('Each risk level must be an object')
+        name = str(level.get('risk_level') or '').strip().lower()
+        if not name or name == 'low':
+            raise ValueError("risk_level is required and 'low' is reserved for students at no level")
+        try:
+            min_grade = float(level.get('min_grade'))
+            max_absences = int(level.get('max_absences'))
+            severity = int(level.get('severity'))
+        except (TypeError, ValueError):
+            raise ValueError(f'{name}: min_grade, max_absences and severity must be numbers')
+        if not 0 <= min_grade <= 20 or max_absences < 0:
+            raise ValueError(f'{name}: min_grade must be 0-20 and max_absences not negative')
+        rule = level.get('rule', 'any')
+        if rule not in RiskThresholds.RULES:
+            raise ValueError(f"{name}: rule must be 'any' or 'all'")
+        rows.append((name, min_grade, max_absences, rule, severity))
+    
+    if len({row[0] for row in rows}) < len(rows) or len({row[4] for row in rows}) < len(rows):
+        raise ValueError('Risk level names and severities must be unique')
+    return rows
+
+# Apply pending migrations, each in its own transaction
+def migrate_db(conn):
+    cursor = conn.cursor()
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        print(f"Applying migration {number}: {migration.__name__}")
+        try:
+            cursor.execute('BEGIN')
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
 # Login required decorator
 def login_required(f):
     @wraps(f)
@@ -137,96 +1384,1409 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Global data version: the sum of all write counters, so it moves on every write
+def get_data_version(conn):
+    return conn.execute('SELECT COALESCE(SUM(version), 0) FROM change_counters').fetchone()[0]
+
+class ResponseCache:
+    """Thread-safe LRU cache of response bodies, bounded by entry count and total bytes"""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, mimetype, etag):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            self._entries[key] = (body, mimetype, etag)
+            self.size += len(body)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                _, (evicted, _, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+response_cache = ResponseCache(max_entries=512, max_bytes=32 * 1024 * 1024)
+
+# Cache decorator for read-only views: responses are keyed on the data version, so any
+# write invalidates them, and carry an ETag so clients can revalidate with If-None-Match
+def cached_response(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Pages that would consume pending flash messages must be rendered fresh
+        if '_flashes' in session:
+            return f(*args, **kwargs)
+        
+        key = (
+            app.config['DATABASE'],
+            request.endpoint,
+            session.get('role'),
+            session.get('user_id'),
+            tuple(sorted(kwargs.items())),
+            tuple(sorted(request.args.items(multi=True))),
+            get_data_version(get_db()),
+        )
+        entry = response_cache.get(key)
+        if entry is None:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            body = response.get_data()
+            entry = (body, response.mimetype, hashlib.sha1(body).hexdigest())
+            response_cache.put(key, *entry)
+        
+        body, mimetype, etag = entry
+        response = Response(body, mimetype=mimetype)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
+    return decorated_function
+
 # Hash password
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
-# Get risk level for a student
-def get_student_risk_level(student_id):
-    conn = sqlite3.connect('school.db')
-    cursor = conn.cursor()
+# Rebuild student_summary from scratch in one grouped pass (recovery after manual edits)
+STUDENT_SUMMARY_REBUILD_SQL = '''
+    INSERT INTO student_summary
+        (student_id, grade_sum, grade_count, pass_count, avg_grade, total_absences, risk_level)
+    SELECT u.id, COALESCE(g.grade_sum, 0), COALESCE(g.grade_count, 0), COALESCE(g.pass_count, 0),
+           g.avg_grade, COALESCE(a.total_absences, 0),
+           COALESCE((
+               SELECT t.risk_level FROM risk_thresholds t
+               WHERE CASE t.rule
+                   WHEN 'all' THEN COALESCE(g.avg_grade, 0) < t.min_grade AND COALESCE(a.total_absences, 0) > t.max_absences
+                   ELSE COALESCE(g.avg_grade, 0) < t.min_grade OR COALESCE(a.total_absences, 0) > t.max_absences
+               END
+               ORDER BY t.severity DESC LIMIT 1
+           ), 'low')
+    FROM users u
+    LEFT JOIN (SELECT student_id, SUM(grade) AS grade_sum, COUNT(*) AS grade_count,
+                      COUNT(CASE WHEN grade >= 10 THEN 1 END) AS pass_count, AVG(grade) AS avg_grade
+               FROM grades GROUP BY student_id) g ON g.student_id = u.id
+    LEFT JOIN (SELECT student_id, SUM(count) AS total_absences
+               FROM absences GROUP BY student_id) a ON a.student_id = u.id
+    WHERE u.role = 'student'
+'''
+
+# Recompute every student_summary row, returning the number of students
+def rebuild_student_summary(conn):
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM student_summary')
+    cursor.execute(STUDENT_SUMMARY_REBUILD_SQL)
+    conn.commit()
+    return cursor.rowcount
+
+# Rebuild the analytics rollup cube from grades and their matching absences
+GRADE_CUBE_REBUILD_SQL = '''
+    INSERT INTO grade_cube
+        (academic_year, semester, module_name, teacher_name,
+         grade_sum, grade_sq_sum, grade_count, pass_count, absence_total)
+    SELECT COALESCE(g.academic_year, ''), COALESCE(g.semester, ''), g.module_name, COALESCE(g.teacher_name, ''),
+           ROUND(SUM(g.grade), 6), ROUND(SUM(g.grade * g.grade), 6), COUNT(*),
+           COUNT(CASE WHEN g.grade >= 10 THEN 1 END), SUM(COALESCE(a.count, 0))
+    FROM grades g
+    LEFT JOIN absences a ON (g.student_id = a.student_id AND g.module_name = a.module_name 
+                            AND g.academic_year = a.academic_year AND g.semester = a.semester)
+    GROUP BY 1, 2, 3, 4
+'''
+
+# Recompute every grade_cube cell, returning the number of cells
+def rebuild_grade_cube(conn):
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM grade_cube')
+    cursor.execute(GRADE_CUBE_REBUILD_SQL)
+    conn.commit()
+    return cursor.rowcount
+
+@app.cli.command('rebuild-summary')
+def rebuild_summary_command():
+    """Recompute the student_summary table and the grade_cube rollup from grades and absences."""
+    init_db()
+    conn = connect_db()
+    count = rebuild_student_summary(conn)
+    cells = rebuild_grade_cube(conn)
+    conn.close()
+    print(f"Rebuilt summary rows for {count} students and {cells} grade cube cells")
+
+# Prepare a freshly started server worker before it takes traffic: open its pooled
+# connections, compile the templates and prime the caches the first requests would
+# otherwise build (data version, risk thresholds, overall ranking, filter facets)
+def warm_up(connections=1):
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    
+    pool = get_pool()
+    conns = [pool.acquire() for _ in range(max(connections, 1))]
+    try:
+        conn = conns[0]
+        get_data_version(conn)
+        get_risk_thresholds(conn)
+        get_ranking_index(conn)
+        get_filter_facets(conn)
+    finally:
+        for conn in conns:
+            pool.release(conn)
+
+# Grade and absence upserts on the (student_id, module_name, academic_year, semester) key
+GRADE_UPSERT_SQL = '''
+    INSERT INTO grades (student_id, module_name, grade, teacher_name, academic_year, semester)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (student_id, module_name, academic_year, semester)
+    DO UPDATE SET grade = excluded.grade, teacher_name = excluded.teacher_name
+'''
+
+ABSENCE_UPSERT_SQL = '''
+    INSERT INTO absences (student_id, module_name, count, academic_year, semester)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (student_id, module_name, academic_year, semester)
+    DO UPDATE SET count = excluded.count
+'''
+
+# Most per-row errors reported back by an import; the total is always counted
+IMPORT_MAX_REPORTED_ERRORS = 100
+
+# Validate one import record and turn it into (grade_params, absence_params or None)
+def parse_grade_record(record, student_ids, student_emails):
+    raw_id = str(record.get('student_id') or '').strip()
+    email = str(record.get('email') or '').strip()
+    if raw_id:
+        try:
+            student_id = int(raw_id)
+        except ValueError:
+            raise ValueError(f'invalid student_id {raw_id!r}')
+        if student_id not in student_ids:
+            raise ValueError(f'unknown student_id {student_id}')
+    elif email:
+        student_id = student_emails.get(email)
+        if student_id is None:
+            raise ValueError(f'unknown student email {email!r}')
+    else:
+        raise ValueError('student_id or email is required')
+    
+    module_name = str(record.get('module_name') or '').strip()
+    if not module_name:
+        raise ValueError('module_name is required')
+    
+    try:
+        grade = float(record.get('grade'))
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid grade {record.get('grade')!r}")
+    if not 0 <= grade <= 20:
+        raise ValueError(f'grade {grade} is outside 0-20')
+    
+    teacher_name = str(record.get('teacher_name') or '').strip()
+    academic_year = str(record.get('academic_year') or '2024-2025').strip()
+    semester = str(record.get('semester') or '1').strip()
+    grade_params = (student_id, module_name, grade, teacher_name, academic_year, semester)
+    
+    raw_absences = record.get('absences')
+    if raw_absences is None or str(raw_absences).strip() == '':
+        return grade_params, None
+    try:
+        absences = int(raw_absences)
+    except (TypeError, ValueError):
+        raise ValueError(f'invalid absences {raw_absences!r}')
+    if absences < 0:
+        raise ValueError('absences cannot be negative')
+    return grade_params, (student_id, module_name, absences, academic_year, semester)
+
+# Upsert grade/absence records in batched transactions and return a validation summary
+def import_grade_records(conn, records, batch_size=None):
+    batch_size = batch_size or app.config.get('IMPORT_BATCH_SIZE', 1000)
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, email FROM users WHERE role = 'student'")
+    student_emails = {email: student_id for student_id, email in cursor.fetchall()}
+    student_ids = set(student_emails.values())
+    
+    summary = {'processed': 0, 'imported': 0, 'error_count': 0, 'errors': []}
+    grade_batch = []
+    absence_batch = []
+    
+    def write_batch(cursor, grades, absences):
+        if grades:
+            cursor.executemany(GRADE_UPSERT_SQL, grades)
+        if absences:
+            cursor.executemany(ABSENCE_UPSERT_SQL, absences)
+    
+    def flush():
+        write_db(write_batch, grade_batch, absence_batch)
+        summary['imported'] += len(grade_batch)
+        grade_batch.clear()
+        absence_batch.clear()
+    
+    # Records the reader could not decode arrive as ValueError and are rejected like
+    # invalid ones; if the body itself stops being readable, the rows read so far are
+    # still imported and the summary says where reading stopped
+    try:
+        for row_number, record in enumerate(records, 1):
+            summary['processed'] += 1
+            try:
+                if isinstance(record, ValueError):
+                    raise record
+                grade_params, absence_params = parse_grade_record(record, student_ids, student_emails)
+            except (ValueError, AttributeError) as e:
+                summary['error_count'] += 1
+                if len(summary['errors']) < IMPORT_MAX_REPORTED_ERRORS:
+                    summary['errors'].append({'row': row_number, 'error': str(e)})
+                continue
+            
+            grade_batch.append(grade_params)
+            if absence_params:
+                absence_batch.append(absence_params)
+            if len(grade_batch) >= batch_size:
+                flush()
+    except (UnicodeDecodeError, csv.Error, OSError) as e:
+        summary['error'] = f"Could not read past row {summary['processed']}: {e}"
+    
+    flush()
+    return summary
+
+# Iterate the records of a CSV upload without loading the whole file; a malformed
+# line is yielded as a ValueError and reading carries on with the next one
+def iter_csv_records(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text)
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield ValueError(f'malformed CSV line: {e}')
+            continue
+        yield {key.strip(): value for key, value in row.items() if key}
+
+# Iterate the records of a newline-delimited JSON body; a line that is not valid JSON
+# is yielded as a ValueError
+def iter_ndjson_records(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield ValueError(f'invalid JSON: {e}')
+
+# Every student joined with their grades and module absences, in export order
+EXPORT_QUERY = '''
+    SELECT u.name, u.email, g.module_name, g.grade, g.teacher_name, 
+           g.academic_year, g.semester, 
+           COALESCE(a.count, 0) as absences
+    FROM users u
+    LEFT JOIN grades g ON u.id = g.student_id
+    LEFT JOIN absences a ON (u.id = a.student_id AND g.module_name = a.module_name 
+                            AND g.academic_year = a.academic_year AND g.semester = a.semester)
+    WHERE u.role = 'student'
+    ORDER BY u.name, g.academic_year, g.semester, g.module_name
+'''
+
+# Rows pulled from the export cursor per fetchmany() call
+EXPORT_FETCH_SIZE = 500
+
+# Iterate a cursor in fixed-size chunks instead of materialising it with fetchall()
+def iter_cursor(cursor, size=EXPORT_FETCH_SIZE):
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        yield from rows
+
+# Format one EXPORT_QUERY row for CSV/Excel output, adding the status column
+def format_export_row(row):
+    grade = row[3]
+    status = 'Admis' if grade and grade >= 10 else 'Non Admis' if grade is not None else 'N/A'
+    return [
+        row[0],                                           # Name
+        row[1],                                           # Email
+        row[2] or 'N/A',                                  # Module
+        f"{grade:.2f}" if grade is not None else 'N/A',   # Grade
+        row[4] or 'N/A',                                  # Teacher
+        row[5] or 'N/A',                                  # Academic Year
+        row[6] or 'N/A',                                  # Semester
+        str(row[7]),                                      # Absences
+        status                                            # Status
+    ]
+
+class ExportSummary:
+    """Running totals for the export summary, updated as rows stream past.
+
+    Rows arrive ordered by student name, so distinct students are counted by
+    watching the name change rather than keeping a set of every name.
+    """
+
+    def __init__(self):
+        self.total_students = 0
+        self.graded = 0
+        self.passed = 0
+        self.grade_sum = 0.0
+        self._last_name = None
+
+    def add(self, row):
+        name, grade = row[0], row[3]
+        if self.total_students == 0 or name != self._last_name:
+            self.total_students += 1
+            self._last_name = name
+        if grade is not None:
+            self.graded += 1
+            self.grade_sum += grade
+            if grade >= 10:
+                self.passed += 1
+
+    @property
+    def avg_grade(self):
+        return self.grade_sum / self.graded if self.graded else 0
+
+    @property
+    def failed(self):
+        return self.graded - self.passed
+
+    @property
+    def success_rate(self):
+        return (self.passed / self.graded * 100) if self.graded else 0
+
+    def rows(self):
+        return [
+            ['Total Students', self.total_students],
+            ['Overall Average', f"{self.avg_grade:.2f}/20"],
+            ['Success Rate', f"{self.success_rate:.1f}%"],
+            ['Failed Modules', self.failed],
+        ]
+
+# Write the Excel export to a path or binary file, streaming EXPORT_QUERY rows from cursor
+def write_excel_export(cursor, output):
+    from openpyxl import Workbook
+    
+    # Write-only workbooks spill rows to temporary files instead of keeping cells in memory
+    wb = Workbook(write_only=True)
+    
+    # Student Data sheet
+    ws1 = wb.create_sheet("Student Data")
+    ws1.append(['Student Name', 'Email', 'Module', 'Grade', 'Teacher', 
+                'Academic Year', 'Semester', 'Absences', 'Status'])
+    
+    summary = ExportSummary()
+    for row in iter_cursor(cursor):
+        summary.add(row)
+        ws1.append(format_export_row(row))
+    
+    # Summary sheet
+    ws2 = wb.create_sheet("Summary")
+    ws2.append(['Metric', 'Value'])
+    for summary_row in summary.rows():
+        ws2.append(summary_row)
+    
+    wb.save(output)
+
+class RankingIndex:
+    """Averages of one ranking scope kept in sorted order for O(log n) rank lookups.
+
+    Ranks are competition-style: tied averages share a rank, and students with
+    no grades in the scope come after everyone who has some.
+    """
+
+    def __init__(self, averages):
+        self.averages = averages
+        self._keys = sorted(self._key(avg) for avg in averages.values())
+
+    @staticmethod
+    def _key(avg):
+        return -avg if avg is not None else 1
+
+    def __len__(self):
+        return len(self._keys)
+
+    def rank(self, student_id):
+        if student_id not in self.averages:
+            return None
+        return bisect.bisect_left(self._keys, self._key(self.averages[student_id])) + 1
+
+# Most ranking scopes (module/year/semester/class combinations) kept in memory
+RANKING_CACHE_SIZE = 256
+
+_ranking_cache = OrderedDict()
+_ranking_cache_lock = threading.Lock()
+
+# Load the averages of one ranking scope
+def load_ranking_averages(cursor, module=None, academic_year=None, semester=None, class_id=None):
+    if not (module or academic_year or semester):
+        # Whole-record averages come straight from the summary table
+        query = 'SELECT s.student_id, s.avg_grade FROM student_summary s'
+        params = []
+        if class_id:
+            query += ' JOIN student_class sc ON sc.student_id = s.student_id AND sc.class_id = ?'
+            params.append(class_id)
+        cursor.execute(query, params)
+        return dict(cursor.fetchall())
+    
+    query = 'SELECT g.student_id, AVG(g.grade) FROM grades g'
+    params = []
+    if class_id:
+        query += ' JOIN student_class sc ON sc.student_id = g.student_id AND sc.class_id = ?'
+        params.append(class_id)
+    conditions = []
+    for column, value in (('module_name', module), ('academic_year', academic_year), ('semester', semester)):
+        if value:
+            conditions.append(f'g.{column} = ?')
+            params.append(value)
+    query += ' WHERE ' + ' AND '.join(conditions) + ' GROUP BY g.student_id'
+    cursor.execute(query, params)
+    return dict(cursor.fetchall())
+
+# Get the ranking index for a scope, rebuilding it only after grades or enrolments change
+def get_ranking_index(conn, module=None, academic_year=None, semester=None, class_id=None):
+    scope = (module or None, academic_year or None, semester or None, int(class_id) if class_id else None)
+    version = get_change_version(conn, 'users', 'grades', 'student_class')
+    
+    with _ranking_cache_lock:
+        cached = _ranking_cache.get(scope)
+        if cached and cached[0] == version:
+            _ranking_cache.move_to_end(scope)
+            return cached[1]
+    
+    index = RankingIndex(load_ranking_averages(conn.cursor(), *scope))
+    with _ranking_cache_lock:
+        _ranking_cache[scope] = (version, index)
+        _ranking_cache.move_to_end(scope)
+        while len(_ranking_cache) > RANKING_CACHE_SIZE:
+            _ranking_cache.popitem(last=False)
+    return index
+
+# Get student ranking, overall or within a module / year / semester / class
+def get_student_ranking(student_id, **scope):
+    index = get_ranking_index(get_db(), **scope)
+    return index.rank(student_id), len(index), index.averages.get(student_id) or 0
+
+# One point of a performance evolution chart
+def evolution_point(year, semester, grade_sum, total, passed):
+    avg_grade = grade_sum / total
+    return {
+        'period': f"{year} S{semester}",
+        'avg_grade': round(avg_grade, 2) if avg_grade else 0,
+        'success_rate': round(passed / total * 100, 1)
+    }
+
+# Everything the student dashboard shows, from one query over the student's own rows
+STUDENT_PROFILE_QUERY = '''
+    SELECT u.name, s.risk_level, g.module_name, g.grade, g.teacher_name, g.academic_year, g.semester,
+           COALESCE(a.count, 0) as absences
+    FROM users u
+    LEFT JOIN student_summary s ON s.student_id = u.id
+    LEFT JOIN grades g ON g.student_id = u.id
+    LEFT JOIN absences a ON (g.student_id = a.student_id AND g.module_name = a.module_name 
+                            AND g.academic_year = a.academic_year AND g.semester = a.semester)
+    WHERE u.id = ?
+    ORDER BY g.academic_year, g.semester, g.module_name
+'''
+
+# Build a student's profile (grades, absences, risk, rank and evolution) in one pass over
+# their (module, grade, teacher, year, semester, absences) rows
+def build_student_profile(student_id, name, risk_level, grade_rows, ranking_index):
+    grades = []
+    total_absences = 0
+    periods = OrderedDict()
+    for module_name, grade, teacher_name, academic_year, semester, module_absences in grade_rows:
+        grades.append({
+            'module': module_name,
+            'grade': grade,
+            'status': 'Admis' if grade >= 10 else 'Non Admis',
+            'teacher': teacher_name,
+            'year': academic_year,
+            'semester': semester,
+            'absences': module_absences
+        })
+        total_absences += module_absences
+        period = periods.setdefault((academic_year, semester), [0.0, 0, 0])
+        period[0] += grade
+        period[1] += 1
+        period[2] += grade >= 10
+    
+    # Process data for visualization
+    evolution = [evolution_point(year, semester, *totals) for (year, semester), totals in periods.items()]
+    
+    return {
+        'student_id': student_id,
+        'name': name,
+        'grades': grades,
+        'total_absences': total_absences,
+        'risk_level': risk_level or 'low',
+        'ranking': ranking_index.rank(student_id),
+        'total_students': len(ranking_index),
+        'avg_grade': math.fsum(grade['grade'] for grade in grades) / len(grades) if grades else 0,
+        'evolution': evolution
+    }
+
+# Profile of one student, from a single query; the rank comes from the cached ranking index
+def get_student_profile(conn, student_id):
+    rows = conn.execute(STUDENT_PROFILE_QUERY, (student_id,)).fetchall()
+    if not rows:
+        return None
+    grade_rows = [row[2:] for row in rows if row[2] is not None]
+    return build_student_profile(student_id, rows[0][0], rows[0][1], grade_rows, get_ranking_index(conn))
+
+# Dimensions of the grade_cube rollup, and the request arguments that slice it
+CUBE_DIMENSIONS = ('academic_year', 'semester', 'module_name', 'teacher_name')
+CUBE_SLICE_ARGS = {'academic_year': 'academic_year', 'semester': 'semester',
+                   'module': 'module_name', 'teacher': 'teacher_name'}
+
+# Cube slice selected by the request arguments, e.g. {'academic_year': '2024-2025'}
+def get_cube_slice(args):
+    return {dimension: args[arg] for arg, dimension in CUBE_SLICE_ARGS.items() if args.get(arg)}
+
+# Summed columns of the grade_cube rollup
+CUBE_MEASURES = ('grade_sum', 'grade_count', 'pass_count', 'absence_total')
+
+# Roll the cube up to the given dimensions within a slice. Each row holds the group values
+# followed by the sums of the measures (by default grade_sum, grade_count, pass_count and
+# absence_total; grade_sq_sum can be asked for too).
+def rollup_grade_cube(conn, group_by=(), cube_slice=None, measures=CUBE_MEASURES):
+    for dimension in (*group_by, *(cube_slice or {})):
+        if dimension not in CUBE_DIMENSIONS:
+            raise ValueError(f'Unknown cube dimension: {dimension}')
+    
+    columns = [*group_by, *(f'COALESCE(SUM({measure}), 0)' for measure in measures)]
+    query = f"SELECT {', '.join(columns)} FROM grade_cube"
+    params = []
+    if cube_slice:
+        query += ' WHERE ' + ' AND '.join(f'{dimension} = ?' for dimension in cube_slice)
+        params.extend(cube_slice.values())
+    if group_by:
+        query += f" GROUP BY {', '.join(group_by)} ORDER BY {', '.join(group_by)}"
+    return conn.execute(query, params).fetchall()
+
+# Overall totals of a cube slice
+def get_cube_totals(conn, cube_slice=None):
+    grade_sum, grade_count, pass_count, absence_total = rollup_grade_cube(conn, cube_slice=cube_slice)[0]
+    return {
+        'avg_grade': grade_sum / grade_count if grade_count else 0,
+        'total_modules': grade_count,
+        'failed_modules': grade_count - pass_count,
+        'total_absences': absence_total
+    }
+
+# (name, average grade, grade count, pass rate %) per module or teacher of a cube slice,
+# best average first
+def get_cube_performance(conn, dimension, cube_slice=None):
+    performance = [
+        (name, grade_sum / grade_count, grade_count, pass_count / grade_count * 100)
+        for name, grade_sum, grade_count, pass_count, _ in rollup_grade_cube(conn, (dimension,), cube_slice)
+    ]
+    performance.sort(key=lambda row: row[1], reverse=True)
+    return performance
+
+# Average grade and success rate per academic year and semester of a cube slice
+def get_cube_evolution(conn, cube_slice=None):
+    return [
+        evolution_point(year, semester, grade_sum, total, passed)
+        for year, semester, grade_sum, total, passed, _ in rollup_grade_cube(conn, ('academic_year', 'semester'), cube_slice)
+    ]
+
+# Students evaluated per set-based round trip by the batch risk API and report cards
+COHORT_CHUNK_SIZE = 500
+
+# Cohort criteria from request arguments or a JSON body: ids (a list or comma-separated),
+# academic_year, class_id and risk. Raises ValueError for malformed ids.
+def parse_cohort_criteria(criteria):
+    ids = criteria.get('ids')
+    if isinstance(ids, str):
+        ids = [value for value in ids.split(',') if value.strip()]
+    try:
+        ids = [int(value) for value in ids] if ids is not None else None
+        class_id = int(criteria['class_id']) if criteria.get('class_id') else None
+    except (TypeError, ValueError):
+        raise ValueError('ids and class_id must be integers')
+    return {'ids': ids, 'academic_year': criteria.get('academic_year'), 'class_id': class_id,
+            'risk': criteria.get('risk')}
+
+# Select a cohort: explicit ids and/or academic year, class and risk level filters.
+# Returns (query, params) yielding (id, name, risk_level, avg_grade) rows.
+def student_cohort_query(ids=None, academic_year=None, class_id=None, risk=None):
+    query = '''
+        SELECT u.id, u.name, s.risk_level, s.avg_grade
+        FROM users u
+        JOIN student_summary s ON s.student_id = u.id
+    '''
+    conditions = ["u.role = 'student'"]
+    params = []
+    if class_id:
+        query += ' JOIN student_class sc ON sc.student_id = u.id AND sc.class_id = ?'
+        params.append(class_id)
+    if ids is not None:
+        conditions.append('u.id IN (SELECT value FROM json_each(?))')
+        params.append(json.dumps(ids))
+    if academic_year:
+        conditions.append('EXISTS (SELECT 1 FROM grades g WHERE g.student_id = u.id AND g.academic_year = ?)')
+        params.append(academic_year)
+    if risk:
+        conditions.append('s.risk_level = ?')
+        params.append(risk)
+    query += ' WHERE ' + ' AND '.join(conditions) + ' ORDER BY u.id'
+    return query, params
+
+# Risk, rank, average and evolution for every student of a cohort, one chunk at a time:
+# each chunk costs one grouped evolution query, and ranks come from the cached index
+def iter_student_risks(conn, query, params, chunk_size=COHORT_CHUNK_SIZE):
+    ranking_index = get_ranking_index(conn)
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    while True:
+        chunk = cursor.fetchmany(chunk_size)
+        if not chunk:
+            break
+        
+        evolution = defaultdict(list)
+        for student_id, year, semester, grade_sum, total, passed in conn.execute('''
+            SELECT student_id, academic_year, semester, SUM(grade), COUNT(*), COUNT(CASE WHEN grade >= 10 THEN 1 END)
+            FROM grades
+            WHERE student_id IN (SELECT value FROM json_each(?))
+            GROUP BY student_id, academic_year, semester
+            ORDER BY student_id, academic_year, semester
+        ''', (json.dumps([row[0] for row in chunk]),)):
+            evolution[student_id].append(evolution_point(year, semester, grade_sum, total, passed))
+        
+        for student_id, name, risk_level, avg_grade in chunk:
+            yield {
+                'student_id': student_id,
+                'name': name,
+                'risk_level': risk_level,
+                'ranking': ranking_index.rank(student_id),
+                'total_students': len(ranking_index),
+                'avg_grade': avg_grade or 0,
+                'evolution_data': evolution[student_id]
+            }
+
+# Grade rows of many students at once, in profile order
+STUDENT_GRADES_BATCH_QUERY = '''
+    SELECT g.student_id, g.module_name, g.grade, g.teacher_name, g.academic_year, g.semester,
+           COALESCE(a.count, 0) as absences
+    FROM grades g
+    LEFT JOIN absences a ON (g.student_id = a.student_id AND g.module_name = a.module_name 
+                            AND g.academic_year = a.academic_year AND g.semester = a.semester)
+    WHERE g.student_id IN (SELECT value FROM json_each(?))
+    ORDER BY g.student_id, g.academic_year, g.semester, g.module_name
+'''
+
+# Full profiles for every student of a cohort query, with one grade query per chunk
+def iter_student_profiles(conn, query, params, chunk_size=COHORT_CHUNK_SIZE):
+    ranking_index = get_ranking_index(conn)
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    while True:
+        chunk = cursor.fetchmany(chunk_size)
+        if not chunk:
+            break
+        
+        grade_rows = defaultdict(list)
+        for student_id, *row in conn.execute(STUDENT_GRADES_BATCH_QUERY, (json.dumps([row[0] for row in chunk]),)):
+            grade_rows[student_id].append(row)
+        
+        for student_id, name, risk_level, _ in chunk:
+            yield build_student_profile(student_id, name, risk_level, grade_rows[student_id], ranking_index)
+
+# Grade distribution statistics. Group counts, means, dispersion and pass rates come from
+# the cube sums; percentiles and histograms from the grade column as a NumPy array.
+PASS_MARK = 10
+GRADE_HISTOGRAM_BINS = np.arange(0, 22, 2)  # 0-2, 2-4, ..., 18-20 (a 20 falls in the last bin)
+GRADE_PERCENTILES = (10, 25, 50, 75, 90)
+STATISTICS_DIMENSIONS = ('module_name', 'semester', 'teacher_name')
+
+# search_terms kind cataloguing the values of each cube dimension
+DIMENSION_TERM_KINDS = {'academic_year': 'academic_year', 'semester': 'semester',
+                        'module_name': 'module', 'teacher_name': 'teacher'}
+
+# Grades of a cube slice as a float array, plus an integer code per grade for each requested
+# dimension: the search_terms id of its value, or 0 for a blank value
+def load_grade_arrays(conn, dimensions=(), cube_slice=None):
+    columns = ['g.grade']
+    joins = []
+    for i, dimension in enumerate(dimensions):
+        columns.append(f'COALESCE(t{i}.id, 0)')
+        joins.append(f"LEFT JOIN search_terms t{i} ON t{i}.kind = '{DIMENSION_TERM_KINDS[dimension]}' "
+                     f"AND t{i}.value = g.{dimension}")
+    query = f"SELECT {', '.join(columns)} FROM grades g {' '.join(joins)}"
+    params = []
+    if cube_slice:
+        query += ' WHERE ' + ' AND '.join(f"COALESCE(g.{dimension}, '') = ?" for dimension in cube_slice)
+        params.extend(cube_slice.values())
+    
+    if not dimensions:
+        return np.fromiter((row[0] for row in conn.execute(query, params)), dtype=np.float64), {}
+    dtype = [('grade', np.float64), *((dimension, np.int64) for dimension in dimensions)]
+    table = np.fromiter(conn.execute(query, params), dtype=dtype)
+    return table['grade'], {dimension: table[dimension] for dimension in dimensions}
+
+# Count, mean, dispersion, percentiles, pass rate and histogram of a grade array
+def describe_grades(grades):
+    if not grades.size:
+        return {'count': 0, 'mean': None, 'std': None, 'min': None, 'max': None, 'pass_rate': None,
+                'percentiles': {}, 'histogram': []}
+    
+    counts, edges = np.histogram(grades, bins=GRADE_HISTOGRAM_BINS)
+    return {
+        'count': int(grades.size),
+        'mean': round(float(grades.mean()), 2),
+        'std': round(float(grades.std()), 2),
+        'min': float(grades.min()),
+        'max': float(grades.max()),
+        'pass_rate': round(float((grades >= PASS_MARK).mean() * 100), 1),
+        'percentiles': {f'p{p}': round(float(value), 2)
+                        for p, value in zip(GRADE_PERCENTILES, np.percentile(grades, GRADE_PERCENTILES))},
+        'histogram': [{'from': int(low), 'to': int(high), 'count': int(count)}
+                      for low, high, count in zip(edges[:-1], edges[1:], counts)]
+    }
+
+# Percentile p of every group at once, from grades sorted by group then value
+# (linear interpolation, as np.percentile does)
+def group_percentile(sorted_grades, starts, counts, p):
+    position = starts + (counts - 1) * (p / 100)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, starts + counts - 1)
+    return sorted_grades[lower] + (sorted_grades[upper] - sorted_grades[lower]) * (position - lower)
+
+# Per-group statistics for one dimension of a cube slice, given the slice's grades and their
+# codes for that dimension. z_score places each group's mean relative to the whole slice,
+# in standard deviations of the slice.
+def describe_groups(conn, dimension, grades, codes, cube_slice=None):
+    rows = rollup_grade_cube(conn, (dimension,), cube_slice,
+                             measures=('grade_sum', 'grade_sq_sum', 'grade_count', 'pass_count'))
+    if not rows:
+        return []
+    
+    names = [row[0] for row in rows]
+    grade_sums, square_sums, counts, pass_counts = np.array([row[1:] for row in rows], dtype=np.float64).T
+    means = grade_sums / counts
+    stds = np.sqrt(np.maximum(square_sums / counts - means ** 2, 0))
+    pass_rates = pass_counts / counts * 100
+    
+    overall_mean = grade_sums.sum() / counts.sum()
+    overall_std = np.sqrt(max(square_sums.sum() / counts.sum() - overall_mean ** 2, 0))
+    z_scores = (means - overall_mean) / overall_std if overall_std > 0 else np.zeros(len(names))
+    
+    # Medians: sort the grades by (code, grade) and pick each group's middle
+    term_ids = dict(conn.execute('SELECT value, id FROM search_terms WHERE kind = ?',
+                                 (DIMENSION_TERM_KINDS[dimension],)).fetchall())
+    group_codes = np.array([term_ids.get(name, 0) for name in names], dtype=np.int64)
+    code_counts = np.bincount(codes, minlength=group_codes.max() + 1)
+    starts = np.cumsum(code_counts) - code_counts
+    medians = group_percentile(grades[np.lexsort((grades, codes))], starts[group_codes], code_counts[group_codes], 50)
+    
+    return [
+        {
+            'name': name,
+            'count': int(count),
+            'mean': round(float(mean), 2),
+            'std': round(float(std), 2),
+            'median': round(float(median), 2),
+            'pass_rate': round(float(pass_rate), 1),
+            'z_score': round(float(z_score), 2)
+        }
+        for name, count, mean, std, median, pass_rate, z_score
+        in zip(names, counts, means, stds, medians, pass_rates, z_scores)
+    ]
+
+# Distribution of a cube slice overall and per module, semester and teacher
+def get_grade_statistics(conn, cube_slice=None, dimensions=STATISTICS_DIMENSIONS):
+    grades, codes = load_grade_arrays(conn, dimensions, cube_slice)
+    return {
+        'overall': describe_grades(grades),
+        'groups': {dimension: describe_groups(conn, dimension, grades, codes[dimension], cube_slice)
+                   for dimension in dimensions}
+    }
+
+# Students at any configured risk level, with the level the summary triggers derived
+AT_RISK_STUDENTS_QUERY = '''
+    SELECT u.name, s.avg_grade, s.total_absences as absences, s.risk_level
+    FROM student_summary s
+    JOIN users u ON u.id = s.student_id
+    WHERE s.risk_level != 'low'
+    ORDER BY s.student_id
+'''
+
+TABLE_ROW_HEIGHT = 7
+TABLE_SAMPLE_ROWS = 200
+
+class ReportPDF(FPDF):
+    """School-wide performance report layout"""
+
+    report_title = 'School Management System - Performance Report'
+
+    def header(self):
+        # Logo - if you have one
+        # self.image('logo.png', 10, 8, 33)
+        self.set_font('Arial', 'B', 15)
+        self.cell(0, 10, self.report_title, 0, 1, 'C')
+        self.set_font('Arial', 'I', 10)
+        self.cell(0, 10, f'Generated on {datetime.now().strftime("%d/%m/%Y")}', 0, 1, 'C')
+        self.ln(5)
+    
+    def footer(self):
+        self.set_y(-15)
+        self.set_font('Arial', 'I', 8)
+        self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
+    
+    def section_title(self, title):
+        self.set_font('Arial', 'B', 12)
+        self.set_fill_color(100, 149, 237)  # Cornflower blue
+        self.cell(0, 10, title, 0, 1, 'L', True)
+        self.ln(5)
+    
+    def table_header(self, headers, col_widths):
+        self.set_font('Arial', 'B', 10)
+        self.set_fill_color(200, 220, 255)
+        for header, col_width in zip(headers, col_widths):
+            self.cell(col_width, TABLE_ROW_HEIGHT, header, border=1, align='C', fill=True)
+        self.ln()
+    
+    def column_widths(self, headers, sample):
+        # Widest header or sampled value per column, scaled to the printable width
+        self.set_font('Arial', 'B', 10)
+        col_widths = [self.get_string_width(header) for header in headers]
+        self.set_font('Arial', '', 9)
+        for row in sample:
+            for i, item in enumerate(row):
+                col_widths[i] = max(col_widths[i], self.get_string_width(item))
+        col_widths = [width + 2 * self.c_margin for width in col_widths]
+        scale = self.epw / sum(col_widths)
+        return [width * scale for width in col_widths]
+    
+    def table_page(self, rows, col_widths):
+        # Lay out a page worth of rows at once: one grid line per row and column edge,
+        # then the text column by column, clipped so long values cannot spill over
+        self.set_font('Arial', '', 9)
+        # Matching the fill to the text colour spares text() a colour save/restore per cell
+        self.set_fill_color(0)
+        top = self.get_y()
+        bottom = top + len(rows) * TABLE_ROW_HEIGHT
+        edges = list(accumulate(col_widths, initial=self.l_margin))
+        
+        for i in range(1, len(rows) + 1):
+            self.line(edges[0], top + i * TABLE_ROW_HEIGHT, edges[-1], top + i * TABLE_ROW_HEIGHT)
+        for x in edges:
+            self.line(x, top, x, bottom)
+        
+        baseline = top + TABLE_ROW_HEIGHT / 2 + 0.3 * self.font_size
+        for i, col_width in enumerate(col_widths):
+            x = edges[i] + self.c_margin
+            with self.rect_clip(edges[i], top, col_width, bottom - top):
+                for j, row in enumerate(rows):
+                    self.text(x, baseline + j * TABLE_ROW_HEIGHT, row[i])
+        self.set_y(bottom)
+    
+    def data_table(self, headers, rows):
+        # Column widths are measured once from the first TABLE_SAMPLE_ROWS rows; rows are
+        # then laid out a page at a time with the header repeated on every page
+        rows = (['N/A' if item is None else str(item) for item in row] for row in rows)
+        sample = list(islice(rows, TABLE_SAMPLE_ROWS))
+        col_widths = self.column_widths(headers, sample)
+        rows = chain(sample, rows)
+        
+        row = next(rows, None)
+        while row is not None:
+            fits = int((self.page_break_trigger - self.get_y()) // TABLE_ROW_HEIGHT) - 1
+            if fits < 1:
+                self.add_page()
+                continue
+            page_rows = [row, *islice(rows, fits - 1)]
+            row = next(rows, None)
+            self.table_header(headers, col_widths)
+            self.table_page(page_rows, col_widths)
+
+# Render the school-wide PDF report to path, reporting progress as a 0-1 fraction
+def render_pdf_report(conn, path, progress=None, params=None):
+    cursor = conn.cursor()
+    
+    # Get overall statistics
+    cursor.execute('SELECT COUNT(*) FROM users WHERE role = "student"')
+    total_students = cursor.fetchone()[0]
+    
+    totals = get_cube_totals(conn)
+    overall_avg = totals['avg_grade']
+    failed_modules = totals['failed_modules']
+    total_modules = totals['total_modules']
+    
+    success_rate = ((total_modules - failed_modules) / total_modules * 100) if total_modules > 0 else 0
+    
+    # Get at-risk students for the report
+    cursor.execute(AT_RISK_STUDENTS_QUERY)
+    at_risk_students = cursor.fetchall()
+    
+    # Get module performance
+    module_performance = get_cube_performance(conn, 'module_name')
+    
+    if progress:
+        progress(0.1)
+    
+    # Initialize PDF
+    pdf = ReportPDF()
+    pdf.set_auto_page_break(True, margin=15)
+    pdf.add_page()
+    
+    # Summary section
+    pdf.section_title('Performance Summary')
+    pdf.set_font('Arial', '', 10)
+    pdf.cell(40, 10, f'Total Students: {total_students}', 0, 0)
+    pdf.cell(60, 10, f'Overall Average: {overall_avg:.2f}/20', 0, 0)
+    pdf.cell(50, 10, f'Success Rate: {success_rate:.1f}%', 0, 0)
+    pdf.cell(40, 10, f'Failed Modules: {failed_modules}/{total_modules}', 0, 1)
+    pdf.ln(5)
+    
+    # Students at Risk section
+    if at_risk_students:
+        pdf.add_page()
+        pdf.section_title('Students at Risk')
+        
+        # Table data
+        def at_risk_rows():
+            for name, avg_grade, absences, risk_level in at_risk_students:
+                recommendation = "Weekly tutoring + checks" if risk_level == 'high' else "Study groups + practice"
+                yield [name, f"{avg_grade or 0:.2f}/20", str(absences or 0), risk_level.title(), recommendation]
+        
+        headers = ['Student Name', 'Average Grade', 'Absences', 'Risk Level', 'Recommendations']
+        pdf.data_table(headers, at_risk_rows())
+        pdf.ln(10)
+    
+    # Module Performance section
+    if module_performance:
+        pdf.add_page()
+        pdf.section_title('Module Performance')
+        
+        headers = ['Module', 'Average Grade', 'Students', 'Success Rate']
+        pdf.data_table(headers, ([
+            module_name, 
+            f"{avg_grade:.2f}/20", 
+            str(student_count), 
+            f"{pass_rate:.1f}%"
+        ] for module_name, avg_grade, student_count, pass_rate in module_performance))
+        pdf.ln(10)
+    
+    if progress:
+        progress(0.2)
+    
+    # Student Performance Data section
+    pdf.add_page()
+    pdf.section_title('Student Performance Data')
+    
+    # One export row per grade, plus one for each student without grades
+    expected_rows = max(total_modules + total_students, 1)
+    
+    # Table data (limited to key columns), streamed from the cursor
+    def performance_rows():
+        cursor.execute(EXPORT_QUERY)
+        for count, student in enumerate(iter_cursor(cursor), 1):
+            yield [
+                student[0],    # name
+                student[1],    # email
+                student[2] or 'N/A',   # module
+                f"{student[3]:.2f}" if student[3] else 'N/A',  # grade
+                student[4] or 'N/A',   # teacher
+                str(student[7] or '0')  # absences
+            ]
+            if progress and count % EXPORT_FETCH_SIZE == 0:
+                progress(0.2 + 0.7 * min(count / expected_rows, 1))
+    
+    # Limit columns to fit on page - show most important ones
+    headers = ['Name', 'Email', 'Module', 'Grade', 'Teacher', 'Absences']
+    pdf.data_table(headers, performance_rows())
+    
+    pdf.output(path)
+
+class ReportCardPDF(ReportPDF):
+    """Individual student report card layout"""
+
+    report_title = 'School Management System - Student Report Card'
+
+# Render one student's report card from their profile; runs in a report card worker process
+def render_report_card(profile):
+    pdf = ReportCardPDF()
+    pdf.set_auto_page_break(True, margin=15)
+    pdf.add_page()
     
-    # Get student's average grade
-    cursor.execute('''
-        SELECT AVG(grade) FROM grades WHERE student_id = ?
-    ''', (student_id,))
-    avg_grade = cursor.fetchone()[0] or 0
+    pdf.section_title(profile['name'])
+    pdf.set_font('Arial', '', 10)
+    ranking = f"{profile['ranking']}/{profile['total_students']}" if profile['ranking'] else '-'
+    pdf.cell(50, 10, f"Average: {profile['avg_grade']:.2f}/20", 0, 0)
+    pdf.cell(40, 10, f'Ranking: {ranking}', 0, 0)
+    pdf.cell(50, 10, f"Risk Level: {profile['risk_level'].title()}", 0, 0)
+    pdf.cell(40, 10, f"Absences: {profile['total_absences']}", 0, 1)
+    pdf.ln(5)
     
-    # Get student's total absences across all modules
-    cursor.execute('SELECT SUM(count) FROM absences WHERE student_id = ?', (student_id,))
-    total_absences_result = cursor.fetchone()
-    total_absences = total_absences_result[0] if total_absences_result and total_absences_result[0] else 0
+    if profile['grades']:
+        pdf.section_title('Grades')
+        pdf.data_table(['Module', 'Grade', 'Status', 'Absences', 'Teacher', 'Period'], ([
+            grade['module'],
+            f"{grade['grade']:.2f}/20",
+            grade['status'],
+            str(grade['absences']),
+            grade['teacher'] or 'N/A',
+            f"{grade['year']} S{grade['semester']}"
+        ] for grade in profile['grades']))
+        pdf.ln(10)
     
-    # Get risk thresholds
-    cursor.execute('SELECT min_grade, max_absences FROM risk_thresholds LIMIT 1')
-    threshold = cursor.fetchone()
-    min_grade, max_absences = threshold if threshold else (10.0, 10)
+    if profile['evolution']:
+        pdf.section_title('Performance Evolution')
+        pdf.data_table(['Period', 'Average Grade', 'Success Rate'], (
+            [point['period'], f"{point['avg_grade']:.2f}/20", f"{point['success_rate']:.1f}%"]
+            for point in profile['evolution']
+        ))
     
-    conn.close()
+    return bytes(pdf.output())
+
+# Archive member name for a student's report card, e.g. 00042_Alice_Martin.pdf
+def report_card_filename(profile):
+    name = re.sub(r'[^\w.-]+', '_', profile['name'])
+    return f"{profile['student_id']:05d}_{name}.pdf"
+
+_report_card_pool = None
+_report_card_pool_lock = threading.Lock()
+
+# Get the process pool that renders report cards (REPORT_CARD_WORKERS, default one per core)
+def get_report_card_pool():
+    global _report_card_pool
+    if _report_card_pool is None:
+        with _report_card_pool_lock:
+            if _report_card_pool is None:
+                _report_card_pool = ProcessPoolExecutor(
+                    max_workers=app.config.get('REPORT_CARD_WORKERS') or os.cpu_count(),
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+    return _report_card_pool
+
+# Render report cards across the process pool, one student per task, yielding
+# (filename, pdf bytes) in cohort order with a bounded number of tasks in flight
+def iter_report_cards(profiles):
+    pool = get_report_card_pool()
+    max_pending = 4 * (app.config.get('REPORT_CARD_WORKERS') or os.cpu_count())
+    pending = deque()
+    for profile in profiles:
+        pending.append((report_card_filename(profile), pool.submit(render_report_card, profile)))
+        if len(pending) >= max_pending:
+            filename, future = pending.popleft()
+            yield filename, future.result()
+    while pending:
+        filename, future = pending.popleft()
+        yield filename, future.result()
+
+class ZipChunkStream(io.RawIOBase):
+    """Write-only, unseekable sink that hands the bytes zipfile writes to a response"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+# Stream a ZIP of report cards chunk by chunk, one member per student
+def iter_report_card_zip(cards):
+    stream = ZipChunkStream()
+    # PDF page streams are already compressed, so members are stored as-is
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+        for filename, pdf_bytes in cards:
+            archive.writestr(filename, pdf_bytes)
+            yield stream.take()
+    yield stream.take()
+
+# Write the report cards of a cohort to an on-disk ZIP archive (report job renderer)
+def render_report_card_archive(conn, path, progress=None, params=None):
+    query, query_params = student_cohort_query(**parse_cohort_criteria(params or {}))
+    total = max(conn.execute(f'SELECT COUNT(*) FROM ({query})', query_params).fetchone()[0], 1)
     
-    # Calculate risk level
-    if avg_grade < min_grade and total_absences > max_absences:
-        return 'high'
-    elif avg_grade < min_grade or total_absences > max_absences:
-        return 'medium'
-    else:
-        return 'low'
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+        cards = iter_report_cards(iter_student_profiles(conn, query, query_params))
+        for count, (filename, pdf_bytes) in enumerate(cards, 1):
+            archive.writestr(filename, pdf_bytes)
+            if progress:
+                progress(count / total)
 
-# Get student ranking
-def get_student_ranking(student_id):
-    conn = sqlite3.connect('school.db')
-    cursor = conn.cursor()
+# Report job renderers: format -> (file extension, render(conn, path, progress, params))
+REPORT_RENDERERS = {
+    'pdf': ('pdf', render_pdf_report),
+    'excel': ('xlsx', lambda conn, path, progress, params: write_excel_export(conn.execute(EXPORT_QUERY), path)),
+    'report_cards': ('zip', render_report_card_archive),
+}
+
+class ExportCache:
+    """Finished export files on disk, content-addressed by export_cache_key.
+
+    Recency is the file's mtime (touched on every hit), so the cache survives restarts
+    and is shared by every worker process; once the files exceed max_bytes the least
+    recently used ones are deleted.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, f'{key}.{extension}')
+
+    def get(self, key, extension):
+        path = self.path(key, extension)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, extension, render):
+        # render(path) writes a temporary file that is moved into place once complete
+        os.makedirs(self.directory, exist_ok=True)
+        fd, part = tempfile.mkstemp(suffix='.part', dir=self.directory)
+        os.close(fd)
+        path = self.path(key, extension)
+        try:
+            render(part)
+            os.replace(part, path)
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+        self.evict(keep=path)
+        return path
+
+    def put_stream(self, key, extension, chunks):
+        # Pass a response body through while writing it to the cache; a stream that is
+        # interrupted (client gone, error) leaves nothing behind
+        os.makedirs(self.directory, exist_ok=True)
+        fd, part = tempfile.mkstemp(suffix='.part', dir=self.directory)
+        path = self.path(key, extension)
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk.encode() if isinstance(chunk, str) else chunk)
+                    yield chunk
+            os.replace(part, path)
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith('.part') and entry.path != keep:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            size = sum(entry_size for _, entry_size, _ in entries)
+            if keep is not None and os.path.exists(keep):
+                size += os.path.getsize(keep)
+            
+            for _, entry_size, path in sorted(entries):
+                if size <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass  # evicted by another worker
+                size -= entry_size
+
+_export_caches = {}
+
+# Export cache in REPORTS_DIR, bounded by EXPORT_CACHE_MAX_BYTES (default 512 MB)
+def get_export_cache():
+    directory = os.path.abspath(app.config.get('REPORTS_DIR', 'reports'))
+    cache = _export_caches.get(directory)
+    if cache is None:
+        max_bytes = app.config.get('EXPORT_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+        cache = _export_caches.setdefault(directory, ExportCache(directory, max_bytes))
+    return cache
+
+# Cache key of an export: the same database, format, parameters and data version
+# always produce the same file
+def export_cache_key(format_type, params, data_version):
+    params_json = json.dumps(params, sort_keys=True)
+    key = f"{app.config['DATABASE']}:{format_type}:{params_json}:{data_version}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+_report_executor = None
+_report_executor_lock = threading.Lock()
+
+# Get the background pool that renders report jobs
+def get_report_executor():
+    global _report_executor
+    if _report_executor is None:
+        with _report_executor_lock:
+            if _report_executor is None:
+                _report_executor = ThreadPoolExecutor(
+                    max_workers=app.config.get('REPORT_WORKERS', 2),
+                    thread_name_prefix='report-job'
+                )
+    return _report_executor
+
+# Public view of a report_jobs row
+def report_job_payload(row):
+    job_id, format_type, status, progress, error = row
+    payload = {
+        'job_id': job_id,
+        'format': format_type,
+        'status': status,
+        'progress': round(progress, 3),
+        'status_url': url_for('report_job_status', job_id=job_id),
+    }
+    if status == 'done':
+        payload['download_url'] = url_for('report_job_download', job_id=job_id)
+    if error:
+        payload['error'] = error
+    return payload
+
+# Queue a report job, or return the in-flight job that has the same format and parameters
+def enqueue_report_job(format_type, params):
+    params_json = json.dumps(params, sort_keys=True)
+    params_key = hashlib.sha256(f'{format_type}:{params_json}'.encode()).hexdigest()
+    conn = get_db()
     
-    # Get all students with their average grades
-    cursor.execute('''
-        SELECT u.id, u.name, AVG(g.grade) as avg_grade
-        FROM users u
-        LEFT JOIN grades g ON u.id = g.student_id
-        WHERE u.role = 'student'
-        GROUP BY u.id, u.name
-        ORDER BY avg_grade DESC
-    ''')
+    job_id = uuid.uuid4().hex
     
-    students = cursor.fetchall()
-    conn.close()
+    # An export of unchanged data is already on disk: record it as a finished job
+    extension, _ = REPORT_RENDERERS[format_type]
+    cached_path = get_export_cache().get(export_cache_key(format_type, params, get_data_version(conn)), extension)
+    if cached_path:
+        write_db(lambda cursor: cursor.execute('''
+            INSERT INTO report_jobs (id, format, params, params_key, status, progress, artifact_path, finished_at)
+            VALUES (?, ?, ?, ?, 'done', 1.0, ?, ?)
+        ''', (job_id, format_type, params_json, params_key, cached_path, datetime.now().isoformat())))
+        return report_job_payload((job_id, format_type, 'done', 1.0, None))
     
-    # Find student's position
-    for i, (sid, name, avg_grade) in enumerate(students, 1):
-        if sid == student_id:
-            return i, len(students), avg_grade or 0
+    try:
+        write_db(lambda cursor: cursor.execute('''
+            INSERT INTO report_jobs (id, format, params, params_key, status)
+            VALUES (?, ?, ?, ?, 'queued')
+        ''', (job_id, format_type, params_json, params_key)))
+        get_report_executor().submit(run_report_job, job_id, format_type)
+    except sqlite3.IntegrityError:
+        # The partial unique index allows one queued/running job per parameter set
+        pass
     
-    return None, len(students), 0
+    row = conn.execute('''
+        SELECT id, format, status, progress, error FROM report_jobs
+        WHERE params_key = ? AND status IN ('queued', 'running')
+        ORDER BY created_at DESC LIMIT 1
+    ''', (params_key,)).fetchone()
+    if row is None:
+        # The job finished between the insert and this read
+        row = conn.execute('SELECT id, format, status, progress, error FROM report_jobs WHERE id = ?',
+                           (job_id,)).fetchone()
+    return report_job_payload(row)
 
-# Get student performance evolution over semesters
-def get_student_evolution(student_id):
-    conn = sqlite3.connect('school.db')
-    cursor = conn.cursor()
+# Render one report job in a background thread
+def run_report_job(job_id, format_type):
+    conn = get_pool().acquire()
     
-    # Get student's grades across semesters
-    cursor.execute('''
-        SELECT academic_year, semester, AVG(grade) as avg_grade,
-               COUNT(CASE WHEN grade >= 10 THEN 1 END) as passed,
-               COUNT(*) as total
-        FROM grades
-        WHERE student_id = ?
-        GROUP BY academic_year, semester
-        ORDER BY academic_year, semester
-    ''', (student_id,))
-    
-    evolution_data = cursor.fetchall()
-    conn.close()
+    def update(**fields):
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        write_db(lambda cursor: cursor.execute(f'UPDATE report_jobs SET {assignments} WHERE id = ?',
+                                               (*fields.values(), job_id)))
     
-    # Process data for visualization
-    result = []
-    for year, semester, avg_grade, passed, total in evolution_data:
-        success_rate = (passed / total * 100) if total > 0 else 0
-        result.append({
-            'period': f"{year} S{semester}",
-            'avg_grade': round(avg_grade, 2) if avg_grade else 0,
-            'success_rate': round(success_rate, 1)
-        })
+    last_reported = [0.0]
+    def progress(fraction):
+        # Throttle progress writes to every 5%
+        if fraction - last_reported[0] >= 0.05:
+            last_reported[0] = fraction
+            update(progress=fraction)
     
-    return result
+    try:
+        update(status='running')
+        extension, render = REPORT_RENDERERS[format_type]
+        params = json.loads(conn.execute('SELECT params FROM report_jobs WHERE id = ?', (job_id,)).fetchone()[0])
+        
+        # The artifact goes into the export cache under the data version it was rendered from
+        key = export_cache_key(format_type, params, get_data_version(conn))
+        path = get_export_cache().put(key, extension, lambda part: render(conn, part, progress, params))
+        update(status='done', progress=1.0, artifact_path=path, finished_at=datetime.now().isoformat())
+    except Exception as e:
+        app.logger.exception('Report job %s failed', job_id)
+        update(status='failed', error=str(e), finished_at=datetime.now().isoformat())
+    finally:
+        get_pool().release(conn)
+
+# Grade filters shared by the admin dashboard and its module-row endpoint
+def admin_dashboard_filters():
+    return {
+        'academic_year': request.args.get('academic_year', '2024-2025'),
+        'module': request.args.get('module', ''),
+        'teacher': request.args.get('teacher', ''),
+        'semester': request.args.get('semester', ''),
+    }
+
+# Filter dropdown values with the number of grade rows each one matches, read in one pass
+# from the trigger-maintained search_terms catalogue
+FACET_KINDS = ('academic_year', 'module', 'teacher', 'semester')
+
+def get_filter_facets(conn):
+    facets = {kind: [] for kind in FACET_KINDS}
+    for kind, value, refs in conn.execute('SELECT kind, value, refs FROM search_terms ORDER BY kind, value'):
+        facets[kind].append((value, refs))
+    return facets
+
+# FTS5 query matching every word of the text as a prefix, or None when it has no words
+def fts_prefix_query(text):
+    words = re.findall(r'[^\W_]+', text)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+# Condition restricting a module/teacher column: a known catalogue value (what the
+# dropdowns send) matches exactly, free-typed text matches the search terms by prefix
+def search_term_condition(conn, column, kind, text):
+    known = conn.execute('SELECT 1 FROM search_terms WHERE kind = ? AND value = ?', (kind, text)).fetchone()
+    if known:
+        return f'{column} = ?', text
+    match = fts_prefix_query(text)
+    if match is None:
+        return f'{column} LIKE ?', f'%{text}%'
+    return f'''{column} IN (
+        SELECT value FROM search_terms WHERE kind = '{kind}'
+        AND id IN (SELECT rowid FROM search_terms_fts WHERE search_terms_fts MATCH ?))''', match
+
+# Condition restricting the users alias u to students whose name or email matches the text
+def student_search_condition(text):
+    match = fts_prefix_query(text)
+    if match is None:
+        return '(u.name LIKE ? OR u.email LIKE ?)', [f'%{text}%', f'%{text}%']
+    return 'u.id IN (SELECT rowid FROM students_fts WHERE students_fts MATCH ?)', [match]
+
+# SQL conditions on the grades alias g for the admin dashboard filters
+def grade_filter_conditions(conn, filters):
+    conditions = []
+    params = []
+    if filters['academic_year']:
+        conditions.append('g.academic_year = ?')
+        params.append(filters['academic_year'])
+    for kind, column in (('module', 'g.module_name'), ('teacher', 'g.teacher_name')):
+        if filters[kind]:
+            condition, param = search_term_condition(conn, column, kind, filters[kind])
+            conditions.append(condition)
+            params.append(param)
+    if filters['semester']:
+        conditions.append('g.semester = ?')
+        params.append(filters['semester'])
+    return conditions, params
 
 # Routes
 @app.route('/')
@@ -247,11 +2807,10 @@ def login():
             return redirect(url_for('admin_dashboard'))
         
         # Check for student login
-        conn = sqlite3.connect('school.db')
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('SELECT id, name, password, role FROM users WHERE email = ?', (email,))
         user = cursor.fetchone()
-        conn.close()
         
         if user and user[2] == hash_password(password):
             session['user_id'] = user[0]
@@ -270,26 +2829,23 @@ def register():
         email = request.form['email']
         password = request.form['password']
         
-        conn = sqlite3.connect('school.db')
-        cursor = conn.cursor()
-        
-        # Check if email already exists
-        cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
-        if cursor.fetchone():
-            flash('Email already registered')
-            conn.close()
-            return render_template('register.html')
-        
-        # Insert new user
         hashed_password = hash_password(password)
-        cursor.execute('INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)', 
-                      (name, email, hashed_password, 'student'))
         
-        # Create default absence record for new student
-        student_id = cursor.lastrowid
+        # The email check and the insert run together on the writer thread
+        def create_student(cursor):
+            # Check if email already exists
+            cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
+            if cursor.fetchone():
+                return None
+            
+            # Insert new user
+            cursor.execute('INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)', 
+                          (name, email, hashed_password, 'student'))
+            return cursor.lastrowid
         
-        conn.commit()
-        conn.close()
+        if write_db(create_student) is None:
+            flash('Email already registered')
+            return render_template('register.html')
         
         flash('Registration successful! Please login.')
         return redirect(url_for('login'))
@@ -300,7 +2856,10 @@ def register():
 @admin_required
 def admin_dashboard():
     if request.method == 'POST':
-        student_id = request.form['student_id']
+        student_id = request.form.get('student_id', type=int)
+        if student_id is None:
+            flash('Please choose a student from the suggestions.')
+            return redirect(url_for('admin_dashboard'))
         module_name = request.form['module_name']
         grade = request.form['grade']
         absences = request.form['absences']
@@ -308,723 +2867,540 @@ def admin_dashboard():
         academic_year = request.form.get('academic_year', '2024-2025')
         semester = request.form.get('semester', '1')
         
-        conn = sqlite3.connect('school.db')
-        cursor = conn.cursor()
-        
-        # Update or insert grade
-        cursor.execute('SELECT id FROM grades WHERE student_id = ? AND module_name = ? AND academic_year = ? AND semester = ?', 
-                      (student_id, module_name, academic_year, semester))
-        existing_grade = cursor.fetchone()
-        
-        if existing_grade:
-            cursor.execute('''
-                UPDATE grades 
-                SET grade = ?, teacher_name = ? 
-                WHERE student_id = ? AND module_name = ? AND academic_year = ? AND semester = ?
-            ''', (grade, teacher_name, student_id, module_name, academic_year, semester))
-        else:
-            cursor.execute('''
-                INSERT INTO grades 
-                (student_id, module_name, grade, teacher_name, academic_year, semester) 
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (student_id, module_name, grade, teacher_name, academic_year, semester))
-        
-        # Update or insert module-specific absences
-        cursor.execute('''
-            SELECT id FROM absences 
-            WHERE student_id = ? AND module_name = ? AND academic_year = ? AND semester = ?
-        ''', (student_id, module_name, academic_year, semester))
-        
-        existing_absence = cursor.fetchone()
-        
-        if existing_absence:
-            cursor.execute('''
-                UPDATE absences 
-                SET count = ? 
-                WHERE student_id = ? AND module_name = ? AND academic_year = ? AND semester = ?
-            ''', (absences, student_id, module_name, academic_year, semester))
-        else:
-            cursor.execute('''
-                INSERT INTO absences 
-                (student_id, module_name, count, academic_year, semester) 
-                VALUES (?, ?, ?, ?, ?)
-            ''', (student_id, module_name, absences, academic_year, semester))
+        # Upsert the grade and the module-specific absences
+        def save_grade(cursor):
+            cursor.execute(GRADE_UPSERT_SQL, (student_id, module_name, grade, teacher_name, academic_year, semester))
+            cursor.execute(ABSENCE_UPSERT_SQL, (student_id, module_name, absences, academic_year, semester))
         
-        conn.commit()
-        conn.close()
+        write_db(save_grade)
         
         flash('Student data updated successfully!')
         return redirect(url_for('admin_dashboard'))
     
     # Get filter parameters
-    academic_year = request.args.get('academic_year', '2024-2025')
-    module_filter = request.args.get('module', '')
-    teacher_filter = request.args.get('teacher', '')
+    filters = admin_dashboard_filters()
     risk_filter = request.args.get('risk', '')
-    semester_filter = request.args.get('semester', '')
+    student_filter = request.args.get('student', '').strip()
+    
+    # Keyset pagination on (name, id): the page starts after the last row of the previous one
+    page_size = min(max(request.args.get('page_size', app.config.get('ADMIN_PAGE_SIZE', 50), type=int), 1), 500)
+    after_name = request.args.get('after_name')
+    after_id = request.args.get('after_id', type=int)
     
-    # Get all students with their grades and absences
-    conn = sqlite3.connect('school.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Build query with filters
     query = '''
-        SELECT u.id, u.name, u.email, 
-               g.module_name,
-               g.grade,
-               COALESCE(a.count, 0) as absences,
-               g.teacher_name,
-               g.academic_year,
-               g.semester
+        SELECT u.id, u.name, u.email, s.total_absences, s.risk_level
         FROM users u
-        LEFT JOIN grades g ON u.id = g.student_id
-        LEFT JOIN absences a ON (u.id = a.student_id AND g.module_name = a.module_name 
-                                AND g.academic_year = a.academic_year AND g.semester = a.semester)
+        JOIN student_summary s ON s.student_id = u.id
         WHERE u.role = 'student'
     '''
-    
     params = []
-    if academic_year:
-        query += ' AND (g.academic_year = ? OR g.academic_year IS NULL)'
-        params.append(academic_year)
-    if module_filter:
-        query += ' AND g.module_name LIKE ?'
-        params.append(f'%{module_filter}%')
-    if teacher_filter:
-        query += ' AND g.teacher_name LIKE ?'
-        params.append(f'%{teacher_filter}%')
-    if semester_filter:
-        query += ' AND g.semester = ?'
-        params.append(semester_filter)
-    
-    query += ' ORDER BY u.name'
     
+    conditions, condition_params = grade_filter_conditions(conn, filters)
+    if conditions:
+        matching = f"EXISTS (SELECT 1 FROM grades g WHERE g.student_id = u.id AND {' AND '.join(conditions)})"
+        if not (filters['module'] or filters['teacher'] or filters['semester']):
+            # A year filter alone still lists students who have no grades yet
+            matching = f'({matching} OR s.grade_count = 0)'
+        query += ' AND ' + matching
+        params.extend(condition_params)
+    if risk_filter:
+        query += ' AND s.risk_level = ?'
+        params.append(risk_filter)
+    if student_filter:
+        condition, condition_params = student_search_condition(student_filter)
+        query += ' AND ' + condition
+        params.extend(condition_params)
+    if after_name is not None and after_id is not None:
+        query += ' AND (u.name, u.id) > (?, ?)'
+        params.extend([after_name, after_id])
+    
+    query += ' ORDER BY u.name, u.id LIMIT ?'
+    params.append(page_size + 1)
+    
+    next_page = None
     try:
         cursor.execute(query, params)
-        students_data = cursor.fetchall()
+        page = cursor.fetchall()
+        if len(page) > page_size:
+            page = page[:page_size]
+            next_page = dict(request.args, after_name=page[-1][1], after_id=page[-1][0], page_size=page_size)
         
-        # Get unique values for filters
-        cursor.execute('SELECT DISTINCT academic_year FROM grades WHERE academic_year IS NOT NULL')
-        academic_years = [row[0] for row in cursor.fetchall()]
-        
-        cursor.execute('SELECT DISTINCT module_name FROM grades WHERE module_name IS NOT NULL')
-        modules = [row[0] for row in cursor.fetchall()]
-        
-        cursor.execute('SELECT DISTINCT teacher_name FROM grades WHERE teacher_name IS NOT NULL')
-        teachers = [row[0] for row in cursor.fetchall()]
-        
-        cursor.execute('SELECT DISTINCT semester FROM grades WHERE semester IS NOT NULL')
-        semesters = [row[0] for row in cursor.fetchall()]
-        
-        # Process data to group by student
         students = {}
-        for row in students_data:
-            if len(row) < 9:  # Skip incomplete rows
-                continue
-                
-            student_id, name, email, module_name, grade, absences, teacher_name, year, semester = row
-            
-            if student_id not in students:
-                students[student_id] = {
-                    'id': student_id,
-                    'name': name,
-                    'email': email,
-                    'absences': absences,
-                    'modules': [],
-                    'risk_level': get_student_risk_level(student_id),
-                    'avg_grade': 0,
-                    'total_modules': 0
-                }
-            
-            if module_name:  # Only add if module name exists
-                students[student_id]['modules'].append({
-                    'name': module_name,
-                    'grade': grade,
-                    'status': 'Admis' if grade >= 10 else 'Non Admis',
-                    'teacher': teacher_name,
-                    'year': year,
-                    'semester': semester,
-                    'absences': absences
-                })
-                students[student_id]['total_modules'] += 1
-                students[student_id]['avg_grade'] += grade
+        for student_id, name, email, total_absences, risk_level in page:
+            students[student_id] = {
+                'id': student_id,
+                'name': name,
+                'email': email,
+                'absences': total_absences,
+                'risk_level': risk_level,
+                'avg_grade': 0,
+                'total_modules': 0
+            }
         
-        # Calculate average grades
-        for student in students.values():
-            if student['total_modules'] > 0:
-                student['avg_grade'] = student['avg_grade'] / student['total_modules']
+        # Module count and average of the grades matching the filters, for this page only
+        if students:
+            placeholders = ', '.join('?' for _ in students)
+            stats_query = f'''
+                SELECT g.student_id, COUNT(*), AVG(g.grade) FROM grades g
+                WHERE g.student_id IN ({placeholders})
+            '''
+            if conditions:
+                stats_query += ' AND ' + ' AND '.join(conditions)
+            stats_query += ' GROUP BY g.student_id'
+            cursor.execute(stats_query, [*students, *condition_params])
+            for student_id, total_modules, avg_grade in cursor.fetchall():
+                students[student_id]['total_modules'] = total_modules
+                students[student_id]['avg_grade'] = avg_grade
+        
+        # Get unique values for filters
+        facets = get_filter_facets(conn)
         
-        # Apply risk filter
-        if risk_filter:
-            students = {k: v for k, v in students.items() if v['risk_level'] == risk_filter}
     except Exception as e:
         flash(f'Error: {str(e)}')
         students = {}
-        academic_years = []
-        modules = []
-        teachers = []
-        semesters = []
-    
-    conn.close()
+        facets = {kind: [] for kind in FACET_KINDS}
     
     return render_template('admin_dashboard.html', 
                          students=students.values(),
-                         academic_years=academic_years,
-                         modules=modules,
-                         teachers=teachers,
-                         semesters=semesters,
-                         current_filters={
-                             'academic_year': academic_year,
-                             'module': module_filter,
-                             'teacher': teacher_filter,
-                             'risk': risk_filter,
-                             'semester': semester_filter
-                         })
+                         academic_years=facets['academic_year'],
+                         modules=facets['module'],
+                         teachers=facets['teacher'],
+                         semesters=facets['semester'],
+                         page_size=page_size,
+                         next_page=next_page,
+                         is_first_page=after_id is None,
+                         risk_levels=get_risk_thresholds(conn).names,
+                         current_filters=dict(filters, risk=risk_filter, student=student_filter))
 
-@app.route('/student_dashboard')
-@login_required
-def student_dashboard():
-    if session.get('role') == 'admin':
-        return redirect(url_for('admin_dashboard'))
-    
-    conn = sqlite3.connect('school.db')
-    cursor = conn.cursor()
+@app.route('/api/admin/risk_thresholds', methods=['GET', 'PUT'])
+@admin_required
+def api_risk_thresholds():
+    # PUT replaces the whole set of levels; the risk_thresholds triggers then re-derive
+    # every stored risk level in the same transaction
+    if request.method == 'PUT':
+        try:
+            rows = parse_risk_levels(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        def replace_levels(cursor):
+            cursor.execute('DELETE FROM risk_thresholds')
+            cursor.executemany(f"INSERT INTO risk_thresholds ({', '.join(RiskThresholds.FIELDS)}) "
+                               "VALUES (?, ?, ?, ?, ?)", rows)
+        
+        write_db(replace_levels)
     
-    # Get student's grades with absences for each module
-    cursor.execute('''
-        SELECT g.module_name, g.grade, g.teacher_name, g.academic_year, g.semester,
-               COALESCE(a.count, 0) as absences
+    return jsonify(get_risk_thresholds(get_db()).levels)
+
+@app.route('/api/admin/students/<int:student_id>/modules')
+@admin_required
+def api_student_modules(student_id):
+    # Module rows of one student, loaded on demand by the admin dashboard
+    conditions, params = grade_filter_conditions(get_db(), admin_dashboard_filters())
+    query = '''
+        SELECT g.module_name, g.grade, COALESCE(a.count, 0) as absences,
+               g.teacher_name, g.academic_year, g.semester
         FROM grades g
         LEFT JOIN absences a ON (g.student_id = a.student_id AND g.module_name = a.module_name 
                                 AND g.academic_year = a.academic_year AND g.semester = a.semester)
-        WHERE g.student_id = ? 
-        ORDER BY g.academic_year, g.semester, g.module_name
-    ''', (session['user_id'],))
-    grades = cursor.fetchall()
-    
-    conn.close()
-    
-    # Process grades with status
-    processed_grades = []
-    total_absences = 0
+        WHERE g.student_id = ?
+    '''
+    if conditions:
+        query += ' AND ' + ' AND '.join(conditions)
+    query += ' ORDER BY g.academic_year, g.semester, g.module_name'
     
-    for module_name, grade, teacher_name, academic_year, semester, module_absences in grades:
-        processed_grades.append({
-            'module': module_name,
+    rows = get_db().execute(query, [student_id, *params]).fetchall()
+    return jsonify([
+        {
+            'name': module_name,
             'grade': grade,
             'status': 'Admis' if grade >= 10 else 'Non Admis',
             'teacher': teacher_name,
-            'year': academic_year,
+            'year': year,
             'semester': semester,
-            'absences': module_absences
-        })
-        total_absences += module_absences
+            'absences': absences
+        }
+        for module_name, grade, absences, teacher_name, year, semester in rows
+    ])
+
+@app.route('/api/search')
+@admin_required
+def api_search():
+    # Typeahead suggestions for students, modules and teachers matching the typed prefix
+    match = fts_prefix_query(request.args.get('q', ''))
+    kinds = request.args.getlist('kind') or ['student', 'module', 'teacher']
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    results = {'students': [], 'modules': [], 'teachers': []}
+    if match is None:
+        return jsonify(results)
+    
+    conn = get_db()
+    if 'student' in kinds:
+        rows = conn.execute('''
+            SELECT rowid, name, email FROM students_fts
+            WHERE students_fts MATCH ? ORDER BY rank LIMIT ?
+        ''', (match, limit)).fetchall()
+        results['students'] = [{'id': row[0], 'name': row[1], 'email': row[2]} for row in rows]
+    for kind in ('module', 'teacher'):
+        if kind in kinds:
+            rows = conn.execute('''
+                SELECT t.value, t.refs FROM search_terms_fts f
+                JOIN search_terms t ON t.id = f.rowid
+                WHERE search_terms_fts MATCH ? AND t.kind = ?
+                ORDER BY f.rank LIMIT ?
+            ''', (match, kind, limit)).fetchall()
+            results[kind + 's'] = [{'name': row[0], 'count': row[1]} for row in rows]
+    return jsonify(results)
+
+@app.route('/admin/import_grades', methods=['POST'])
+@admin_required
+def import_grades():
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Please choose a CSV file to import.')
+        return redirect(url_for('admin_dashboard'))
+    
+    summary = import_grade_records(get_db(), iter_csv_records(upload.stream))
+    if 'error' in summary:
+        flash(f"Error reading CSV file: {summary['error']}")
+    flash(f"Imported {summary['imported']} of {summary['processed']} rows "
+          f"({summary['error_count']} rejected).")
+    for error in summary['errors'][:10]:
+        flash(f"Row {error['row']}: {error['error']}")
+    return redirect(url_for('admin_dashboard'))
+
+@app.route('/api/grades/bulk', methods=['POST'])
+@admin_required
+def api_bulk_grades():
+    # Accepts a JSON array, newline-delimited JSON or a CSV body
+    content_type = request.mimetype
+    if content_type == 'text/csv':
+        records = iter_csv_records(request.stream)
+    elif content_type == 'application/x-ndjson':
+        records = iter_ndjson_records(request.stream)
+    else:
+        payload = request.get_json(silent=True)
+        if isinstance(payload, dict):
+            payload = payload.get('records')
+        if not isinstance(payload, list):
+            return jsonify({'error': 'Expected a JSON array of records'}), 400
+        records = payload
     
-    # Get risk level and ranking
-    risk_level = get_student_risk_level(session['user_id'])
-    ranking, total_students, avg_grade = get_student_ranking(session['user_id'])
+    # A body that became unreadable part-way still reports what was imported before it
+    summary = import_grade_records(get_db(), records)
+    return jsonify(summary), (400 if 'error' in summary else 200)
+
+@app.route('/student_dashboard')
+@login_required
+@cached_response
+def student_dashboard():
+    if session.get('role') == 'admin':
+        return redirect(url_for('admin_dashboard'))
     
-    # Get performance evolution
-    evolution_data = get_student_evolution(session['user_id'])
+    # A session can outlive its user row; sign it out rather than render nothing
+    profile = get_student_profile(get_db(), session['user_id'])
+    if profile is None:
+        session.clear()
+        flash('Your account no longer exists. Please sign in again.')
+        return redirect(url_for('login'))
     
     return render_template('student_dashboard.html', 
-                         grades=processed_grades, 
-                         total_absences=total_absences,
+                         grades=profile['grades'], 
+                         total_absences=profile['total_absences'],
                          name=session['name'],
-                         risk_level=risk_level,
-                         ranking=ranking,
-                         total_students=total_students,
-                         avg_grade=avg_grade,
-                         evolution_data=evolution_data)
+                         risk_level=profile['risk_level'],
+                         ranking=profile['ranking'],
+                         total_students=profile['total_students'],
+                         avg_grade=profile['avg_grade'],
+                         evolution_data=profile['evolution'])
+
+@app.route('/api/me')
+@login_required
+@cached_response
+def api_me():
+    # The signed-in student's dashboard payload
+    if session.get('role') == 'admin':
+        return jsonify({'error': 'Only available to students'}), 403
+    profile = get_student_profile(get_db(), session['user_id'])
+    if profile is None:
+        return jsonify({'error': 'Unknown student'}), 404
+    return jsonify(profile)
 
 @app.route('/analytics')
 @admin_required
+@cached_response
 def analytics():
-    conn = sqlite3.connect('school.db')
+    conn = get_db()
     cursor = conn.cursor()
     
+    # Drill-down slice, e.g. ?academic_year=2024-2025&module=Math
+    cube_slice = get_cube_slice(request.args)
+    
     # Get overall statistics
     cursor.execute('SELECT COUNT(*) FROM users WHERE role = "student"')
     total_students = cursor.fetchone()[0]
     
-    cursor.execute('SELECT AVG(grade) FROM grades')
-    overall_avg = cursor.fetchone()[0] or 0
-    
-    cursor.execute('SELECT COUNT(*) FROM grades WHERE grade < 10')
-    failed_modules = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM grades')
-    total_modules = cursor.fetchone()[0]
+    totals = get_cube_totals(conn, cube_slice)
+    statistics = get_grade_statistics(conn, cube_slice)
+    group_statistics = {dimension: {row['name']: row for row in rows}
+                        for dimension, rows in statistics['groups'].items()}
     
     # Get students at risk (with only unique student names and total absences across all modules)
-    cursor.execute('''
-        SELECT u.name, AVG(g.grade) as avg_grade,
-        (SELECT SUM(count) FROM absences WHERE student_id = u.id) as absences
-        FROM users u
-        LEFT JOIN grades g ON u.id = g.student_id
-        WHERE u.role = 'student'
-        GROUP BY u.id, u.name
-        HAVING avg_grade < 10 OR absences > 10
-    ''')
+    cursor.execute(AT_RISK_STUDENTS_QUERY)
     at_risk_students = cursor.fetchall()
     
-    # Get module performance
-    cursor.execute('''
-        SELECT module_name, AVG(grade) as avg_grade, COUNT(*) as student_count
-        FROM grades
-        GROUP BY module_name
-        ORDER BY avg_grade DESC
-    ''')
-    module_performance = cursor.fetchall()
-    
-    # Get performance evolution by semester
-    cursor.execute('''
-        SELECT academic_year, semester, 
-               AVG(grade) as avg_grade,
-               COUNT(CASE WHEN grade >= 10 THEN 1 END) as passed,
-               COUNT(*) as total
-        FROM grades
-        GROUP BY academic_year, semester
-        ORDER BY academic_year, semester
-    ''')
-    
-    performance_evolution = []
-    for year, semester, avg_grade, passed, total in cursor.fetchall():
-        success_rate = (passed / total * 100) if total > 0 else 0
-        performance_evolution.append({
-            'period': f"{year} S{semester}",
-            'avg_grade': round(avg_grade, 2) if avg_grade else 0,
-            'success_rate': round(success_rate, 1)
-        })
-    
-    conn.close()
-    
     return render_template('analytics.html',
                          total_students=total_students,
-                         overall_avg=overall_avg,
-                         failed_modules=failed_modules,
-                         total_modules=total_modules,
+                         overall_avg=totals['avg_grade'],
+                         failed_modules=totals['failed_modules'],
+                         total_modules=totals['total_modules'],
                          at_risk_students=at_risk_students,
-                         module_performance=module_performance,
-                         performance_evolution=performance_evolution)
+                         risk_thresholds=get_risk_thresholds(conn),
+                         module_performance=get_cube_performance(conn, 'module_name', cube_slice),
+                         teacher_performance=get_cube_performance(conn, 'teacher_name', cube_slice),
+                         performance_evolution=get_cube_evolution(conn, cube_slice),
+                         statistics=statistics['overall'],
+                         group_statistics=group_statistics,
+                         facets=get_filter_facets(conn),
+                         current_slice={arg: request.args.get(arg, '') for arg in CUBE_SLICE_ARGS})
 
 @app.route('/export_data')
 @admin_required
 def export_data():
     format_type = request.args.get('format', 'csv')
     
-    conn = sqlite3.connect('school.db')
+    # PDF reports, and Excel on request, render in the background; the client polls the job
+    params = {key: value for key, value in request.args.items() if key not in ('format', 'async')}
+    if format_type == 'pdf' or (format_type == 'excel' and request.args.get('async')):
+        job = enqueue_report_job(format_type, params)
+        return jsonify(job), 202
+    
+    # Finished exports are kept on disk per data version and served by path, so the
+    # WSGI server can hand the file to sendfile instead of copying it through Python
+    conn = get_db()
+    cache = get_export_cache()
     
     if format_type == 'excel':
-        # Create Excel file with simplified pandas approach
-        query = '''
-            SELECT u.name, u.email, g.module_name, g.grade, g.teacher_name, 
-                   g.academic_year, g.semester, 
-                   COALESCE(a.count, 0) as absences
-            FROM users u
-            LEFT JOIN grades g ON u.id = g.student_id
-            LEFT JOIN absences a ON (u.id = a.student_id AND g.module_name = a.module_name 
-                                    AND g.academic_year = a.academic_year AND g.semester = a.semester)
-            WHERE u.role = 'student'
-            ORDER BY u.name, g.academic_year, g.semester, g.module_name
-        '''
+        key = export_cache_key('excel', params, get_data_version(conn))
+        path = cache.get(key, 'xlsx')
+        if path is None:
+            try:
+                path = cache.put(key, 'xlsx', lambda part: write_excel_export(conn.execute(EXPORT_QUERY), part))
+            except Exception as e:
+                return f"Error generating export file: {str(e)}", 500
         
-        try:
-            # Get data using cursor instead of pandas
-            cursor = conn.cursor()
-            cursor.execute(query)
-            data = cursor.fetchall()
-            
-            # Process data manually
-            processed_data = []
-            for row in data:
-                grade = row[3]
-                status = 'Admis' if grade and grade >= 10 else 'Non Admis' if grade is not None else 'N/A'
-                processed_row = [
-                    row[0],  # Student Name
-                    row[1],  # Email
-                    row[2] or 'N/A',  # Module
-                    f"{grade:.2f}" if grade is not None else 'N/A',  # Grade
-                    row[4] or 'N/A',  # Teacher
-                    row[5] or 'N/A',  # Academic Year
-                    row[6] or 'N/A',  # Semester
-                    str(row[7]),  # Absences
-                    status  # Status
-                ]
-                processed_data.append(processed_row)
-            
-            # Calculate summary data
-            students = set([row[0] for row in data])
-            total_students = len(students)
-            grades = [row[3] for row in data if row[3] is not None]
-            avg_grade = sum(grades) / len(grades) if grades else 0
-            passed = len([g for g in grades if g >= 10])
-            failed = len(grades) - passed
-            success_rate = (passed / len(grades) * 100) if grades else 0
-            
-            # Create Excel file using openpyxl directly
-            from openpyxl import Workbook
-            wb = Workbook()
-            
-            # Student Data sheet
-            ws1 = wb.active
-            ws1.title = "Student Data"
-            headers = ['Student Name', 'Email', 'Module', 'Grade', 'Teacher', 
-                      'Academic Year', 'Semester', 'Absences', 'Status']
-            ws1.append(headers)
-            
-            for row in processed_data:
-                ws1.append(row)
-            
-            # Summary sheet
-            ws2 = wb.create_sheet("Summary")
-            summary_headers = ['Metric', 'Value']
-            ws2.append(summary_headers)
-            ws2.append(['Total Students', total_students])
-            ws2.append(['Overall Average', f"{avg_grade:.2f}/20"])
-            ws2.append(['Success Rate', f"{success_rate:.1f}%"])
-            ws2.append(['Failed Modules', failed])
-            
-            # Save to memory
-            output = io.BytesIO()
-            wb.save(output)
-            output.seek(0)
-            conn.close()
-            
-            # Send as Excel file
-            return send_file(
-                output,
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                as_attachment=True,
-                download_name=f'student_data_{datetime.now().strftime("%Y%m%d")}.xlsx'
-            )
-            
-        except Exception as e:
-            conn.close()
-            return f"Error generating export file: {str(e)}", 500
-    
-    elif format_type == 'pdf':
-        try:
-            # Create PDF report using FPDF (no external dependencies)
-            cursor = conn.cursor()
-            
-            # Get student data with proper join between grades and absences
-            cursor.execute('''
-                SELECT u.name, u.email, g.module_name, g.grade, g.teacher_name, 
-                       g.academic_year, g.semester, 
-                       COALESCE(a.count, 0) as absences
-                FROM users u
-                LEFT JOIN grades g ON u.id = g.student_id
-                LEFT JOIN absences a ON (u.id = a.student_id AND g.module_name = a.module_name 
-                                        AND g.academic_year = a.academic_year AND g.semester = a.semester)
-                WHERE u.role = 'student'
-                ORDER BY u.name, g.academic_year, g.semester, g.module_name
-            ''')
-            student_data = cursor.fetchall()
-            
-            # Get overall statistics
-            cursor.execute('SELECT COUNT(*) FROM users WHERE role = "student"')
-            total_students = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT AVG(grade) FROM grades')
-            overall_avg = cursor.fetchone()[0] or 0
-            
-            cursor.execute('SELECT COUNT(*) FROM grades WHERE grade < 10')
-            failed_modules = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM grades')
-            total_modules = cursor.fetchone()[0]
-            
-            success_rate = ((total_modules - failed_modules) / total_modules * 100) if total_modules > 0 else 0
-            
-            # Get at-risk students for the report
-            cursor.execute('''
-                SELECT u.name, AVG(g.grade) as avg_grade,
-                (SELECT SUM(count) FROM absences WHERE student_id = u.id) as absences
-                FROM users u
-                LEFT JOIN grades g ON u.id = g.student_id
-                WHERE u.role = 'student'
-                GROUP BY u.id, u.name
-                HAVING avg_grade < 10 OR absences > 10
-            ''')
-            at_risk_students = cursor.fetchall()
-            
-            # Get module performance
-            cursor.execute('''
-                SELECT module_name, AVG(grade) as avg_grade, COUNT(*) as student_count
-                FROM grades
-                GROUP BY module_name
-                ORDER BY avg_grade DESC
-            ''')
-            module_performance = cursor.fetchall()
-            
-            conn.close()
-            
-            # Create PDF using FPDF
-            class PDF(FPDF):
-                def header(self):
-                    # Logo - if you have one
-                    # self.image('logo.png', 10, 8, 33)
-                    self.set_font('Arial', 'B', 15)
-                    self.cell(0, 10, 'School Management System - Performance Report', 0, 1, 'C')
-                    self.set_font('Arial', 'I', 10)
-                    self.cell(0, 10, f'Generated on {datetime.now().strftime("%d/%m/%Y")}', 0, 1, 'C')
-                    self.ln(5)
-                
-                def footer(self):
-                    self.set_y(-15)
-                    self.set_font('Arial', 'I', 8)
-                    self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
-                
-                def section_title(self, title):
-                    self.set_font('Arial', 'B', 12)
-                    self.set_fill_color(100, 149, 237)  # Cornflower blue
-                    self.cell(0, 10, title, 0, 1, 'L', True)
-                    self.ln(5)
-                
-                def table_header(self, headers):
-                    self.set_font('Arial', 'B', 10)
-                    self.set_fill_color(200, 220, 255)
-                    
-                    # Calculate column widths based on content
-                    col_widths = []
-                    total_width = self.w - 20  # Page width minus margins
-                    
-                    # Simple algorithm - divide equally for now
-                    col_width = total_width / len(headers)
-                    
-                    for header in headers:
-                        self.cell(col_width, 7, header, 1, 0, 'C', True)
-                    self.ln()
-                
-                def table_row(self, data, col_widths=None):
-                    self.set_font('Arial', '', 9)
-                    
-                    if not col_widths:
-                        # Use equal width for columns
-                        col_width = (self.w - 20) / len(data)
-                        col_widths = [col_width] * len(data)
-                    
-                    for i, item in enumerate(data):
-                        # Convert any non-string data
-                        if item is None:
-                            item = 'N/A'
-                        elif not isinstance(item, str):
-                            item = str(item)
-                        
-                        # Make sure cell doesn't overflow to next page
-                        if self.get_y() + 7 > self.page_break_trigger:
-                            self.add_page()
-                        
-                        self.cell(col_widths[i], 7, item, 1, 0, 'L')
-                    self.ln()
-            
-            # Initialize PDF
-            pdf = PDF()
-            pdf.set_auto_page_break(True, margin=15)
-            pdf.add_page()
-            
-            # Summary section
-            pdf.section_title('Performance Summary')
-            pdf.set_font('Arial', '', 10)
-            pdf.cell(40, 10, f'Total Students: {total_students}', 0, 0)
-            pdf.cell(60, 10, f'Overall Average: {overall_avg:.2f}/20', 0, 0)
-            pdf.cell(50, 10, f'Success Rate: {success_rate:.1f}%', 0, 0)
-            pdf.cell(40, 10, f'Failed Modules: {failed_modules}/{total_modules}', 0, 1)
-            pdf.ln(5)
-            
-            # Students at Risk section
-            if at_risk_students:
-                pdf.add_page()
-                pdf.section_title('Students at Risk')
-                
-                # Table header
-                headers = ['Student Name', 'Average Grade', 'Absences', 'Risk Level', 'Recommendations']
-                pdf.table_header(headers)
-                
-                # Table data
-                for name, avg_grade, absences in at_risk_students:
-                    risk_level = 'High' if (avg_grade or 0) < 10 and absences > 10 else 'Medium'
-                    recommendation = "Weekly tutoring + checks" if risk_level == "High" else "Study groups + practice"
-                    pdf.table_row([name, f"{avg_grade:.2f}/20", str(absences), risk_level, recommendation])
-                pdf.ln(10)
-            
-            # Module Performance section
-            if module_performance:
-                pdf.add_page()
-                pdf.section_title('Module Performance')
-                
-                # Table header
-                headers = ['Module', 'Average Grade', 'Students', 'Success Rate']
-                pdf.table_header(headers)
-                
-                # Table data
-                for module_name, avg_grade, student_count in module_performance:
-                    module_success = (avg_grade / 20 * 100) if avg_grade else 0
-                    pdf.table_row([
-                        module_name, 
-                        f"{avg_grade:.2f}/20", 
-                        str(student_count), 
-                        f"{module_success:.1f}%"
-                    ])
-                pdf.ln(10)
-            
-            # Student Performance Data section
-            pdf.add_page()
-            pdf.section_title('Student Performance Data')
-            
-            # Limit columns to fit on page - show most important ones
-            headers = ['Name', 'Email', 'Module', 'Grade', 'Teacher', 'Absences']
-            pdf.table_header(headers)
-            
-            # Table data (limited to key columns)
-            for student in student_data:
-                pdf.table_row([
-                    student[0],    # name
-                    student[1],    # email
-                    student[2] or 'N/A',   # module
-                    f"{student[3]:.2f}" if student[3] else 'N/A',  # grade
-                    student[4] or 'N/A',   # teacher
-                    str(student[7] or '0')  # absences
-                ])
-            
-            # Get PDF as bytes
-            pdf_bytes = pdf.output(dest='S').encode('latin1')
-            
-            # Return PDF file
-            return send_file(
-                io.BytesIO(pdf_bytes),
-                mimetype='application/pdf',
-                as_attachment=True,
-                download_name=f'student_report_{datetime.now().strftime("%Y%m%d")}.pdf'
-            )
-            
-        except Exception as e:
-            return f"Error generating report: {str(e)}", 500
+        return send_file(
+            path,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=f'student_data_{datetime.now().strftime("%Y%m%d")}.xlsx'
+        )
     
     else:  # CSV
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT u.name, u.email, g.module_name, g.grade, g.teacher_name, 
-                   g.academic_year, g.semester, 
-                   COALESCE(a.count, 0) as absences
-            FROM users u
-            LEFT JOIN grades g ON u.id = g.student_id
-            LEFT JOIN absences a ON (u.id = a.student_id AND g.module_name = a.module_name 
-                                    AND g.academic_year = a.academic_year AND g.semester = a.semester)
-            WHERE u.role = 'student'
-            ORDER BY u.name, g.academic_year, g.semester, g.module_name
-        ''')
-        
-        data = cursor.fetchall()
-        conn.close()
+        filename = f'student_data_{datetime.now().strftime("%Y%m%d")}.csv'
+        key = export_cache_key('csv', params, get_data_version(conn))
+        path = cache.get(key, 'csv')
+        if path is not None:
+            return send_file(path, mimetype='text/csv', as_attachment=True, download_name=filename)
         
-        # Create CSV in memory with improved formatting
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['Name', 'Email', 'Module', 'Grade', 'Teacher', 'Academic Year', 'Semester', 'Absences', 'Status'])
+        cursor = conn.cursor()
+        cursor.execute(EXPORT_QUERY)
         
-        # Add status column and format grades
-        formatted_data = []
-        for row in data:
-            # Calculate status
-            grade = row[3]
-            status = 'Admis' if grade and grade >= 10 else 'Non Admis' if grade is not None else 'N/A'
+        # Stream the file one chunk of rows at a time; the summary is built as we go
+        def generate():
+            output = io.StringIO()
+            writer = csv.writer(output)
+            summary = ExportSummary()
+            writer.writerow(['Name', 'Email', 'Module', 'Grade', 'Teacher', 'Academic Year', 'Semester', 'Absences', 'Status'])
             
-            # Format grade to 2 decimal places if not None
-            formatted_grade = f"{grade:.2f}" if grade is not None else 'N/A'
+            for count, row in enumerate(iter_cursor(cursor), 1):
+                summary.add(row)
+                writer.writerow(format_export_row(row))
+                if count % EXPORT_FETCH_SIZE == 0:
+                    yield output.getvalue()
+                    output.seek(0)
+                    output.truncate(0)
             
-            # Create new row with formatted data
-            new_row = [
-                row[0],                    # Name
-                row[1],                    # Email
-                row[2] or 'N/A',           # Module
-                formatted_grade,           # Grade
-                row[4] or 'N/A',           # Teacher
-                row[5] or 'N/A',           # Academic Year
-                row[6] or 'N/A',           # Semester
-                str(row[7]),               # Absences
-                status                     # Status
-            ]
-            formatted_data.append(new_row)
-        
-        # Write the formatted data
-        writer.writerows(formatted_data)
+            writer.writerow([])
+            writer.writerow(['SUMMARY'])
+            writer.writerows(summary.rows())
+            yield output.getvalue()
         
-        # Add summary data
-        writer.writerow([])
-        writer.writerow(['SUMMARY'])
-        
-        # Calculate summary metrics
-        students = set([row[0] for row in data])
-        total_students = len(students)
-        grades = [row[3] for row in data if row[3] is not None]
-        avg_grade = sum(grades) / len(grades) if grades else 0
-        passed = len([g for g in grades if g >= 10])
-        failed = len(grades) - passed
-        success_rate = (passed / len(grades) * 100) if grades else 0
-        
-        # Write summary rows
-        writer.writerow(['Total Students', total_students])
-        writer.writerow(['Overall Average', f"{avg_grade:.2f}/20"])
-        writer.writerow(['Success Rate', f"{success_rate:.1f}%"])
-        writer.writerow(['Failed Modules', failed])
-        
-        output.seek(0)
-        
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8')),
+        # The first download streams and is written to the cache on the way out
+        return Response(
+            stream_with_context(cache.put_stream(key, 'csv', generate())),
             mimetype='text/csv',
-            as_attachment=True,
-            download_name=f'student_data_{datetime.now().strftime("%Y%m%d")}.csv'
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
         )
 
+@app.route('/export_report_cards')
+@admin_required
+def export_report_cards():
+    # One PDF report card per student of the cohort (ids, academic_year, class_id, risk)
+    try:
+        query, params = student_cohort_query(**parse_cohort_criteria(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # async=1 writes the archive to disk as a background report job instead
+    if request.args.get('async'):
+        job_params = {key: value for key, value in request.args.items() if key != 'async'}
+        return jsonify(enqueue_report_job('report_cards', job_params)), 202
+    
+    conn = get_db()
+    cards = iter_report_cards(iter_student_profiles(conn, query, params))
+    filename = f'report_cards_{datetime.now().strftime("%Y%m%d")}.zip'
+    return Response(
+        stream_with_context(iter_report_card_zip(cards)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.route('/export_jobs/<job_id>')
+@admin_required
+def report_job_status(job_id):
+    row = get_db().execute('SELECT id, format, status, progress, error FROM report_jobs WHERE id = ?',
+                           (job_id,)).fetchone()
+    if row is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(report_job_payload(row))
+
+@app.route('/export_jobs/<job_id>/download')
+@admin_required
+def report_job_download(job_id):
+    row = get_db().execute('SELECT format, status, artifact_path FROM report_jobs WHERE id = ?',
+                           (job_id,)).fetchone()
+    if row is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    format_type, status, artifact_path = row
+    if status != 'done' or not artifact_path or not os.path.exists(artifact_path):
+        return jsonify({'error': f'Report is not available (status: {status})'}), 409
+    
+    extension, _ = REPORT_RENDERERS[format_type]
+    prefix = {'pdf': 'student_report', 'report_cards': 'report_cards'}.get(format_type, 'student_data')
+    return send_file(
+        artifact_path,
+        as_attachment=True,
+        download_name=f'{prefix}_{datetime.now().strftime("%Y%m%d")}.{extension}'
+    )
+
 @app.route('/api/student_risk/<int:student_id>')
 @admin_required
+@cached_response
 def api_student_risk(student_id):
-    risk_level = get_student_risk_level(student_id)
-    ranking, total_students, avg_grade = get_student_ranking(student_id)
-    evolution_data = get_student_evolution(student_id)
+    profile = get_student_profile(get_db(), student_id)
+    if profile is None:
+        return jsonify({'error': 'Unknown student'}), 404
+    
+    return jsonify({
+        'risk_level': profile['risk_level'],
+        'ranking': profile['ranking'],
+        'total_students': profile['total_students'],
+        'avg_grade': profile['avg_grade'],
+        'evolution_data': profile['evolution']
+    })
+
+@app.route('/api/student_risk/batch', methods=['GET', 'POST'])
+@admin_required
+def api_student_risk_batch():
+    # Cohort from a JSON body ({"ids": [...]} and/or filters, or a bare list of ids) or the query string
+    criteria = dict(request.args)
+    body = request.get_json(silent=True)
+    if isinstance(body, list):
+        body = {'ids': body}
+    elif body is not None and not isinstance(body, dict):
+        return jsonify({'error': 'Expected a JSON object or a list of student ids'}), 400
+    criteria.update(body or {})
+    try:
+        query, params = student_cohort_query(**parse_cohort_criteria(criteria))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    conn = get_db()
+    
+    # Large cohorts can be streamed as one JSON object per line
+    if criteria.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+        def generate():
+            for record in iter_student_risks(conn, query, params):
+                yield json.dumps(record) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    return jsonify(list(iter_student_risks(conn, query, params)))
+
+@app.route('/api/student_ranking/<int:student_id>')
+@login_required
+def api_student_ranking(student_id):
+    # Students may only look up their own rank
+    if session.get('role') != 'admin' and session.get('user_id') != student_id:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    scope = {
+        'module': request.args.get('module', ''),
+        'academic_year': request.args.get('academic_year', ''),
+        'semester': request.args.get('semester', ''),
+        'class_id': request.args.get('class_id', type=int),
+    }
+    ranking, total_students, avg_grade = get_student_ranking(student_id, **scope)
     
     return jsonify({
-        'risk_level': risk_level,
         'ranking': ranking,
         'total_students': total_students,
         'avg_grade': avg_grade,
-        'evolution_data': evolution_data
+        'scope': {key: value for key, value in scope.items() if value}
     })
 
 @app.route('/api/performance_evolution')
 @admin_required
+@cached_response
 def api_performance_evolution():
-    conn = sqlite3.connect('school.db')
-    cursor = conn.cursor()
-    
-    # Get performance evolution by semester
-    cursor.execute('''
-        SELECT academic_year, semester, 
-               AVG(grade) as avg_grade,
-               COUNT(CASE WHEN grade >= 10 THEN 1 END) as passed,
-               COUNT(*) as total
-        FROM grades
-        GROUP BY academic_year, semester
-        ORDER BY academic_year, semester
-    ''')
-    
-    performance_data = cursor.fetchall()
-    conn.close()
+    return jsonify(get_cube_evolution(get_db(), get_cube_slice(request.args)))
+
+@app.route('/api/analytics/statistics')
+@admin_required
+@cached_response
+def api_analytics_statistics():
+    # Grade distribution of a slice, e.g. ?group_by=module_name&academic_year=2024-2025
+    dimensions = tuple(filter(None, request.args.get('group_by', ','.join(STATISTICS_DIMENSIONS)).split(',')))
+    for dimension in dimensions:
+        if dimension not in CUBE_DIMENSIONS:
+            return jsonify({'error': f'Unknown dimension: {dimension}'}), 400
+    return jsonify(get_grade_statistics(get_db(), get_cube_slice(request.args), dimensions))
+
+@app.route('/api/analytics/rollup')
+@admin_required
+@cached_response
+def api_analytics_rollup():
+    # Any drill-down of the grade cube, e.g. ?group_by=module_name,teacher_name&academic_year=2024-2025
+    group_by = tuple(filter(None, request.args.get('group_by', '').split(',')))
+    try:
+        rows = rollup_grade_cube(get_db(), group_by, get_cube_slice(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     result = []
-    for year, semester, avg_grade, passed, total in performance_data:
-        success_rate = (passed / total * 100) if total > 0 else 0
-        result.append({
-            'period': f"{year} S{semester}",
-            'avg_grade': round(avg_grade, 2) if avg_grade else 0,
-            'success_rate': round(success_rate, 1)
+    for row in rows:
+        grade_sum, grade_count, pass_count, absence_total = row[len(group_by):]
+        cell = dict(zip(group_by, row))
+        cell.update({
+            'avg_grade': round(grade_sum / grade_count, 2) if grade_count else 0,
+            'grade_count': grade_count,
+            'pass_count': pass_count,
+            'absence_total': absence_total
         })
-    
+        result.append(cell)
     return jsonify(result)
 
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus scrape target: request, SQL and template timings of this process, or of
+    # every worker when they publish to METRICS_DIR
+    directory = app.config.get('METRICS_DIR')
+    snapshot = metrics.collect(directory) if directory else None
+    return Response(metrics.render(snapshot), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/logout')
 def logout():
     session.clear()
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for the School Management System.
+
+Generate a seeded synthetic database, then drive the real routes through the Flask
+test client and report throughput, p50/p99 latency and peak RSS:
+
+    python benchmark.py generate --grades 100000
+    python benchmark.py run --concurrency 4 --requests 50 --save-baseline baseline.json
+    python benchmark.py run --concurrency 4 --requests 50 --compare baseline.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import app as school_app
+
+FIRST_NAMES = ('Adam', 'Amina', 'Camille', 'David', 'Emma', 'Fatima', 'Hugo', 'Ines', 'Jules', 'Karim',
+               'Lea', 'Lucas', 'Mehdi', 'Nora', 'Omar', 'Sara', 'Thomas', 'Yasmine', 'Youssef', 'Zoe')
+LAST_NAMES = ('Alaoui', 'Benali', 'Bernard', 'Dubois', 'El Amrani', 'Fournier', 'Haddad', 'Idrissi', 'Lambert',
+              'Martin', 'Mercier', 'Moreau', 'Petit', 'Robert', 'Rousseau', 'Tazi', 'Bennani', 'Chraibi',
+              'Girard', 'Ziani')
+MODULES = ('Algorithms', 'Arabic', 'Art', 'Biology', 'Calculus', 'Chemistry', 'Computer Science', 'Databases',
+           'Economics', 'English', 'French', 'Geography', 'History', 'Linear Algebra', 'Literature',
+           'Management', 'Music', 'Networks', 'Operating Systems', 'Philosophy', 'Physical Education',
+           'Physics', 'Statistics', 'Mathematics')
+SEMESTERS = ('1', '2')
+MODULES_PER_SEMESTER = 6
+CLASS_SIZE = 30
+INSERT_CHUNK_SIZE = 20000
+STUDENT_PASSWORD = 'password'
+
+# Academic years ending with the current default one, e.g. 2022-2023, 2023-2024, 2024-2025
+def academic_years(count):
+    return [f'{year}-{year + 1}' for year in range(2024 - count + 1, 2025)]
+
+# Grade and absence rows of one student: k distinct (year, semester, module) slots
+def student_records(rng, student_id, slots, count, teachers):
+    ability = rng.gauss(12, 3)
+    absence_rate = rng.betavariate(1, 8)
+    for year, semester, module in sorted(rng.sample(slots, count)):
+        grade = min(max(round(rng.gauss(ability, 2.5) * 4) / 4, 0), 20)
+        absences = rng.randint(1, 3) if rng.random() < absence_rate else 0
+        yield ((student_id, module, grade, teachers[module], year, semester),
+               (student_id, module, absences, absences * 2, year, semester) if absences else None)
+
+# Fill an empty database with a seeded school: students, classes, grades and absences.
+# Students follow from the grade count unless given; every write goes through the
+# schema's triggers, so summaries, counters and the search index are maintained as in use
+def generate_dataset(path, grades, students=None, years=3, modules=len(MODULES), seed=42, log=print):
+    rng = random.Random(seed)
+    year_names = academic_years(years)
+    module_names = MODULES[:modules]
+    slots = [(year, semester, module) for year in year_names for semester in SEMESTERS for module in module_names]
+    if students is None:
+        students = max(1, math.ceil(grades / (len(year_names) * len(SEMESTERS) * min(MODULES_PER_SEMESTER, modules))))
+    per_student = math.ceil(grades / students)
+    if per_student > len(slots):
+        raise ValueError(f'{students} students can hold at most {students * len(slots)} grades '
+                         f'with {years} years of {modules} modules')
+
+    school_app.app.config['DATABASE'] = path
+    school_app.init_db()
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    if conn.execute("SELECT COUNT(*) FROM users WHERE role = 'student'").fetchone()[0]:
+        conn.close()
+        raise ValueError(f'{path} already has students; pass --replace to start from scratch')
+
+    teachers = {module: f'Prof. {rng.choice(LAST_NAMES)}' for module in module_names}
+    password = school_app.hash_password(STUDENT_PASSWORD)
+    with conn:
+        first_id = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM users').fetchone()[0]
+        conn.executemany("INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, 'student')", [
+            (f'{first} {last}', f"{first}.{last.replace(' ', '')}.{number}@example.com".lower(), password)
+            for number, (first, last) in enumerate(
+                (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)) for _ in range(students))
+        ])
+    student_ids = list(range(first_id, first_id + students))
+    log(f'Inserted {students} students')
+
+    # One class of CLASS_SIZE students per group and year
+    with conn:
+        for year in year_names:
+            shuffled = rng.sample(student_ids, len(student_ids))
+            for group, start in enumerate(range(0, len(shuffled), CLASS_SIZE), 1):
+                class_id = conn.execute('INSERT INTO classes (name, academic_year, teacher_name) VALUES (?, ?, ?)',
+                                        (f'Group {group}', year, rng.choice(list(teachers.values())))).lastrowid
+                conn.executemany('INSERT INTO student_class (student_id, class_id) VALUES (?, ?)',
+                                 [(student_id, class_id) for student_id in shuffled[start:start + CLASS_SIZE]])
+
+    inserted = 0
+    grade_rows, absence_rows = [], []
+    def flush():
+        with conn:
+            conn.executemany('INSERT INTO grades (student_id, module_name, grade, teacher_name, academic_year, semester) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', grade_rows)
+            conn.executemany('INSERT INTO absences (student_id, module_name, count, total_hours, academic_year, semester) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', absence_rows)
+        grade_rows.clear()
+        absence_rows.clear()
+        log(f'Inserted {inserted} of {grades} grades')
+
+    for student_id in student_ids:
+        count = min(per_student, grades - inserted)
+        if count <= 0:
+            break
+        for grade, absence in student_records(rng, student_id, slots, count, teachers):
+            grade_rows.append(grade)
+            if absence is not None:
+                absence_rows.append(absence)
+        inserted += count
+        if len(grade_rows) >= INSERT_CHUNK_SIZE:
+            flush()
+    if grade_rows:
+        flush()
+
+    conn.execute('PRAGMA optimize')
+    conn.close()
+    return dataset_size(path)
+
+# Row counts that identify a dataset in reports and baselines
+def dataset_size(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {
+            'students': conn.execute("SELECT COUNT(*) FROM users WHERE role = 'student'").fetchone()[0],
+            'grades': conn.execute('SELECT COUNT(*) FROM grades').fetchone()[0],
+            'absences': conn.execute('SELECT COUNT(*) FROM absences').fetchone()[0],
+            'classes': conn.execute('SELECT COUNT(*) FROM classes').fetchone()[0],
+        }
+    finally:
+        conn.close()
+
+class Workload:
+    """Seeded request parameters drawn from the benchmarked database"""
+
+    def __init__(self, rng, catalogue):
+        self.rng = rng
+        self.catalogue = catalogue
+
+    def student(self):
+        return self.rng.choice(self.catalogue['students'])
+
+    def year(self):
+        return self.rng.choice(self.catalogue['years'])
+
+    def module(self):
+        return self.rng.choice(self.catalogue['modules'])
+
+    def search(self):
+        return self.rng.choice(self.catalogue['names'])[:3]
+
+# Routes the harness drives: name -> (signed-in role, method, build(workload) -> path or (path, form))
+ROUTES = {
+    'admin_dashboard': ('admin', 'GET', lambda w: '/admin_dashboard'),
+    'admin_dashboard_filtered': ('admin', 'GET', lambda w: f'/admin_dashboard?academic_year={w.year()}&risk=medium'),
+    'student_dashboard': ('student', 'GET', lambda w: '/student_dashboard'),
+    'analytics': ('admin', 'GET', lambda w: '/analytics'),
+    'export_csv': ('admin', 'GET', lambda w: '/export_data?format=csv'),
+    'export_excel': ('admin', 'GET', lambda w: '/export_data?format=excel'),
+    'export_pdf': ('admin', 'GET', lambda w: '/export_data?format=pdf'),
+    'api_me': ('student', 'GET', lambda w: '/api/me'),
+    'api_student_risk': ('admin', 'GET', lambda w: f'/api/student_risk/{w.student()}'),
+    'api_student_risk_batch': ('admin', 'GET', lambda w: f'/api/student_risk/batch?academic_year={w.year()}'),
+    'api_student_ranking': ('admin', 'GET', lambda w: f'/api/student_ranking/{w.student()}'),
+    'api_student_modules': ('admin', 'GET', lambda w: f'/api/admin/students/{w.student()}/modules'),
+    'api_search': ('admin', 'GET', lambda w: f'/api/search?q={w.search()}'),
+    'api_performance_evolution': ('admin', 'GET', lambda w: '/api/performance_evolution'),
+    'api_analytics_statistics': ('admin', 'GET', lambda w: '/api/analytics/statistics'),
+    'api_analytics_rollup': ('admin', 'GET', lambda w: '/api/analytics/rollup?group_by=academic_year,module_name'),
+    'grade_entry': ('admin', 'POST', lambda w: ('/admin_dashboard', {
+        'student_id': w.student(), 'module_name': w.module(), 'grade': w.rng.randint(0, 20),
+        'absences': w.rng.randint(0, 3), 'academic_year': w.year(), 'semester': w.rng.choice(SEMESTERS)})),
+}
+# Writes invalidate the caches the read routes are measured with, so they run only on request
+DEFAULT_ROUTES = [name for name in ROUTES if name != 'grade_entry']
+EXPECTED_STATUS = {'GET': 200, 'POST': 302}
+PDF_POLL_INTERVAL = 0.05
+
+# Student ids, years, modules and names the workload draws from
+def load_catalogue(path):
+    conn = sqlite3.connect(path)
+    try:
+        catalogue = {
+            'students': [row[0] for row in conn.execute("SELECT id FROM users WHERE role = 'student' ORDER BY id")],
+            'names': [row[0] for row in conn.execute("SELECT name FROM users WHERE role = 'student' ORDER BY id LIMIT 1000")],
+            'years': [row[0] for row in conn.execute('SELECT DISTINCT academic_year FROM grades ORDER BY 1')],
+            'modules': [row[0] for row in conn.execute('SELECT DISTINCT module_name FROM grades ORDER BY 1')],
+        }
+    finally:
+        conn.close()
+    if not catalogue['students'] or not catalogue['years']:
+        raise ValueError(f'{path} has no students or grades; create it with: python benchmark.py generate')
+    return catalogue
+
+# Peak resident set size of this process so far, in MB (None where unsupported)
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+# Total SQL statements and requests recorded by the app's /metrics for one endpoint
+def endpoint_sql_totals(endpoint):
+    text = school_app.metrics.render()
+    totals = []
+    for suffix in ('sum', 'count'):
+        match = re.search(f'^http_request_sql_statements_{suffix}{{endpoint="{endpoint}"}} (\\S+)$', text, re.M)
+        totals.append(float(match.group(1)) if match else 0.0)
+    return totals
+
+# Sign the client in: the admin, or the given student
+def sign_in(client, role, student_id=None):
+    with client.session_transaction() as sess:
+        sess.clear()
+        if role == 'admin':
+            sess.update(user_id='admin', role='admin', name='Administrator')
+        else:
+            sess.update(user_id=student_id, role='student', name=f'Student {student_id}')
+
+# Send one request, following a PDF export's job until its file is downloaded
+def send_request(client, method, target):
+    path, form = target if isinstance(target, tuple) else (target, None)
+    response = client.open(path, method=method, data=form)
+    response.get_data()
+    if response.status_code == 202 and path.startswith('/export_data'):
+        job = response.get_json()
+        while job['status'] in ('queued', 'running'):
+            time.sleep(PDF_POLL_INTERVAL)
+            job = client.get(job['status_url']).get_json()
+        if job['status'] != 'done':
+            return 500
+        response = client.get(job['download_url'])
+        response.get_data()
+    return response.status_code
+
+# Invalidate every data-version keyed cache, as a write would
+def invalidate_caches():
+    school_app.write_db(lambda cursor: cursor.execute('UPDATE change_counters SET version = version + 1'))
+
+# Run count requests of one route over `concurrency` threads, each with its own client
+def run_route(name, count, concurrency, catalogue, seed=42, warmup=1, cold=False):
+    role, method, build = ROUTES[name]
+
+    def worker(index, share, record):
+        client = school_app.app.test_client()
+        workload = Workload(random.Random(f'{seed}:{name}:{index}'), catalogue)
+        latencies, errors = [], 0
+        for _ in range(share):
+            sign_in(client, role, workload.student() if role == 'student' else None)
+            target = build(workload)
+            if cold:
+                invalidate_caches()
+            start = time.perf_counter()
+            status = send_request(client, method, target)
+            elapsed = time.perf_counter() - start
+            if status != EXPECTED_STATUS[method]:
+                errors += 1
+            latencies.append(elapsed)
+        return latencies if record else [], errors if record else 0
+
+    # Untimed warm-up requests fill the connection pool and the caches
+    if warmup:
+        worker('warmup', warmup, False)
+
+    path = build(Workload(random.Random(seed), catalogue))
+    path = path[0] if isinstance(path, tuple) else path
+    endpoint = school_app.app.url_map.bind('localhost').match(path.split('?')[0], method=method)[0]
+    sql_before = endpoint_sql_totals(endpoint)
+
+    shares = [count // concurrency + (index < count % concurrency) for index in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(worker, range(concurrency), shares, [True] * concurrency))
+    wall = time.perf_counter() - started
+
+    sql_after = endpoint_sql_totals(endpoint)
+    latencies = np.array([latency for part, _ in results for latency in part])
+    requests = sql_after[1] - sql_before[1]
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors for _, errors in results),
+        'throughput_rps': round(len(latencies) / wall, 2),
+        'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 2),
+        'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 2),
+        'mean_ms': round(float(latencies.mean()) * 1000, 2),
+        'sql_per_request': round((sql_after[0] - sql_before[0]) / requests, 1) if requests else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+# Benchmark the routes against the database at path; exports go to a scratch directory
+def run_benchmark(path, routes=DEFAULT_ROUTES, requests=50, concurrency=4, seed=42, warmup=1, cold=False,
+                  log=print):
+    unknown = sorted(set(routes) - set(ROUTES))
+    if unknown:
+        raise ValueError(f"Unknown routes: {', '.join(unknown)}")
+    catalogue = load_catalogue(path)
+
+    reports_dir = tempfile.mkdtemp(prefix='school-benchmark-')
+    school_app.app.config.update(DATABASE=path, REPORTS_DIR=reports_dir)
+    school_app.response_cache.clear()
+    try:
+        school_app.init_db()
+        results = {}
+        for name in routes:
+            results[name] = run_route(name, requests, concurrency, catalogue, seed, warmup, cold)
+            log(format_row(name, results[name]))
+    finally:
+        shutil.rmtree(reports_dir, ignore_errors=True)
+
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'dataset': dataset_size(path),
+        'settings': {'requests': requests, 'concurrency': concurrency, 'seed': seed, 'cold': cold},
+        'peak_rss_mb': peak_rss_mb(),
+        'routes': results,
+    }
+
+REPORT_HEADER = f"{'route':<28}{'reqs':>6}{'err':>5}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'sql/req':>9}{'rss MB':>9}"
+
+def format_row(name, result):
+    sql = '-' if result['sql_per_request'] is None else result['sql_per_request']
+    rss = '-' if result['peak_rss_mb'] is None else result['peak_rss_mb']
+    return (f"{name:<28}{result['requests']:>6}{result['errors']:>5}{result['throughput_rps']:>9}"
+            f"{result['p50_ms']:>10}{result['p99_ms']:>10}{sql:>9}{rss:>9}")
+
+# Compare a report with a saved baseline; returns the routes whose p50 or p99 latency
+# grew by more than the tolerance (0.25 = 25% slower)
+def compare_reports(report, baseline, tolerance=0.25, log=print):
+    for key in ('dataset', 'settings'):
+        if report[key] != baseline[key]:
+            log(f'Warning: {key} differs from the baseline ({baseline[key]} -> {report[key]})')
+
+    regressions = []
+    log(f"{'route':<28}{'p50 ms':>26}{'p99 ms':>26}{'req/s':>26}")
+    for name, result in report['routes'].items():
+        previous = baseline['routes'].get(name)
+        if previous is None:
+            continue
+        cells = []
+        for metric in ('p50_ms', 'p99_ms', 'throughput_rps'):
+            change = result[metric] / previous[metric] - 1 if previous[metric] else 0.0
+            cells.append(f'{previous[metric]}->{result[metric]} {change:+.0%}')
+            if metric != 'throughput_rps' and change > tolerance and name not in regressions:
+                regressions.append(name)
+        log(f"{name:<28}{cells[0]:>26}{cells[1]:>26}{cells[2]:>26}{'  REGRESSION' if name in regressions else ''}")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the School Management System')
+    parser.add_argument('--database', default='school.db')
+    parser.add_argument('--seed', type=int, default=42)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help='fill a new database with seeded synthetic data')
+    generate.add_argument('--grades', type=int, default=100000, help='grade rows to create (default: 100000)')
+    generate.add_argument('--students', type=int, help='default: enough for six modules per semester')
+    generate.add_argument('--years', type=int, default=3)
+    generate.add_argument('--modules', type=int, default=len(MODULES), choices=range(1, len(MODULES) + 1),
+                          metavar=f'1-{len(MODULES)}')
+    generate.add_argument('--replace', action='store_true', help='delete the database first if it exists')
+
+    run = commands.add_parser('run', help='drive the routes and report latency, throughput and memory')
+    run.add_argument('--routes', default=','.join(DEFAULT_ROUTES),
+                     help=f"comma-separated, from: {', '.join(ROUTES)} (default: all but grade_entry)")
+    run.add_argument('--requests', type=int, default=50, help='timed requests per route')
+    run.add_argument('--concurrency', type=int, default=4, help='client threads')
+    run.add_argument('--warmup', type=int, default=1, help='untimed requests per route first')
+    run.add_argument('--cold', action='store_true', help='invalidate the caches before every request')
+    run.add_argument('--save-baseline', metavar='FILE', help='write the report as JSON')
+    run.add_argument('--compare', metavar='FILE', help='compare with a saved report; exit 1 on regressions')
+    run.add_argument('--tolerance', type=float, default=0.25, help='allowed latency growth (default: 0.25)')
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        if args.replace:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(args.database + suffix):
+                    os.remove(args.database + suffix)
+        started = time.perf_counter()
+        size = generate_dataset(args.database, args.grades, args.students, args.years, args.modules, args.seed)
+        print(f'Generated {size} in {args.database} in {time.perf_counter() - started:.1f}s')
+    else:
+        print(REPORT_HEADER)
+        report = run_benchmark(args.database, [name for name in args.routes.split(',') if name], args.requests,
+                               args.concurrency, args.seed, args.warmup, args.cold)
+        print(f"Dataset {report['dataset']}, peak RSS {report['peak_rss_mb']} MB")
+
+        if args.save_baseline:
+            with open(args.save_baseline, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f'Saved baseline to {args.save_baseline}')
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+            regressions = compare_reports(report, baseline, args.tolerance)
+            if regressions:
+                print(f"Regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+                sys.exit(1)
@@ -1,30 +1,136 @@
+import argparse
 import os
-from app import app, init_db
-
-print("\nStarting School Management System...")
-print("================================================")
-
-try:
-    print("✓ Flask application loaded successfully")
-    
-    # Check if database exists and initialize if needed
-    db_path = 'school.db'
-    if not os.path.exists(db_path) or os.path.getsize(db_path) == 0:
-        print("✓ Creating new database...")
-        init_db()
-        print("✓ Database initialized successfully")
-    else:
-        print("✓ Database will be initialized automatically")
-    
-    print("\nStarting server...")
-    print("Access the application at: http://localhost:5000")
-    print("Admin login: email='admin', password='admin'")
-    print("\nPress Ctrl+C to stop the server")
+import tempfile
+import time
+from app import app, init_db, metrics, publish_metrics, reset_metrics_dir, warm_up
+
+# Create the schema or upgrade an existing school.db in place, and requeue report jobs an
+# earlier run left unfinished. init_db only applies the migrations PRAGMA user_version has
+# not recorded yet, so both modes call this on every start.
+def prepare_database():
+    init_db()
+    print("✓ Database ready")
+
+def run_development():
+    print("\nStarting School Management System...")
     print("================================================")
-    
-    # Run the application
-    app.run(debug=True, host='0.0.0.0')
-    
-except Exception as e:
-    print(f"✗ Error: {str(e)}")
-    print("Please check your configuration and try again.")
\ No newline at end of file
+
+    try:
+        print("✓ Flask application loaded successfully")
+
+        prepare_database()
+
+        print("\nStarting server...")
+        print("Access the application at: http://localhost:5000")
+        print("Admin login: email='admin', password='admin'")
+        print("\nPress Ctrl+C to stop the server")
+        print("================================================")
+
+        # Run the application
+        app.run(debug=True, host='0.0.0.0')
+
+    except Exception as e:
+        print(f"✗ Error: {str(e)}")
+        print("Please check your configuration and try again.")
+
+# Serve the app with gunicorn: several worker processes, each with a pool of threads.
+# kill -HUP <master pid> starts fresh workers before the old ones finish their requests
+# and exit; kill -TERM stops after in-flight requests complete (within --graceful-timeout)
+def run_production(host, port, workers, threads, graceful_timeout, metrics_dir=None):
+    from gunicorn.app.base import BaseApplication
+    from gunicorn.workers.gthread import ThreadWorker
+
+    class DrainingThreadWorker(ThreadWorker):
+        # Stock gthread workers close connections they have accepted but not yet read
+        # when told to stop; this one stops accepting and finishes them first
+        drain_deadline = None
+        draining = False
+
+        def handle_exit(self, sig, frame):
+            # Runs in the signal handler, so only record the request to stop
+            if self.drain_deadline is None:
+                self.drain_deadline = time.monotonic() + self.cfg.graceful_timeout
+
+        def murder_keepalived(self):
+            # Called once per event loop iteration
+            super().murder_keepalived()
+            if self.drain_deadline is None:
+                return
+            if not self.draining:
+                self.draining = True
+                for sock in self.sockets:
+                    self.poller.unregister(sock)
+            if self.nr_conns == 0 or time.monotonic() > self.drain_deadline:
+                self.alive = False
+
+    class SchoolApplication(BaseApplication):
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    print("\nStarting School Management System (production)...")
+    print("================================================")
+
+    # Migrations and job recovery run once, in the master, before any worker starts
+    prepare_database()
+
+    # Every request thread of a worker can hold a pooled connection
+    app.config['DB_POOL_SIZE'] = max(app.config['DB_POOL_SIZE'], threads)
+
+    # Workers publish their metrics there and /metrics adds them up, so every scrape
+    # reports the whole server; the previous run's files are removed first
+    app.config['METRICS_DIR'] = metrics_dir or tempfile.mkdtemp(prefix='school-metrics-')
+    reset_metrics_dir(app.config['METRICS_DIR'])
+
+    # Workers start from the metrics the master recorded while migrating; drop those
+    def init_worker(worker):
+        metrics.clear()
+        warm_up(threads)
+
+    print(f"✓ Serving on http://{host}:{port} with {workers} workers x {threads} threads")
+    print(f"✓ Worker metrics collected in {app.config['METRICS_DIR']}")
+    print("================================================")
+
+    SchoolApplication(app, {
+        'bind': f'{host}:{port}',
+        'workers': workers,
+        'worker_class': DrainingThreadWorker,
+        'threads': threads,
+        'timeout': 120,               # synchronous Excel exports can take a while
+        'graceful_timeout': graceful_timeout,
+        'keepalive': 5,
+        'accesslog': '-',
+        'post_worker_init': init_worker,
+        'worker_exit': lambda server, worker: publish_metrics(force=True),
+    }).run()
+
+# Guarded so that worker processes importing this module do not start another server
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the School Management System')
+    parser.add_argument('--production', action='store_true',
+                        help='serve with gunicorn instead of the Flask development server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1)),
+                        help='worker processes (default: $WEB_CONCURRENCY or one per core)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('WEB_THREADS', 4)),
+                        help='request threads per worker (default: $WEB_THREADS or 4)')
+    parser.add_argument('--graceful-timeout', type=int, default=30,
+                        help='seconds a stopping worker gets to finish in-flight requests')
+    parser.add_argument('--metrics-dir', default=os.environ.get('METRICS_DIR'),
+                        help='directory shared by the workers for /metrics (default: $METRICS_DIR or a new temporary one)')
+    args = parser.parse_args()
+
+    if args.production:
+        run_production(args.host, args.port, args.workers, args.threads, args.graceful_timeout,
+                       args.metrics_dir)
+    else:
+        run_development()
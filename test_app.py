@@ -5,6 +5,7 @@ Simple test script to verify the Flask application setup
 
 import sqlite3
 import os
+import json
 
 def test_database_creation():
     """Test if the database and tables are created correctly"""
@@ -53,6 +54,764 @@ def test_flask_import():
         print(f"✗ Flask import failed: {e}")
         return False
 
+def _make_client(tmp_path):
+    """Point the app at a fresh database under tmp_path and return (module, test client)"""
+    import app as school_app
+    school_app.app.config.update(TESTING=True, DATABASE=str(tmp_path / 'school.db'))
+    school_app.init_db()
+    return school_app, school_app.app.test_client()
+
+def test_connection_pool_reuses_tuned_connections(tmp_path):
+    """Requests should share pooled connections that carry the tuned PRAGMAs"""
+    school_app, _ = _make_client(tmp_path)
+
+    with school_app.app.app_context():
+        first = school_app.get_db()
+        assert school_app.get_db() is first
+        assert first.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert first.execute('PRAGMA temp_store').fetchone()[0] == 2
+
+    with school_app.app.app_context():
+        assert school_app.get_db() is first
+
+def test_migrations_upgrade_existing_database(tmp_path):
+    """Legacy databases with duplicate grades are de-duplicated and indexed in place"""
+    conn = sqlite3.connect(str(tmp_path / 'school.db'))
+    conn.execute("""
+        CREATE TABLE grades (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, student_id INTEGER NOT NULL,
+            module_name TEXT NOT NULL, grade REAL NOT NULL, teacher_name TEXT,
+            academic_year TEXT DEFAULT '2024-2025', semester TEXT DEFAULT '1',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.executemany('INSERT INTO grades (student_id, module_name, grade) VALUES (?, ?, ?)',
+                     [(1, 'Math', 8.0), (1, 'Math', 12.0), (1, 'Physics', 15.0)])
+    conn.commit()
+    conn.close()
+
+    school_app, _ = _make_client(tmp_path)
+
+    conn = sqlite3.connect(str(tmp_path / 'school.db'))
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == len(school_app.MIGRATIONS)
+    rows = conn.execute('SELECT module_name, grade FROM grades ORDER BY module_name').fetchall()
+    assert rows == [('Math', 12.0), ('Physics', 15.0)]
+    indexes = [row[1] for row in conn.execute('PRAGMA index_list(grades)')]
+    assert 'ux_grades_natural_key' in indexes
+    conn.close()
+
+def test_development_server_upgrades_baseline_database(tmp_path, monkeypatch):
+    """run.py's development mode migrates a school.db created by the original schema"""
+    import app as school_app
+    import run
+    conn = sqlite3.connect(str(tmp_path / 'school.db'))
+    conn.executescript("""
+        CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL,
+                            email TEXT UNIQUE NOT NULL, password TEXT NOT NULL, role TEXT NOT NULL);
+        CREATE TABLE grades (id INTEGER PRIMARY KEY AUTOINCREMENT, student_id INTEGER NOT NULL,
+                             module_name TEXT NOT NULL, grade REAL NOT NULL, teacher_name TEXT,
+                             academic_year TEXT DEFAULT '2024-2025', semester TEXT DEFAULT '1',
+                             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE absences (id INTEGER PRIMARY KEY AUTOINCREMENT, student_id INTEGER NOT NULL,
+                               module_name TEXT DEFAULT NULL, count INTEGER DEFAULT 0, total_hours INTEGER DEFAULT 0,
+                               academic_year TEXT DEFAULT '2024-2025', semester TEXT DEFAULT '1');
+        CREATE TABLE classes (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL,
+                              academic_year TEXT DEFAULT '2024-2025', teacher_name TEXT);
+        CREATE TABLE student_class (id INTEGER PRIMARY KEY AUTOINCREMENT, student_id INTEGER NOT NULL,
+                                    class_id INTEGER NOT NULL);
+        CREATE TABLE risk_thresholds (id INTEGER PRIMARY KEY AUTOINCREMENT, min_grade REAL DEFAULT 10.0,
+                                      max_absences INTEGER DEFAULT 10, risk_level TEXT DEFAULT 'medium');
+        INSERT INTO risk_thresholds (min_grade, max_absences, risk_level) VALUES (10.0, 10, 'medium');
+        INSERT INTO users (name, email, password, role) VALUES ('Alice', 'alice@example.com', 'x', 'student');
+        INSERT INTO grades (student_id, module_name, grade, teacher_name) VALUES (1, 'Math', 8, 'Dr. Smith');
+        INSERT INTO absences (student_id, module_name, count) VALUES (1, 'Math', 12);
+    """)
+    conn.close()
+
+    school_app.app.config.update(TESTING=True, DATABASE=str(tmp_path / 'school.db'))
+    monkeypatch.setattr(school_app.app, 'run', lambda **options: None)
+    run.run_development()
+
+    conn = sqlite3.connect(str(tmp_path / 'school.db'))
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == len(school_app.MIGRATIONS)
+    conn.close()
+    client = school_app.app.test_client()
+    _login_admin(client)
+    dashboard = client.get('/admin_dashboard')
+    assert dashboard.status_code == 200 and 'Alice' in dashboard.get_data(as_text=True)
+    assert client.get('/analytics').status_code == 200
+
+def _login_admin(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 'admin'
+        sess['role'] = 'admin'
+        sess['name'] = 'Administrator'
+
+def test_bulk_grade_import_upserts_and_reports_errors(tmp_path):
+    """Bulk CSV import should upsert on the natural key and report rejected rows"""
+    school_app, client = _make_client(tmp_path)
+    client.post('/register', data={'name': 'Alice', 'email': 'alice@example.com', 'password': 'pw'})
+    _login_admin(client)
+
+    body = (
+        'student_id,module_name,grade,absences\n'
+        '1,Math,8,2\n'
+        '1,Math,14,3\n'
+        '1,Physics,25,0\n'
+        '42,Math,10,0\n'
+    )
+    response = client.post('/api/grades/bulk', data=body, content_type='text/csv')
+    summary = response.get_json()
+    assert summary['processed'] == 4
+    assert summary['imported'] == 2
+    assert [error['row'] for error in summary['errors']] == [3, 4]
+
+    conn = sqlite3.connect(str(tmp_path / 'school.db'))
+    assert conn.execute('SELECT grade FROM grades').fetchall() == [(14.0,)]
+    assert conn.execute('SELECT count FROM absences').fetchall() == [(3,)]
+
+    # A malformed line is a row error, even after earlier batches were committed
+    school_app.app.config['IMPORT_BATCH_SIZE'] = 2
+    try:
+        body = ('{"student_id": 1, "module_name": "A", "grade": 10}\n'
+                '{"student_id": 1, "module_name": "B", "grade": 11}\n'
+                '{"student_id": 1, "module_name": \n'
+                '{"student_id": 1, "module_name": "C", "grade": 12}\n')
+        response = client.post('/api/grades/bulk', data=body, content_type='application/x-ndjson')
+        assert response.status_code == 200
+        summary = response.get_json()
+        assert (summary['processed'], summary['imported']) == (4, 3)
+        assert summary['errors'][0]['row'] == 3 and 'invalid JSON' in summary['errors'][0]['error']
+
+        # An unreadable body stops the import but still reports the rows committed before it
+        rows = ''.join(f'1,M{i},10\n' for i in range(1000))
+        body = ('student_id,module_name,grade\n' + rows).encode() + b'1,\xff\xfe,10\n'
+        response = client.post('/api/grades/bulk', data=body, content_type='text/csv')
+        assert response.status_code == 400
+        summary = response.get_json()
+        assert summary['imported'] > 0 and 'Could not read past row' in summary['error']
+    finally:
+        school_app.app.config.pop('IMPORT_BATCH_SIZE')
+    assert conn.execute("SELECT COUNT(*) FROM grades WHERE module_name GLOB 'M[0-9]*'").fetchone()[0] == summary['imported']
+    conn.close()
+
+def test_pdf_export_runs_as_deduplicated_background_job(tmp_path):
+    """PDF exports are queued once per parameter set and served when finished"""
+    import time
+    school_app, client = _make_client(tmp_path)
+    school_app.app.config['REPORTS_DIR'] = str(tmp_path / 'reports')
+    client.post('/register', data={'name': 'Alice', 'email': 'alice@example.com', 'password': 'pw'})
+    _login_admin(client)
+
+    first = client.get('/export_data?format=pdf')
+    assert first.status_code == 202
+    job = first.get_json()
+
+    for _ in range(50):
+        job = client.get(job['status_url']).get_json()
+        if job['status'] in ('done', 'failed'):
+            break
+        time.sleep(0.1)
+    assert job['status'] == 'done', job
+
+    download = client.get(job['download_url'])
+    assert download.status_code == 200
+    assert download.data.startswith(b'%PDF')
+
+def test_student_summary_tracks_writes(tmp_path):
+    """Triggers keep student_summary equal to a full rebuild after grade edits"""
+    school_app, client = _make_client(tmp_path)
+    for name in ('Alice', 'Bob'):
+        client.post('/register', data={'name': name, 'email': f'{name}@example.com', 'password': 'pw'})
+    _login_admin(client)
+    for student_id, module_name, grade, absences in ((1, 'Math', 8, 12), (1, 'Physics', 9.5, 0), (2, 'Math', 15, 1)):
+        client.post('/admin_dashboard', data={'student_id': student_id, 'module_name': module_name,
+                                              'grade': grade, 'absences': absences})
+
+    conn = sqlite3.connect(str(tmp_path / 'school.db'))
+    conn.execute("UPDATE grades SET grade = 16 WHERE module_name = 'Physics'")
+    conn.execute("DELETE FROM absences WHERE student_id = 2")
+    conn.commit()
+    query = 'SELECT student_id, grade_count, pass_count, avg_grade, total_absences, risk_level FROM student_summary ORDER BY student_id'
+    maintained = conn.execute(query).fetchall()
+    assert maintained == [(1, 2, 1, 12.0, 12, 'medium'), (2, 1, 1, 15.0, 0, 'low')]
+
+    school_app.rebuild_student_summary(conn)
+    assert conn.execute(query).fetchall() == maintained
+    conn.close()
+
+    assert client.get('/api/student_risk/2').get_json()['ranking'] == 1
+
+def test_ranking_index_is_scoped_and_invalidated_by_grade_changes(tmp_path):
+    """Scoped ranks follow grade edits without serving a stale cached index"""
+    school_app, client = _make_client(tmp_path)
+    for name in ('Alice', 'Bob', 'Carol'):
+        client.post('/register', data={'name': name, 'email': f'{name}@example.com', 'password': 'pw'})
+    _login_admin(client)
+    for student_id, math, physics in ((1, 12, 9), (2, 15, 8), (3, 12, 18)):
+        for module_name, grade in (('Math', math), ('Physics', physics)):
+            client.post('/admin_dashboard', data={'student_id': student_id, 'module_name': module_name,
+                                                  'grade': grade, 'absences': 0})
+
+    def rank(student_id, **scope):
+        return client.get(f'/api/student_ranking/{student_id}', query_string=scope).get_json()['ranking']
+
+    assert rank(1) == 3
+    assert rank(1, module='Math') == 2
+    assert rank(3, module='Math') == 2
+
+    client.post('/admin_dashboard', data={'student_id': 1, 'module_name': 'Math', 'grade': 20, 'absences': 0})
+    assert rank(1, module='Math') == 1
+    assert rank(2, module='Math') == 2
+
+def test_api_responses_revalidate_with_etags_until_data_changes(tmp_path):
+    """Cached API responses answer If-None-Match with 304 until the next write"""
+    school_app, client = _make_client(tmp_path)
+    client.post('/register', data={'name': 'Alice', 'email': 'alice@example.com', 'password': 'pw'})
+    _login_admin(client)
+    client.post('/admin_dashboard', data={'student_id': 1, 'module_name': 'Math', 'grade': 12, 'absences': 0})
+    client.get('/admin_dashboard')  # consume the flash message
+
+    first = client.get('/api/performance_evolution')
+    etag = first.headers['ETag']
+    assert client.get('/api/performance_evolution', headers={'If-None-Match': etag}).status_code == 304
+
+    client.post('/admin_dashboard', data={'student_id': 1, 'module_name': 'Math', 'grade': 8, 'absences': 0})
+    client.get('/admin_dashboard')
+    changed = client.get('/api/performance_evolution', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.get_json()[0]['avg_grade'] == 8.0
+
+def test_admin_dashboard_pages_with_keyset_and_loads_modules_lazily(tmp_path):
+    """Students are paged on (name, id) and their module rows come from a JSON endpoint"""
+    school_app, client = _make_client(tmp_path)
+    for name in ('Carol', 'Alice', 'Bob'):
+        client.post('/register', data={'name': name, 'email': f'{name.lower()}@example.com', 'password': 'pw'})
+    _login_admin(client)
+    client.post('/admin_dashboard', data={'student_id': 2, 'module_name': 'Math', 'grade': 14, 'absences': 1})
+    client.post('/admin_dashboard', data={'student_id': 2, 'module_name': 'Physics', 'grade': 8, 'absences': 0})
+    client.get('/admin_dashboard')  # consume the flash message
+
+    first = client.get('/admin_dashboard?page_size=2').get_data(as_text=True)
+    assert 'alice@example.com' in first and 'bob@example.com' in first
+    assert 'carol@example.com' not in first
+    assert 'after_name=Bob' in first
+
+    second = client.get('/admin_dashboard?page_size=2&after_name=Bob&after_id=3').get_data(as_text=True)
+    assert 'carol@example.com' in second and 'alice@example.com' not in second
+
+    # The grade form picks students through the search API, not from the visible page
+    assert 'id="student_lookup"' in first and '<select id="student_id"' not in first
+    carol = client.get('/api/search?kind=student&q=car').get_json()['students'][0]
+    assert carol['id'] == 1
+    client.post('/admin_dashboard', data={'student_id': carol['id'], 'module_name': 'Art', 'grade': 12, 'absences': 0})
+    assert [module['name'] for module in client.get('/api/admin/students/1/modules').get_json()] == ['Art']
+    missing = client.post('/admin_dashboard', data={'student_id': '', 'module_name': 'Art', 'grade': 12, 'absences': 0},
+                          follow_redirects=True)
+    assert 'Please choose a student' in missing.get_data(as_text=True)
+
+    modules = client.get('/api/admin/students/2/modules?module=Math').get_json()
+    assert modules == [{'name': 'Math', 'grade': 14.0, 'status': 'Admis', 'teacher': '',
+                        'year': '2024-2025', 'semester': '1', 'absences': 1}]
+
+def test_search_index_follows_writes_and_backs_filters(tmp_path):
+    """The FTS index tracks students and grade terms and drives typeahead and filters"""
+    school_app, client = _make_client(tmp_path)
+    client.post('/register', data={'name': 'Zoé Martin', 'email': 'zoe@example.com', 'password': 'pw'})
+    client.post('/register', data={'name': 'Bob Durand', 'email': 'bob@example.com', 'password': 'pw'})
+    _login_admin(client)
+    client.post('/admin_dashboard', data={'student_id': 1, 'module_name': 'Mathematics', 'grade': 12,
+                                          'absences': 0, 'teacher_name': 'Dr. Smith'})
+    client.post('/admin_dashboard', data={'student_id': 2, 'module_name': 'Physics', 'grade': 9,
+                                          'absences': 0, 'teacher_name': 'Dr. Jones'})
+    client.get('/admin_dashboard')  # consume the flash message
+
+    found = client.get('/api/search?q=zoe').get_json()
+    assert [student['email'] for student in found['students']] == ['zoe@example.com']
+    assert client.get('/api/search?q=math&kind=module').get_json()['modules'] == [{'name': 'Mathematics', 'count': 1}]
+
+    page = client.get('/admin_dashboard?module=math').get_data(as_text=True)
+    assert 'zoe@example.com' in page and 'bob@example.com' not in page
+    page = client.get('/admin_dashboard?student=bob').get_data(as_text=True)
+    assert 'bob@example.com' in page and 'zoe@example.com' not in page
+
+    # Re-grading with another teacher retires the old teacher term
+    client.post('/admin_dashboard', data={'student_id': 2, 'module_name': 'Physics', 'grade': 11,
+                                          'absences': 0, 'teacher_name': 'Dr. Brown'})
+    teachers = client.get('/api/search?q=dr&kind=teacher').get_json()['teachers']
+    assert sorted(teacher['name'] for teacher in teachers) == ['Dr. Brown', 'Dr. Smith']
+
+    # Dropdown values with punctuation match exactly instead of widening to a prefix
+    client.post('/admin_dashboard', data={'student_id': 2, 'module_name': 'C++', 'grade': 14, 'absences': 0})
+    client.post('/admin_dashboard', data={'student_id': 1, 'module_name': 'Chemistry', 'grade': 14, 'absences': 0})
+    client.get('/admin_dashboard')  # consume the flash message
+    page = client.get('/admin_dashboard?module=C%2B%2B').get_data(as_text=True)
+    assert 'bob@example.com' in page and 'zoe@example.com' not in page
+    page = client.get('/admin_dashboard?teacher=Dr.+Brown').get_data(as_text=True)
+    assert 'bob@example.com' in page and 'zoe@example.com' not in page
+
+def test_filter_facets_are_counted_on_write(tmp_path):
+    """Dropdown facets come from the catalogue with per-value row counts"""
+    school_app, client = _make_client(tmp_path)
+    for name in ('Alice', 'Bob'):
+        client.post('/register', data={'name': name, 'email': f'{name.lower()}@example.com', 'password': 'pw'})
+    _login_admin(client)
+    for student_id, semester in ((1, '1'), (2, '1'), (2, '2')):
+        client.post('/admin_dashboard', data={'student_id': student_id, 'module_name': 'Math', 'grade': 12,
+                                              'absences': 0, 'teacher_name': 'Dr. Smith', 'semester': semester})
+
+    conn = sqlite3.connect(str(tmp_path / 'school.db'))
+    conn.execute("UPDATE grades SET academic_year = '2023-2024' WHERE student_id = 1")
+    conn.commit()
+    facets = school_app.get_filter_facets(conn)
+    conn.close()
+
+    assert facets['academic_year'] == [('2023-2024', 1), ('2024-2025', 2)]
+    assert facets['semester'] == [('1', 2), ('2', 1)]
+    assert facets['module'] == [('Math', 3)]
+    assert facets['teacher'] == [('Dr. Smith', 3)]
+    assert client.get('/api/search?q=2024').get_json() == {'students': [], 'modules': [], 'teachers': []}
+
+def test_api_me_returns_the_signed_in_students_profile(tmp_path):
+    """/api/me builds the dashboard payload per student and revalidates with an ETag"""
+    school_app, client = _make_client(tmp_path)
+    for name in ('Alice', 'Bob'):
+        client.post('/register', data={'name': name, 'email': f'{name.lower()}@example.com', 'password': 'pw'})
+    _login_admin(client)
+    assert client.get('/api/me').status_code == 403
+    for academic_year, semester, grade in (('2023-2024', '2', 8), ('2024-2025', '1', 14), ('2024-2025', '1', 12)):
+        client.post('/admin_dashboard', data={'student_id': 1, 'module_name': f'M{grade}', 'grade': grade,
+                                              'absences': 2, 'academic_year': academic_year, 'semester': semester})
+
+    client.post('/login', data={'email': 'alice@example.com', 'password': 'pw'})
+    client.get('/student_dashboard')  # consume the flash message
+    response = client.get('/api/me')
+    profile = response.get_json()
+    assert profile['name'] == 'Alice'
+    assert profile['total_absences'] == 6
+    assert profile['avg_grade'] == 34 / 3
+    assert (profile['ranking'], profile['total_students']) == (1, 2)
+    assert profile['evolution'] == [{'period': '2023-2024 S2', 'avg_grade': 8.0, 'success_rate': 0.0},
+                                    {'period': '2024-2025 S1', 'avg_grade': 13.0, 'success_rate': 100.0}]
+    assert client.get('/api/me', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    client.post('/login', data={'email': 'bob@example.com', 'password': 'pw'})
+    other = client.get('/api/me').get_json()
+    assert other['name'] == 'Bob' and other['grades'] == [] and other['ranking'] == 2
+
+    # A session whose user row was deleted is signed out instead of failing
+    conn = sqlite3.connect(str(tmp_path / 'school.db'))
+    conn.execute("DELETE FROM users WHERE email = 'bob@example.com'")
+    conn.commit()
+    conn.close()
+    assert client.get('/api/me').status_code == 404
+    response = client.get('/student_dashboard')
+    assert response.status_code == 302 and response.headers['Location'].endswith('/login')
+    with client.session_transaction() as sess:
+        assert 'user_id' not in sess
+
+def test_grade_cube_serves_analytics_slices(tmp_path):
+    """The rollup cube follows grade/absence writes and answers drill-down queries"""
+    school_app, client = _make_client(tmp_path)
+    for name in ('Alice', 'Bob'):
+        client.post('/register', data={'name': name, 'email': f'{name.lower()}@example.com', 'password': 'pw'})
+    _login_admin(client)
+    for student_id, module_name, grade, absences, academic_year in ((1, 'Math', 8, 3, '2023-2024'),
+                                                                  (1, 'Math', 14, 1, '2024-2025'),
+                                                                  (2, 'Math', 12, 5, '2024-2025'),
+                                                                  (2, 'Physics', 9, 2, '2024-2025')):
+        client.post('/admin_dashboard', data={'student_id': student_id, 'module_name': module_name, 'grade': grade,
+                                              'absences': absences, 'teacher_name': 'Dr. Smith',
+                                              'academic_year': academic_year})
+    # Re-grading moves the grade between cells; absences follow their grade
+    client.post('/admin_dashboard', data={'student_id': 2, 'module_name': 'Physics', 'grade': 11, 'absences': 4,
+                                          'teacher_name': 'Dr. Jones', 'academic_year': '2024-2025'})
+    client.get('/admin_dashboard')  # consume the flash message
+
+    cells = client.get('/api/analytics/rollup?group_by=module_name,teacher_name&academic_year=2024-2025').get_json()
+    assert cells == [
+        {'module_name': 'Math', 'teacher_name': 'Dr. Smith', 'avg_grade': 13.0, 'grade_count': 2,
+         'pass_count': 2, 'absence_total': 6},
+        {'module_name': 'Physics', 'teacher_name': 'Dr. Jones', 'avg_grade': 11.0, 'grade_count': 1,
+         'pass_count': 1, 'absence_total': 4},
+    ]
+    assert client.get('/api/performance_evolution?module=Math').get_json() == [
+        {'period': '2023-2024 S1', 'avg_grade': 8.0, 'success_rate': 0.0},
+        {'period': '2024-2025 S1', 'avg_grade': 13.0, 'success_rate': 100.0},
+    ]
+    assert client.get('/api/analytics/rollup?group_by=student_id').status_code == 400
+
+    conn = sqlite3.connect(str(tmp_path / 'school.db'))
+    cube = conn.execute('SELECT * FROM grade_cube ORDER BY 1, 2, 3, 4').fetchall()
+    school_app.rebuild_grade_cube(conn)
+    assert conn.execute('SELECT * FROM grade_cube ORDER BY 1, 2, 3, 4').fetchall() == cube
+    conn.close()
+
+def test_grade_statistics_match_reference_computations(tmp_path):
+    """Vectorised group statistics agree with per-group NumPy results and real pass rates"""
+    import numpy as np
+    school_app, client = _make_client(tmp_path)
+    for name in ('Alice', 'Bob', 'Carol'):
+        client.post('/register', data={'name': name, 'email': f'{name.lower()}@example.com', 'password': 'pw'})
+    _login_admin(client)
+    grades = {'Math': [4, 12, 17], 'Physics': [9.5, 10, 11]}
+    for module_name, module_grades in grades.items():
+        for student_id, grade in enumerate(module_grades, 1):
+            client.post('/admin_dashboard', data={'student_id': student_id, 'module_name': module_name,
+                                                  'grade': grade, 'absences': 0, 'teacher_name': 'Dr. Smith'})
+    client.get('/admin_dashboard')  # consume the flash message
+
+    stats = client.get('/api/analytics/statistics?group_by=module_name').get_json()
+    everything = np.array(grades['Math'] + grades['Physics'])
+    assert stats['overall']['count'] == 6
+    assert stats['overall']['pass_rate'] == round(4 / 6 * 100, 1)
+    assert stats['overall']['percentiles']['p50'] == round(float(np.median(everything)), 2)
+    assert sum(bucket['count'] for bucket in stats['overall']['histogram']) == 6
+
+    math, physics = stats['groups']['module_name']
+    assert (math['name'], math['median'], math['std']) == ('Math', 12.0, round(float(np.std(grades['Math'])), 2))
+    assert math['pass_rate'] == round(2 / 3 * 100, 1)
+    assert physics['z_score'] == round(float((np.mean(grades['Physics']) - everything.mean()) / everything.std()), 2)
+
+    # The module table reports real pass rates instead of average / 20
+    page = client.get('/analytics').get_data(as_text=True)
+    assert '66.7%' in page and '55.0%' not in page
+    assert client.get('/api/analytics/statistics?group_by=password').status_code == 400
+
+def test_batch_risk_api_matches_single_student_lookups(tmp_path):
+    """The batch endpoint agrees with /api/student_risk/<id> for ids, filters and NDJSON"""
+    school_app, client = _make_client(tmp_path)
+    for i in range(6):
+        client.post('/register', data={'name': f'S{i}', 'email': f's{i}@example.com', 'password': 'pw'})
+    _login_admin(client)
+    for student_id in range(1, 6):
+        client.post('/admin_dashboard', data={'student_id': student_id, 'module_name': 'Math',
+                                              'grade': student_id * 3, 'absences': student_id * 4})
+        client.post('/admin_dashboard', data={'student_id': student_id, 'module_name': 'Physics', 'grade': 10,
+                                              'absences': 0, 'academic_year': '2023-2024'})
+    client.get('/admin_dashboard')  # consume the flash message
+
+    batch = client.post('/api/student_risk/batch', json={'ids': [2, 4, 99]}).get_json()
+    assert [record['student_id'] for record in batch] == [2, 4]
+    for record in batch:
+        single = client.get(f"/api/student_risk/{record['student_id']}").get_json()
+        for field in ('risk_level', 'ranking', 'total_students', 'evolution_data'):
+            assert record[field] == single[field]
+        assert abs(record['avg_grade'] - single['avg_grade']) < 1e-9
+
+    high = client.get('/api/student_risk/batch?risk=high').get_json()
+    assert [record['student_id'] for record in high] == [3]
+    assert len(client.get('/api/student_risk/batch?academic_year=2023-2024').get_json()) == 5
+
+    streamed = client.get('/api/student_risk/batch?format=ndjson')
+    assert streamed.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in streamed.get_data(as_text=True).splitlines()]
+    assert [record['student_id'] for record in lines] == [1, 2, 3, 4, 5, 6]
+
+    with school_app.app.app_context():
+        query, params = school_app.student_cohort_query()
+        chunked = list(school_app.iter_student_risks(school_app.get_db(), query, params, chunk_size=2))
+    assert chunked == lines
+    assert client.post('/api/student_risk/batch', json={'ids': ['x']}).status_code == 400
+
+    # A bare JSON list is a list of ids; other non-object bodies are rejected
+    assert client.post('/api/student_risk/batch', json=[2, 4]).get_json() == batch
+    for body in ('2', '"ids"', '[1, "x"]'):
+        response = client.post('/api/student_risk/batch', data=body, content_type='application/json')
+        assert response.status_code == 400 and 'error' in response.get_json()
+
+def test_report_cards_render_in_process_pool_and_stream_as_zip(tmp_path):
+    """Report cards come back in cohort order as one PDF per student, streamed or as a job"""
+    import io
+    import time
+    import zipfile
+    school_app, client = _make_client(tmp_path)
+    school_app.app.config.update(REPORTS_DIR=str(tmp_path / 'reports'), REPORT_CARD_WORKERS=1)
+    for i in range(3):
+        client.post('/register', data={'name': f'S{i}', 'email': f's{i}@example.com', 'password': 'pw'})
+    _login_admin(client)
+    for student_id in (1, 2, 3):
+        client.post('/admin_dashboard', data={'student_id': student_id, 'module_name': 'Math',
+                                              'grade': student_id * 5, 'absences': 0})
+    client.get('/admin_dashboard')  # consume the flash message
+
+    streamed = client.get('/export_report_cards')
+    assert streamed.mimetype == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(streamed.data)) as archive:
+        assert archive.namelist() == ['00001_S0.pdf', '00002_S1.pdf', '00003_S2.pdf']
+        assert all(archive.read(name).startswith(b'%PDF') for name in archive.namelist())
+
+    queued = client.get('/export_report_cards?risk=medium&async=1')
+    assert queued.status_code == 202
+    job = queued.get_json()
+    for _ in range(100):
+        job = client.get(job['status_url']).get_json()
+        if job['status'] in ('done', 'failed'):
+            break
+        time.sleep(0.1)
+    assert job['status'] == 'done', job
+    with zipfile.ZipFile(io.BytesIO(client.get(job['download_url']).data)) as archive:
+        assert archive.namelist() == ['00001_S0.pdf']
+    assert client.get('/export_report_cards?ids=x').status_code == 400
+
+def test_pdf_tables_size_columns_from_data_and_repeat_headers(tmp_path):
+    """Tables are sized from sampled values and restart with their header on each page"""
+    school_app, _ = _make_client(tmp_path)
+    pdf = school_app.ReportPDF()
+    pdf.set_compression(False)
+    pdf.add_page()
+    rows = [[f'Student {i}', f'student{i}.with.a.long.address@example.com', None] for i in range(200)]
+    widths = pdf.column_widths(['Name', 'Email', 'Grade'], [row[:2] + ['N/A'] for row in rows[:10]])
+    assert widths[1] > widths[0] > widths[2] and abs(sum(widths) - pdf.epw) < 1e-6
+
+    pdf.data_table(['Name', 'Email', 'Grade'], iter(rows))
+    content = bytes(pdf.output()).decode('latin-1')
+    assert pdf.page_no() > 1
+    assert content.count('(Email) Tj') == pdf.page_no()
+    assert all(f'(Student {i}) Tj' in content for i in range(200))
+    assert content.count('(N/A) Tj') == 200
+
+def test_exports_are_cached_on_disk_per_data_version(tmp_path):
+    """Repeat exports are served from the on-disk cache until the data changes"""
+    school_app, client = _make_client(tmp_path)
+    reports = tmp_path / 'reports'
+    school_app.app.config['REPORTS_DIR'] = str(reports)
+    client.post('/register', data={'name': 'Alice', 'email': 'alice@example.com', 'password': 'pw'})
+    _login_admin(client)
+
+    first = client.get('/export_data?format=csv')
+    assert 'Last-Modified' not in first.headers
+    body = first.get_data()
+    cached = client.get('/export_data?format=csv')
+    assert 'Last-Modified' in cached.headers and cached.mimetype == 'text/csv'
+    assert cached.get_data() == body
+    assert len(list(reports.glob('*.csv'))) == 1
+
+    excel = client.get('/export_data?format=excel').get_data()
+    assert client.get('/export_data?format=excel').get_data() == excel
+
+    # A write moves the data version, so the next export is regenerated
+    client.post('/register', data={'name': 'Bob', 'email': 'bob@example.com', 'password': 'pw'})
+    _login_admin(client)
+    fresh = client.get('/export_data?format=csv')
+    assert 'Last-Modified' not in fresh.headers and b'Bob' in fresh.get_data()
+
+    # A background export of data that was already exported finishes immediately
+    cache = school_app.get_export_cache()
+    with school_app.app.app_context():
+        key = school_app.export_cache_key('pdf', {}, school_app.get_data_version(school_app.get_db()))
+    cache.put(key, 'pdf', lambda part: open(part, 'wb').write(b'%PDF cached'))
+    job = client.get('/export_data?format=pdf').get_json()
+    assert job['status'] == 'done'
+    assert client.get(job['download_url']).data == b'%PDF cached'
+
+    # Least recently used files go first once the cache is over its size budget
+    for age, path in enumerate(sorted(reports.iterdir())):
+        os.utime(path, (age, age))
+    assert cache.get(key, 'pdf') is not None  # a hit makes the file most recent
+    cache.max_bytes = len(b'%PDF cached')
+    cache.evict()
+    assert [path.suffix for path in reports.iterdir()] == ['.pdf']
+
+def test_warm_up_primes_worker_connections_and_caches(tmp_path):
+    """A warmed-up worker has idle pooled connections and the overall ranking cached"""
+    school_app, client = _make_client(tmp_path)
+    client.post('/register', data={'name': 'Alice', 'email': 'alice@example.com', 'password': 'pw'})
+    school_app._ranking_cache.clear()
+
+    school_app.warm_up(connections=3)
+    assert school_app.get_pool()._idle.qsize() >= 3
+    assert (None, None, None, None) in school_app._ranking_cache
+
+def test_write_queue_groups_writes_and_isolates_failures(tmp_path):
+    """Queued writes share one transaction; a failing write is rolled back on its own"""
+    import threading
+    school_app, client = _make_client(tmp_path)
+    writes = school_app.WriteQueue(school_app.app.config['DATABASE'])
+    insert = lambda cursor, email: cursor.execute(
+        "INSERT INTO users (name, email, password, role) VALUES ('S', ?, 'pw', 'student')", (email,)).lastrowid
+    try:
+        # Hold the writer so the next submissions pile up behind it
+        release = threading.Event()
+        blocker = writes.submit(lambda cursor: release.wait())
+        futures = [writes.submit(insert, f's{i}@example.com') for i in range(20)]
+        release.set()
+        blocker.result(timeout=5)
+        assert len({future.result(timeout=5) for future in futures}) == 20
+        assert writes.transactions <= 2
+
+        # s0@example.com is taken: that write fails, the rest of its group still commits
+        release = threading.Event()
+        blocker = writes.submit(lambda cursor: release.wait())
+        futures = [writes.submit(insert, f's{i}@example.com') for i in (0, 20, 21)]
+        release.set()
+        try:
+            futures[0].result(timeout=5)
+            assert False, 'expected the duplicate email to be rejected'
+        except school_app.sqlite3.IntegrityError:
+            pass
+        assert futures[1].result(timeout=5) and futures[2].result(timeout=5)
+    finally:
+        writes.close()
+
+    # Registration goes through the writer and still rejects taken emails
+    client.post('/register', data={'name': 'Alice', 'email': 's1@example.com', 'password': 'pw'})
+    with school_app.app.app_context():
+        assert school_app.get_db().execute("SELECT COUNT(*) FROM users WHERE role = 'student'").fetchone()[0] == 22
+
+def test_risk_levels_are_configurable_and_drive_every_risk_view(tmp_path):
+    """Edited risk levels re-derive stored levels and feed analytics, filters and the cache"""
+    school_app, client = _make_client(tmp_path)
+    for i in range(3):
+        client.post('/register', data={'name': f'S{i}', 'email': f's{i}@example.com', 'password': 'pw'})
+    _login_admin(client)
+    for student_id, grade, absences in ((1, 5, 12), (2, 7, 4), (3, 15, 0)):
+        client.post('/admin_dashboard', data={'student_id': student_id, 'module_name': 'Math',
+                                              'grade': grade, 'absences': absences})
+    client.get('/admin_dashboard')  # consume the flash message
+
+    def stored_levels():
+        with school_app.app.app_context():
+            return dict(school_app.get_db().execute('SELECT student_id, risk_level FROM student_summary').fetchall())
+
+    # The defaults reproduce the former hard-coded rules
+    defaults = client.get('/api/admin/risk_thresholds').get_json()
+    assert [(level['risk_level'], level['rule']) for level in defaults] == [('high', 'all'), ('medium', 'any')]
+    assert stored_levels() == {1: 'high', 2: 'medium', 3: 'low'}
+
+    with school_app.app.app_context():
+        cached = school_app.get_risk_thresholds(school_app.get_db())
+        assert school_app.get_risk_thresholds(school_app.get_db()) is cached
+
+    levels = [
+        {'risk_level': 'critical', 'min_grade': 6, 'max_absences': 10, 'rule': 'all', 'severity': 3},
+        {'risk_level': 'watch', 'min_grade': 8, 'max_absences': 3, 'rule': 'any', 'severity': 1},
+    ]
+    response = client.put('/api/admin/risk_thresholds', json=levels)
+    assert [level['risk_level'] for level in response.get_json()] == ['critical', 'watch']
+    assert stored_levels() == {1: 'critical', 2: 'watch', 3: 'low'}
+    with school_app.app.app_context():
+        assert school_app.get_risk_thresholds(school_app.get_db()) is not cached
+        school_app.rebuild_student_summary(school_app.get_db())
+    assert stored_levels() == {1: 'critical', 2: 'watch', 3: 'low'}
+
+    page = client.get('/analytics').get_data(as_text=True)
+    assert 'Critical' in page and 'Watch' in page
+    assert 'value="watch"' in client.get('/admin_dashboard').get_data(as_text=True)
+    assert [record['student_id'] for record in client.get('/api/student_risk/batch?risk=watch').get_json()] == [2]
+
+    assert client.put('/api/admin/risk_thresholds', json=[{'risk_level': 'low', 'min_grade': 5,
+                                                          'max_absences': 1, 'severity': 1}]).status_code == 400
+    assert client.put('/api/admin/risk_thresholds', json=levels + [dict(levels[0], risk_level='x')]).status_code == 400
+
+def test_metrics_expose_request_query_and_template_timings(tmp_path, caplog):
+    """/metrics reports per-route SQL statement counts that do not grow with the page size"""
+    import re
+    school_app, client = _make_client(tmp_path)
+    for i in range(30):
+        client.post('/register', data={'name': f'S{i:02}', 'email': f's{i}@example.com', 'password': 'pw'})
+    _login_admin(client)
+    client.post('/admin_dashboard', data={'student_id': 1, 'module_name': 'Math', 'grade': 8, 'absences': 2})
+    client.get('/admin_dashboard')  # consume the flash message
+    school_app.metrics.clear()
+
+    def sample(text, series):
+        match = re.search('^' + re.escape(series) + r' (\S+)$', text, re.M)
+        return float(match.group(1)) if match else None
+
+    client.get('/admin_dashboard?page_size=5')
+    client.get('/admin_dashboard?page_size=30')
+    school_app.app.config['SLOW_QUERY_SECONDS'] = 0
+    try:
+        with caplog.at_level('WARNING'):
+            client.get('/export_data?format=csv').get_data()
+    finally:
+        school_app.app.config['SLOW_QUERY_SECONDS'] = None
+
+    response = client.get('/metrics')
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    text = response.get_data(as_text=True)
+    assert sample(text, 'http_request_duration_seconds_count{endpoint="admin_dashboard",method="GET",status="200"}') == 2
+    assert sample(text, 'http_request_sql_statements_bucket{endpoint="admin_dashboard",le="+Inf"}') == 2
+    assert sample(text, 'http_request_sql_statements_sum{endpoint="admin_dashboard"}') <= 2 * 10
+    assert sample(text, 'http_request_sql_rows_total{endpoint="admin_dashboard"}') >= 35
+    assert sample(text, 'sql_query_rows_total{query="export_query"}') == 30
+    assert sample(text, 'template_render_seconds_count{template="admin_dashboard.html"}') == 2
+    assert any('Slow query export_query in export_data' in message for message in caplog.messages)
+
+def test_metrics_add_up_across_worker_processes(tmp_path):
+    """Workers publish their series to METRICS_DIR and any of them reports the totals"""
+    import re
+    school_app, client = _make_client(tmp_path)
+    workers = []
+    for requests, seconds in ((3, 0.02), (2, 0.3)):
+        worker = school_app.Metrics()
+        worker.counter('rows_total', 'Rows', ('query',))
+        worker.histogram('duration_seconds', 'Duration', ('query',))
+        for _ in range(requests):
+            worker.inc('rows_total', ('grades',), 10)
+            worker.observe('duration_seconds', ('grades',), seconds)
+        workers.append(worker)
+    workers[1].inc('rows_total', ('users',))
+
+    directory = tmp_path / 'metrics'
+    school_app.reset_metrics_dir(str(directory))
+    workers[0].publish(str(directory), worker=101)
+    workers[0].publish(str(directory), worker=101)  # republishing replaces the worker's file
+    workers[1].publish(str(directory), worker=102)
+    text = workers[1].render(workers[1].collect(str(directory), worker=102))
+    assert 'rows_total{query="grades"} 50\n' in text
+    assert 'rows_total{query="users"} 1\n' in text
+    assert 'duration_seconds_bucket{query="grades",le="0.025"} 3\n' in text
+    assert 'duration_seconds_count{query="grades"} 5\n' in text
+    assert workers[0].render() != text  # each process still reports only itself without a directory
+
+    # /metrics adds the other workers' published series to those of the worker answering
+    _login_admin(client)
+    school_app.metrics.clear()
+    other = school_app.Metrics()
+    other.histogram('http_request_duration_seconds', 'Duration', ('endpoint', 'method', 'status'))
+    for _ in range(4):
+        other.observe('http_request_duration_seconds', ('admin_dashboard', 'GET', '200'), 0.01)
+    other.publish(str(directory), worker='other')
+    school_app.app.config['METRICS_DIR'] = str(directory)
+    try:
+        client.get('/admin_dashboard')
+        text = client.get('/metrics').get_data(as_text=True)
+        assert re.search(r'^http_request_duration_seconds_count\{endpoint="admin_dashboard",method="GET",'
+                         r'status="200"\} 5$', text, re.M)
+        assert any(path.name == f'metrics-{os.getpid()}.json' for path in directory.iterdir())
+    finally:
+        school_app.app.config['METRICS_DIR'] = None
+    school_app.reset_metrics_dir(str(directory))
+    assert list(directory.iterdir()) == []
+
+def test_benchmark_generates_seeded_data_and_reports_route_latencies(tmp_path):
+    """The synthetic dataset is reproducible and the harness reports every route it drives"""
+    import benchmark
+    rows = []
+    for name in ('a.db', 'b.db'):
+        size = benchmark.generate_dataset(str(tmp_path / name), grades=500, years=2, seed=7, log=lambda message: None)
+        conn = sqlite3.connect(str(tmp_path / name))
+        rows.append(conn.execute('SELECT student_id, module_name, grade, academic_year, semester FROM grades '
+                                 'ORDER BY id').fetchall())
+        conn.close()
+    assert rows[0] == rows[1]
+    assert size['grades'] == 500 and size['students'] == 21 and size['absences'] > 0
+
+    report = benchmark.run_benchmark(str(tmp_path / 'a.db'), ['admin_dashboard', 'student_dashboard', 'export_csv'],
+                                     requests=6, concurrency=2, log=lambda message: None)
+    assert report['dataset'] == size
+    for result in report['routes'].values():
+        assert result['requests'] == 6 and result['errors'] == 0
+        assert 0 < result['p50_ms'] <= result['p99_ms']
+        assert result['sql_per_request'] is not None
+    assert benchmark.compare_reports(report, report, log=lambda message: None) == []
+
+    slower = json.loads(json.dumps(report))
+    slower['routes']['export_csv']['p99_ms'] *= 2
+    assert benchmark.compare_reports(slower, report, log=lambda message: None) == ['export_csv']
+
 if __name__ == "__main__":
     print("Flask School Management System - Setup Test")
     print("=" * 50)